@@ -1,87 +1,156 @@
 import os
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
 import joblib
-from financial import make_financial_path
+from financial import load_panel
+from matrix import append_matrix, has_matrix, write_matrix
+from storing import make_store
 
-def make_aggregated_path(days: int):
-    return os.path.join("data/files/aggregated/", str(days), f"aggregate.csv")
+categories = 20
+seconds_per_day = 60 * 60 * 24
+# a mention is counted for its event up to a week after the event day
+mention_days = 7
+
+aggregate_columns = ["Time", "EventBaseCode", "GoldsteinScale", "MentionsCount", "WordCount", "Negative", "Positive", "Finance"]
 
 def make_scaler_path(days: int):
     return os.path.join("data/files/aggregated/", str(days), f"scaler.joblib.gz")
 
-def aggregate(names: list[str], days: int):
-    financials = {}
-    for name in names:
-        df = pd.read_csv(make_financial_path(name, is_raw=False))
-        df["Timestamp"] = pd.to_datetime(df["Date"]).dt.normalize().astype(int).div(1000000000).astype(int)
-        df[name] = df["CloseToClose"]
-        df = df[["Timestamp", "CloseToClose"]]
-        financials[name] = df
-
-    directory = os.path.abspath("data/files/collected")
-    files = os.listdir(directory)
+def make_columns() -> list[str]:
+    columns = [element for row in [[f"{i}_total_mentions", f"{i}_goldstein", f"{i}_positive", f"{i}_negative", f"{i}_finance"] for i in range(1, categories + 1)] for element in row]
+    columns.append("Timestamp")
+    return columns
+
+mention_columns = [f"{i}_total_mentions" for i in range(1, categories + 1)]
+
+def daily_sums(events: pd.DataFrame, start: int, total_days: int) -> dict[str, np.ndarray]:
+    day = (events["Timestamp"].to_numpy() - start) // seconds_per_day
+    category = events["EventBaseCode"].to_numpy()
+    keep = (day >= 0) & (day < total_days) & (category >= 1) & (category <= categories)
+    cell = day[keep] * categories + (category[keep] - 1)
+
+    mentions = events["MentionsCount"].to_numpy(dtype=np.float64)[keep]
+    goldstein = events["GoldsteinScale"].add(10).mul(10).to_numpy(dtype=np.float64)[keep]
+    # Goldstein scores have one decimal, so summing whole tenths keeps every window sum exact, even from float32 scores
+    if np.allclose(goldstein, np.rint(goldstein), rtol=0, atol=1e-4):
+        goldstein = np.rint(goldstein)
+
+    weights = {
+        "mentions": mentions,
+        "goldstein": mentions * goldstein,
+        "words": events["WordCount"].to_numpy(dtype=np.float64)[keep],
+        "positive": events["Positive"].to_numpy(dtype=np.float64)[keep],
+        "negative": events["Negative"].to_numpy(dtype=np.float64)[keep],
+        "finance": events["Finance"].to_numpy(dtype=np.float64)[keep],
+    }
+
+    sums = {}
+    for name, weight in weights.items():
+        daily = np.bincount(cell, weights=weight, minlength=total_days * categories).reshape(total_days, categories)
+        sums[name] = np.concatenate([np.zeros((1, categories)), np.cumsum(daily, axis=0)])
+    return sums
+
+def window_features(events: pd.DataFrame, timestamps: np.ndarray, windows: list[int]) -> dict[int, dict[str, np.ndarray]]:
+    start = int(timestamps[0]) - max(windows) * seconds_per_day
+    total_days = (int(timestamps[-1]) - start) // seconds_per_day + 1
+    cumulative = daily_sums(events, start, total_days)
+    end = (timestamps - start) // seconds_per_day + 1
+
+    features = {}
+    for days in windows:
+        features[days] = {**window_ratios({name: values[end] - values[end - days] for name, values in cumulative.items()}), "timestamps": timestamps}
+    return features
+
+def window_ratios(sums: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    mentions, words = sums["mentions"], sums["words"]
+    return {
+        "mentions": mentions.astype(np.int64),
+        "goldstein": np.divide(sums["goldstein"], mentions * 200, out=np.full_like(mentions, 0.5), where=mentions > 0),
+        "positive": np.divide(sums["positive"], words, out=np.zeros_like(words), where=words > 0),
+        "negative": np.divide(sums["negative"], words, out=np.zeros_like(words), where=words > 0),
+        "finance": np.divide(sums["finance"], words, out=np.zeros_like(words), where=words > 0),
+        "words": words,
+    }
+
+def make_feature_frame(features: dict[str, np.ndarray], timestamps: np.ndarray) -> pd.DataFrame:
+    columns = make_columns()
+    data = {}
+    for i in range(categories):
+        # a category without any words anywhere only ever produced integer zeros
+        ratio_dtype = np.int64 if (features["words"][:, i] == 0).all() else np.float64
+        data[columns[i * 5]] = features["mentions"][:, i]
+        data[columns[i * 5 + 1]] = features["goldstein"][:, i]
+        data[columns[i * 5 + 2]] = features["positive"][:, i].astype(ratio_dtype)
+        data[columns[i * 5 + 3]] = features["negative"][:, i].astype(ratio_dtype)
+        data[columns[i * 5 + 4]] = features["finance"][:, i].astype(ratio_dtype)
+    data["Timestamp"] = timestamps.astype(np.int64)
+    return pd.DataFrame(data, columns=columns)
+
+def aggregate(names: list[str], days: int | list[int], storage: str = "csv", append: bool = False):
+    store = make_store(storage)
+    windows = [days] if isinstance(days, int) else list(days)
+
+    panel, _ = load_panel(names)
+    financials = panel[names].reset_index(drop=True)
+    financials.insert(0, "Timestamp", panel.index.normalize().as_unit("s").asi8)
+
+    files = store.list_collected()
 
     previous_collected_events = pd.DataFrame()
     previous_cutoff = pd.to_datetime("20200101")
 
-    aggregated = []
+    segments: dict[int, list[dict[str, np.ndarray]]] = {window: [] for window in windows}
 
-    for index, file in enumerate(files):
-        collected_events = pd.read_csv(os.path.join(directory, file))
-        collected_events["Time"] = pd.to_datetime(collected_events["Time"])
-        collected_events["Timestamp"] = collected_events["Time"].dt.normalize().astype(int).div(1000000000).astype(int)
+    for index, (year, quarter) in enumerate(files):
+        collected_events = store.read_collected(year, quarter, aggregate_columns)
+        # the store hands Time back as datetime64, so the day is integer arithmetic on its epoch
+        collected_events["Timestamp"] = collected_events["Time"].to_numpy().astype("datetime64[D]").astype("datetime64[s]").astype(np.int64)
         cutoff = collected_events["Time"].mean().normalize() if index != len(files) - 1 else collected_events["Time"].max().normalize()
         (previous_collected_events, collected_events) = (collected_events, pd.concat([previous_collected_events, collected_events]))
-        for date in pd.date_range(previous_cutoff, cutoff):
-            print(date)
-            timestamp = int(date.normalize().timestamp())
-            if collected_events["Timestamp"].le(timestamp).any():
-                previous = timestamp - (60 * 60 * 24 * days)
-                events = collected_events[collected_events["Timestamp"].between(previous, timestamp, inclusive="right")]
-
-                data = []
-                for category in range(1, 21):
-                    category_events = events[events["EventBaseCode"] == category]
-
-                    mentions = category_events["MentionsCount"].sum()
-                    goldstein = category_events["MentionsCount"].mul(category_events["GoldsteinScale"].add(10)).sum() / (mentions * 20) if mentions > 0 else 0.5
-
-                    words = category_events["WordCount"].sum()
-                    positive = category_events["Positive"].sum() / words if words > 0 else 0
-                    negative = category_events["Negative"].sum() / words if words > 0 else 0
-                    finance =  category_events["Finance"].sum()  / words if words > 0 else 0
-
-                    data.append(mentions)
-                    data.append(goldstein)
-                    data.append(positive)
-                    data.append(negative)
-                    data.append(finance)
-                data.append(timestamp)
-                aggregated.append(data)
-        previous_cutoff = cutoff + pd.Timedelta(days=1)
-
-    columns = [element for row in [[f"{i}_total_mentions", f"{i}_goldstein", f"{i}_positive", f"{i}_negative", f"{i}_finance"] for i in range(1, 21)] for element in row]
-    columns.append("Timestamp")
 
-    aggregated_df = pd.DataFrame(aggregated, columns=columns)
-    aggregated_df = aggregated_df.iloc[14:]
-    for name in names:
-        financial = financials[name]
-        aggregated_df = pd.merge(aggregated_df, financial, on="Timestamp", how="left")
-        aggregated_df.columns = [*aggregated_df.columns[:-1], name]
-    aggregated_df = aggregated_df.drop(columns=["Timestamp"])
-
-    mention_columns = [f"{i}_total_mentions" for i in range(1, 21)]
-
-    scaler = MinMaxScaler(feature_range=(0, 1))
-
-    aggregated_df[mention_columns] = scaler.fit_transform(aggregated_df[mention_columns])
-
-    aggregated_path = make_aggregated_path(days)
-    os.makedirs(os.path.dirname(aggregated_path), exist_ok=True)
-    aggregated_df.to_csv(aggregated_path, index=False)
+        dates = pd.date_range(previous_cutoff, cutoff)
+        timestamps = dates.normalize().asi8 // 1000000000
+        if len(collected_events) > 0:
+            timestamps = timestamps[timestamps >= collected_events["Timestamp"].min()]
+            if len(timestamps) > 0:
+                for window, features in window_features(collected_events, timestamps, windows).items():
+                    segments[window].append(features)
+        previous_cutoff = cutoff + pd.Timedelta(days=1)
 
-    scaler_path = make_scaler_path(days)
-    os.makedirs(os.path.dirname(scaler_path), exist_ok=True)
-    joblib.dump(scaler, scaler_path)
\ No newline at end of file
+    for window in windows:
+        features = {name: np.concatenate([segment[name] for segment in segments[window]]) if len(segments[window]) > 0 else np.zeros((0, categories)) for name in ["mentions", "goldstein", "positive", "negative", "finance", "words"]}
+        timestamps = np.concatenate([segment["timestamps"] for segment in segments[window]]) if len(segments[window]) > 0 else np.zeros(0, dtype=np.int64)
+
+        aggregated_df = make_feature_frame(features, timestamps)
+        aggregated_df = aggregated_df.iloc[14:]
+        aggregated_df = pd.merge(aggregated_df, financials, on="Timestamp", how="left")
+        start = aggregated_df["Timestamp"].iloc[0] if len(aggregated_df) > 0 else 0
+        aggregated_df = aggregated_df.drop(columns=["Timestamp"])
+
+        scaler_path = make_scaler_path(window)
+        if append and store.has_aggregated(window) and os.path.exists(scaler_path):
+            # rows are consecutive days from the first event, and the last days of the previous run were built
+            # before all of their mentions arrived, so they are recomputed along with the new days
+            existing = store.read_aggregated(window)
+            keep = max(0, len(existing) - (mention_days + 1))
+            aggregated_df = aggregated_df.iloc[keep:].copy()
+            scaler = joblib.load(scaler_path)
+            if len(aggregated_df) > 0:
+                aggregated_df[mention_columns] = scaler.transform(aggregated_df[mention_columns])
+            store.append_aggregated(aggregated_df, window, keep)
+            if has_matrix(window):
+                append_matrix(aggregated_df, window, keep)
+            else:
+                write_matrix(pd.concat([existing.iloc[:keep], aggregated_df]), window, start, names)
+            continue
+
+        scaler = MinMaxScaler(feature_range=(0, 1))
+
+        aggregated_df[mention_columns] = scaler.fit_transform(aggregated_df[mention_columns])
+
+        store.write_aggregated(aggregated_df, window)
+        write_matrix(aggregated_df, window, start, names)
+
+        os.makedirs(os.path.dirname(scaler_path), exist_ok=True)
+        joblib.dump(scaler, scaler_path)
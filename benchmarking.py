@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import masterlist
+from aggregating import aggregate
+from collecting import collect_all
+from downloading import download_all
+from executing import ResourceExecutor
+from financial import make_financial_path, process_all_financial_files
+from live import live
+from manifest import data_types
+from masterlist import download_masterlist, index_masterlist, query_masterlist, quarters_between
+from metrics import Metrics
+from parsing import details_cols, event_cols, extract_gcam, extract_gcam_columns, gcam_dimensions, mentions_cols
+from quarterizing import quarterize
+
+event_base_codes = ["010", "020", "036", "042", "051", "061", "071", "081", "090", "100", "111", "120", "130", "141", "150", "160", "172", "180", "190", "203"]
+goldstein_scale = [-10.0, -9.5, -7.2, -5.0, -2.2, -0.4, 0.0, 1.0, 1.9, 3.4, 4.0, 6.0, 7.0, 10.0]
+country_codes = ["US", "UK", "CH", "RS", "FR", "GM", "IN", "PL", "IS", "UP", ""]
+sources = ["reuters.com", "apnews.com", "bbc.co.uk", "nytimes.com", "theguardian.com", "aljazeera.com", "lemonde.fr", "spiegel.de"]
+
+
+def make_gcam(rng: random.Random) -> str:
+    dimensions = [f"wc:{rng.randint(50, 3000)}"]
+    for family in range(1, 25):
+        for dimension in range(1, rng.randint(2, 20)):
+            if rng.random() < 0.3:
+                dimensions.append(f"c{family}.{dimension}:{rng.randint(1, 50)}")
+    for family in range(1, 5):
+        for dimension in range(1, 4):
+            dimensions.append(f"v{family}.{dimension}:{rng.random():.3f}")
+    return ",".join(dimensions)
+
+def benchmark_gcam(rows: int = 20000, seed: int = 0) -> dict[str, float]:
+    rng = random.Random(seed)
+    gcam = pd.Series([make_gcam(rng) for _ in range(rows)])
+
+    start = time.perf_counter()
+    expected = gcam.apply(extract_gcam)
+    apply_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    extracted = extract_gcam_columns(gcam, gcam_dimensions)
+    vectorized_time = time.perf_counter() - start
+
+    if not (extracted.to_numpy() == expected.to_numpy()).all():
+        raise AssertionError("extract_gcam_columns does not match extract_gcam")
+
+    wide_dimensions = {**gcam_dimensions, **{f"c{family}.1": f"C{family}_1" for family in range(5, 17)}}
+    start = time.perf_counter()
+    extract_gcam_columns(gcam, wide_dimensions)
+    wide_time = time.perf_counter() - start
+
+    print(f"GCAM rows: {rows}")
+    print(f"extract_gcam (apply):            {apply_time:.3f}s")
+    print(f"extract_gcam_columns ({len(gcam_dimensions)} codes):  {vectorized_time:.3f}s ({apply_time / vectorized_time:.1f}x)")
+    print(f"extract_gcam_columns ({len(wide_dimensions)} codes): {wide_time:.3f}s")
+
+    return {"apply": apply_time, "vectorized": vectorized_time, "vectorized_wide": wide_time}
+
+def make_zip(text: str, name: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(name, text)
+    return buffer.getvalue()
+
+def make_url(rng: random.Random) -> str:
+    slug = "-".join(rng.choice(["market", "talks", "protest", "election", "summit", "strike", "court", "trade", "energy", "border"]) for _ in range(rng.randint(3, 7)))
+    return f"https://www.{rng.choice(sources)}/{rng.randint(2015, 2025)}/{rng.randint(1, 12):02d}/{slug}-{rng.getrandbits(40):x}.html"
+
+def make_event_lines(rng: random.Random, stamp: pd.Timestamp, ids: list[int]) -> str:
+    lines = []
+    for event_id in ids:
+        row = dict.fromkeys(event_cols, "")
+        code = rng.choice(event_base_codes)
+        date = stamp - pd.Timedelta(days=rng.choice([0, 0, 0, 1, 2, 7]))
+        row.update({
+            "GlobalEventID": str(event_id),
+            "SQLDATE": date.strftime("%Y%m%d"),
+            "MonthYear": date.strftime("%Y%m"),
+            "Year": date.strftime("%Y"),
+            "FractionDate": f"{date.year + date.dayofyear / 365:.4f}",
+            "Actor1Name": rng.choice(["UNITED STATES", "CHINA", "RUSSIA", "POLICE", "GOVERNMENT", ""]),
+            "IsRootEvent": str(rng.randint(0, 1)),
+            "EventCode": code + rng.choice(["", "0", "1"]),
+            "EventBaseCode": code if rng.random() > 0.01 else "---",
+            "EventRootCode": code[0:2],
+            "QuadClass": str(rng.randint(1, 4)),
+            "GoldsteinScale": str(rng.choice(goldstein_scale)),
+            "NumMentions": str(rng.randint(1, 20)),
+            "NumSources": "1",
+            "NumArticles": str(rng.randint(1, 20)),
+            "AvgTone": f"{rng.uniform(-10, 10):.6f}",
+            "ActionGeo_Type": str(rng.randint(1, 4)),
+            "ActionGeo_CountryCode": rng.choice(country_codes),
+            "ActionGeo_Lat": f"{rng.uniform(-60, 60):.4f}",
+            "ActionGeo_Long": f"{rng.uniform(-180, 180):.4f}",
+            "DATEADDED": stamp.strftime("%Y%m%d%H%M%S"),
+            "SOURCEURL": make_url(rng),
+        })
+        lines.append("\t".join(row.values()))
+    return "\n".join(lines) + "\n"
+
+def make_detail_lines(rng: random.Random, stamp: pd.Timestamp, documents: list[str]) -> str:
+    lines = []
+    for index, document in enumerate(documents):
+        row = dict.fromkeys(details_cols, "")
+        row.update({
+            "GKGRECORDID": f"{stamp.strftime('%Y%m%d%H%M%S')}-{index}",
+            "DATE": stamp.strftime("%Y%m%d%H%M%S"),
+            "SourceCollectionIdentifier": "1",
+            "SourceCommonName": document.split("/")[2].removeprefix("www."),
+            "DocumentIdentifier": document,
+            "V2Tone": f"{rng.uniform(-10, 10):.6f},{rng.uniform(0, 10):.6f},{rng.uniform(0, 10):.6f}",
+            "GCAM": make_gcam(rng) if rng.random() > 0.02 else "",
+        })
+        lines.append("\t".join(row.values()))
+    return "\n".join(lines) + "\n"
+
+def make_mention_lines(rng: random.Random, stamp: pd.Timestamp, ids: list[int], documents: list[str], mentions: int) -> str:
+    lines = []
+    for _ in range(mentions):
+        row = dict.fromkeys(mentions_cols, "")
+        document = rng.choice(documents) if rng.random() > 0.1 else make_url(rng)
+        row.update({
+            "GlobalEventID": str(rng.choice(ids)),
+            "SQLDATE": stamp.strftime("%Y%m%d%H%M%S"),
+            "MentionTimeDate": (stamp + pd.Timedelta(minutes=rng.randint(0, 14))).strftime("%Y%m%d%H%M%S"),
+            "MentionType": "1",
+            "MentionSourceName": document.split("/")[2].removeprefix("www."),
+            "MentionIdentifier": document,
+            "SentenceID": str(rng.randint(1, 30)),
+            "InRawText": "1",
+            "Confidence": str(rng.choice([10, 20, 50, 100])),
+            "MentionDocLen": str(rng.randint(500, 9000)),
+            "MentionDocTone": f"{rng.uniform(-10, 10):.6f}",
+        })
+        lines.append("\t".join(row.values()))
+    return "\n".join(lines) + "\n"
+
+def generate_files(start: str, end: str, interval: str = "15min", events: int = 100, mentions: int = 300, details: int = 150, seed: int = 0) -> dict[str, bytes]:
+    rng = random.Random(seed)
+    files = {}
+    next_id = 1000000000
+    recent: list[list[int]] = []
+    for stamp in pd.date_range(start, end, freq=interval, inclusive="left"):
+        name = stamp.strftime("%Y%m%d%H%M%S")
+        ids = list(range(next_id, next_id + events))
+        next_id += events
+        # mentions keep arriving for events from the previous day or so, like the real feed
+        recent = (recent + [ids])[-96:]
+        documents = [make_url(rng) for _ in range(details)]
+
+        files[f"{name}.export.CSV.zip"] = make_zip(make_event_lines(rng, stamp, ids), f"{name}.export.CSV")
+        files[f"{name}.mentions.CSV.zip"] = make_zip(make_mention_lines(rng, stamp, [event_id for batch in recent for event_id in batch], documents, mentions), f"{name}.mentions.CSV")
+        files[f"{name}.gkg.csv.zip"] = make_zip(make_detail_lines(rng, stamp, documents), f"{name}.gkg.csv")
+    return files
+
+def generate_financial(start: str, end: str, seed: int = 0) -> dict[str, pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    financials = {}
+    for name, price in [("spx", 4500.0), ("btc", 40000.0)]:
+        dates = pd.date_range(pd.Timestamp(start) - pd.Timedelta(days=30), pd.Timestamp(end) + pd.Timedelta(days=30), freq="D")[::-1]
+        prices = price * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+        financials[name] = pd.DataFrame({"Date": dates.strftime("%m/%d/%Y"), "Price": [f"{value:,.2f}" for value in prices]})
+    return financials
+
+def make_masterfilelist(files: dict[str, bytes], base_url: str) -> bytes:
+    lines = [f"{len(body)} {hashlib.md5(body).hexdigest()} {base_url}/{name}" for name, body in sorted(files.items())]
+    return ("\n".join(lines) + "\n").encode()
+
+def serve_mirror(files: dict[str, bytes], port: int = 0) -> ThreadingHTTPServer:
+    mirror = {}
+
+    class MirrorHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = mirror.get(self.path.removeprefix("/gdeltv2/"))
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MirrorHandler)
+    mirror.update(files)
+    mirror["masterfilelist.txt"] = make_masterfilelist(files, f"http://127.0.0.1:{server.server_address[1]}/gdeltv2")
+    mirror["lastupdate.txt"] = b""
+    server.mirror = mirror
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def publish_slice(server: ThreadingHTTPServer, name: str) -> None:
+    slice_files = {file: body for file, body in server.mirror.items() if file.startswith(f"{name}.")}
+    server.mirror["lastupdate.txt"] = make_masterfilelist(slice_files, f"http://127.0.0.1:{server.server_address[1]}/gdeltv2")
+
+async def run_pipeline(start: str, end: str, storage: str, engine: str, keys: str, metrics: Metrics, collect_engine: str = "pandas") -> dict[str, float]:
+    timings = {}
+
+    def _timed(stage: str, started: float) -> None:
+        timings[stage] = time.perf_counter() - started
+        print(f"{stage}: {timings[stage]:.3f}s")
+
+    started = time.perf_counter()
+    raw = download_masterlist()
+    _timed("download_masterlist", started)
+
+    started = time.perf_counter()
+    index = query_masterlist(index_masterlist(raw), start=start, end=end)
+    _timed("index_masterlist", started)
+
+    quarters = quarters_between(start, end)
+    with ResourceExecutor(metrics=metrics) as executor:
+        for masterlist_type, data_type in data_types.items():
+            started = time.perf_counter()
+            await download_all(index[index["type"] == masterlist_type], data_type, engine=engine, storage=storage, keys=keys, executor=executor)
+            _timed(f"download_{data_type}", started)
+
+        for data_type in data_types.values():
+            started = time.perf_counter()
+            await quarterize(quarters, data_type, storage=storage, executor=executor)
+            _timed(f"quarterize_{data_type}", started)
+
+        started = time.perf_counter()
+        await collect_all(quarters, storage=storage, keys=keys, executor=executor, engine=collect_engine)
+        _timed("collect", started)
+
+        started = time.perf_counter()
+        await process_all_financial_files(["spx", "btc"], executor=executor)
+        _timed("financial", started)
+
+    started = time.perf_counter()
+    aggregate(["spx", "btc"], days=[1, 2, 3, 5, 8, 13, 21], storage=storage)
+    _timed("aggregate", started)
+
+    return timings
+
+def benchmark_pipeline(start: str = "2024-01-01", end: str = "2024-02-01", interval: str = "1h", events: int = 100, mentions: int = 300, details: int = 150, storage: str = "csv", engine: str = "pyarrow", keys: str = "url", seed: int = 0, workdir: str | None = None, collect_engine: str = "pandas") -> dict[str, float]:
+    started = time.perf_counter()
+    files = generate_files(start, end, interval, events, mentions, details, seed)
+    print(f"Generated {len(files)} files ({sum(len(body) for body in files.values()) / 1024 ** 2:.1f} MB) in {time.perf_counter() - started:.3f}s")
+
+    # the pipeline works relative to data/, so a scratch directory keeps the benchmark away from real data
+    cwd = os.getcwd()
+    workdir = workdir or tempfile.mkdtemp(prefix="gdelt-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    server = serve_mirror(files)
+    url = masterlist.masterlist_url
+    masterlist.masterlist_url = f"http://127.0.0.1:{server.server_address[1]}/gdeltv2/masterfilelist.txt"
+    try:
+        for name, df in generate_financial(start, end, seed).items():
+            os.makedirs(os.path.dirname(make_financial_path(name, is_raw=True)), exist_ok=True)
+            df.to_csv(make_financial_path(name, is_raw=True), index=False)
+
+        metrics = Metrics()
+        timings = asyncio.run(run_pipeline(start, end, storage, engine, keys, metrics, collect_engine))
+        print("Report:", os.path.abspath(metrics.save(mode="benchmark", start=start, end=end, interval=interval, storage=storage, engine=engine, collect_engine=collect_engine, keys=keys, timings=timings)))
+    finally:
+        masterlist.masterlist_url = url
+        server.shutdown()
+        os.chdir(cwd)
+
+    print(f"Total: {sum(timings.values()):.3f}s")
+    return timings
+
+def benchmark_live(start: str = "2024-01-01", end: str = "2024-01-03", interval: str = "15min", events: int = 100, mentions: int = 300, details: int = 150, period: float = 0.5, storage: str = "csv", engine: str = "pyarrow", keys: str = "url", seed: int = 0, workdir: str | None = None) -> dict:
+    files = generate_files(start, end, interval, events, mentions, details, seed)
+    slices = sorted({name.split(".")[0] for name in files})
+    print(f"Generated {len(slices)} slices")
+
+    cwd = os.getcwd()
+    workdir = workdir or tempfile.mkdtemp(prefix="gdelt-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    server = serve_mirror(files)
+    url = masterlist.lastupdate_url
+    masterlist.lastupdate_url = f"http://127.0.0.1:{server.server_address[1]}/gdeltv2/lastupdate.txt"
+
+    # slices are published faster than the real 15 minutes, and the feed is polled ten times per slice
+    async def _run(metrics: Metrics) -> None:
+        with ResourceExecutor(workers=3, metrics=metrics) as executor:
+            following = asyncio.ensure_future(live(engine, storage, executor, keys, interval=period / 10, seed=False))
+            try:
+                for name in slices:
+                    publish_slice(server, name)
+                    await asyncio.sleep(period)
+                # the last slice may still be parsing, so the follower is only stopped once it stops reporting slices
+                done = -1
+                while (count := metrics.stages.get("live", {}).get("slices", 0)) != done:
+                    done = count
+                    await asyncio.sleep(max(period, 2.0))
+            finally:
+                following.cancel()
+                await asyncio.gather(following, return_exceptions=True)
+
+    try:
+        metrics = Metrics()
+        asyncio.run(_run(metrics))
+        report = metrics.report(mode="benchmark-live", start=start, end=end, interval=interval, period=period, storage=storage, engine=engine, keys=keys)
+        print("Report:", os.path.abspath(metrics.save(mode="benchmark-live", start=start, end=end, interval=interval, period=period, storage=storage, engine=engine, keys=keys)))
+    finally:
+        masterlist.lastupdate_url = url
+        server.shutdown()
+        os.chdir(cwd)
+
+    stage = report["stages"].get("live", {})
+    if stage.get("slices", 0) > 0:
+        print(f"Slices: {stage['slices']:.0f}, mean latency: {stage['latency_seconds'] / stage['slices']:.3f}s, peak latency: {stage['peak_latency_seconds']:.3f}s")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", nargs="?", default="gcam", choices=["gcam", "pipeline", "live"])
+    parser.add_argument("--start", default="2024-01-01")
+    parser.add_argument("--end", default="2024-02-01")
+    parser.add_argument("--interval", default="1h")
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--mentions", type=int, default=300)
+    parser.add_argument("--details", type=int, default=150)
+    parser.add_argument("--storage", default="csv", choices=["csv", "parquet"])
+    parser.add_argument("--engine", default="pyarrow", choices=["pandas", "pyarrow"])
+    parser.add_argument("--collect-engine", default="pandas", choices=["pandas", "pyarrow"])
+    parser.add_argument("--keys", default="url", choices=["url", "hash", "check"])
+    parser.add_argument("--period", type=float, default=0.5)
+    parser.add_argument("--workdir", default=None)
+    args = parser.parse_args()
+
+    if args.benchmark == "gcam":
+        benchmark_gcam()
+    elif args.benchmark == "live":
+        benchmark_live(args.start, args.end, "15min", args.events, args.mentions, args.details, args.period, args.storage, args.engine, args.keys, workdir=args.workdir)
+    else:
+        benchmark_pipeline(args.start, args.end, args.interval, args.events, args.mentions, args.details, args.storage, args.engine, args.keys, workdir=args.workdir, collect_engine=args.collect_engine)
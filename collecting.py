@@ -1,17 +1,20 @@
 import asyncio
 import gc
+import math
 import os
-from concurrent.futures.process import ProcessPoolExecutor
+import shutil
+from itertools import chain
+from typing import Iterator
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-from downloading import _init_worker
-from progress import make_progress
-
-def make_quarter_path(data_type: str, year: int, quarter: int):
-    return os.path.join("data/files/quarters/", data_type, f"{str(year)}-{str(quarter)}.csv.gz")
-
-def make_collected_path(year: int, quarter: int):
-    return os.path.join("data/files/collected/", f"{str(year)}-{str(quarter)}.csv.gz")
+from executing import ResourceExecutor
+from progress import advance_bytes, make_progress
+from schema import apply_schema
+from storing import DecodedStore, make_store, quarter_of
 
 def make_next_quarter(year: int, quarter: int) -> (int, int):
     if quarter == 4:
@@ -19,93 +22,355 @@ def make_next_quarter(year: int, quarter: int) -> (int, int):
     return year, quarter + 1
 
 
-def collect_data(year: int, quarter: int):
-    next_year, next_quarter = make_next_quarter(year, quarter)
+# rough in-memory size of a quarter relative to its compressed size on disk, and of one spilled row
+memory_expansion = 10
+row_bytes = 256
 
-    events_path = os.path.abspath(make_quarter_path("event", year, quarter))
+# a mention counts for its event from the event day until one week later, in epoch seconds like the stored times
+mention_window = 7 * 24 * 60 * 60
 
-    mentions_path_1 = os.path.abspath(make_quarter_path("mention", year, quarter))
-    mentions_path_2 = os.path.abspath(make_quarter_path("mention", next_year, next_quarter))
+# mentions reach one week past the last event day, plus a margin for mentions filed late
+lookahead = pd.Timedelta(days=8)
 
-    details_path_1 = os.path.abspath(make_quarter_path("detail", year, quarter))
-    details_path_2 = os.path.abspath(make_quarter_path("detail", next_year, next_quarter))
+detail_values = ["WordCount", "Negative", "Positive", "Finance"]
 
-    if os.path.exists(events_path) and os.path.exists(mentions_path_1) and os.path.exists(details_path_1):
+def join_keys(keys: str = "url") -> (str, str):
+    if keys == "url":
+        return "MentionIdentifier", "DocumentIdentifier"
+    return "MentionKey", "DocumentKey"
 
-        events = pd.read_csv(events_path)
+def make_collect_columns(keys: str = "url") -> dict[str, list[str]]:
+    mention_key, document_key = join_keys(keys)
+    columns = {
+        "event": ["GlobalEventID", "SQLDATE", "EventBaseCode", "QuadClass", "GoldsteinScale", "ActionGeo_CountryCode"],
+        "mention": ["GlobalEventID", "MentionTimeDate", mention_key],
+        "detail": [document_key, *detail_values],
+    }
+    if keys == "check":
+        columns["mention"].append("MentionIdentifier")
+        columns["detail"].append("DocumentIdentifier")
+    return columns
 
-        mentions = pd.read_csv(mentions_path_1)
-        if os.path.exists(mentions_path_2):
-            mentions = pd.concat([mentions, pd.read_csv(mentions_path_2)])
+def check_keys(mentions: pd.DataFrame, details: pd.DataFrame) -> None:
+    pairs = pd.concat([
+        mentions[["MentionKey", "MentionIdentifier"]].set_axis(["Key", "Identifier"], axis=1),
+        details[["DocumentKey", "DocumentIdentifier"]].set_axis(["Key", "Identifier"], axis=1),
+    ]).drop_duplicates()
+    collisions = pairs[pairs["Key"].duplicated(keep=False)]
+    if len(collisions) > 0:
+        raise ValueError(f"{collisions['Key'].nunique()} keys are shared by different identifiers, e.g. {collisions['Identifier'].head(2).tolist()}")
 
-        details = pd.read_csv(details_path_1)
-        if os.path.exists(details_path_2):
-            details = pd.concat([details, pd.read_csv(details_path_2)])
+def event_time(df: pd.DataFrame) -> pd.DataFrame:
+    # collected quarters keep the event day as a timestamp, so the epoch seconds are converted on the way out
+    return df.rename(columns={"SQLDATE": "Time"}).assign(Time=lambda df: df["Time"].to_numpy(dtype=np.int64).astype("datetime64[s]"))
 
-        events['time'] = pd.to_datetime(events['SQLDATE'], format='%Y%m%d')
-        mentions['time'] = pd.to_datetime(mentions['MentionTimeDate'], format='%Y%m%d%H%M%S')
+def iter_lookahead(store, data_type: str, year: int, quarter: int, columns: list[str], rows: int = 1000000) -> Iterator[pd.DataFrame]:
+    start = pd.Timestamp(year=year, month=quarter * 3 - 2, day=1)
+    until = (start + lookahead).strftime("%Y%m%d%H%M%S")
+    until_seconds = (start + lookahead).value // 1000000000
 
-        em = pd.merge(
-            events,
-            mentions,
-            on='GlobalEventID',
-            how='left',
-            suffixes=('_e', '_m')
-        )
+    # a decoded quarter is memory-mapped, so streaming its head is cheaper than parsing the per-file outputs
+    decoded = isinstance(store, DecodedStore) and store.has_decoded(data_type, year, quarter)
+
+    # per-file outputs let the head of the quarter be read on its own, one day at a time
+    dates = [date for date in store.list_files(data_type, str(year)) if quarter_of(date) == quarter and date < until]
+    if len(dates) > 0 and not (decoded and "MentionTimeDate" in columns):
+        for day in sorted({date[0:8] for date in dates}):
+            yield store.read_files(data_type, str(year), [date for date in dates if date[0:8] == day], columns)
+        return
+
+    if not store.has_quarter(data_type, year, quarter):
+        return
+
+    # quarter files are joined in file order, so mentions can stop at the first chunk past the lookahead
+    for chunk in store.iter_quarter(data_type, year, quarter, columns, rows):
+        if "MentionTimeDate" in chunk.columns:
+            chunk = chunk[chunk["MentionTimeDate"] < until_seconds]
+            if len(chunk) == 0:
+                return
+        yield chunk
+
+def collect_in_memory(store, year: int, quarter: int, keys: str = "url") -> pd.DataFrame:
+    next_year, next_quarter = make_next_quarter(year, quarter)
+    collect_columns = make_collect_columns(keys)
+    mention_key, document_key = join_keys(keys)
+
+    events = store.read_quarter("event", year, quarter, collect_columns["event"])
+
+    mentions = pd.concat([
+        store.read_quarter("mention", year, quarter, collect_columns["mention"]),
+        *iter_lookahead(store, "mention", next_year, next_quarter, collect_columns["mention"]),
+    ])
+    mentions = mentions[
+        mentions['GlobalEventID'].isin(events['GlobalEventID'])
+        & (mentions['MentionTimeDate'] >= events['SQLDATE'].min())
+        & (mentions['MentionTimeDate'] <= events['SQLDATE'].max() + mention_window)
+    ]
 
-        em = em[(em['time_m'] >= em['time_e']) & (em['time_m'] <= em['time_e'] + pd.Timedelta(weeks=1))]
+    details = pd.concat([
+        store.read_quarter("detail", year, quarter, collect_columns["detail"]),
+        *iter_lookahead(store, "detail", next_year, next_quarter, collect_columns["detail"]),
+    ])
+    if keys == "check":
+        check_keys(mentions, details)
 
-        em = pd.merge(
-            em,
-            details,
-            left_on="MentionIdentifier",
-            right_on="DocumentIdentifier",
-            how='left'
+    em = pd.merge(
+        events,
+        mentions,
+        on='GlobalEventID',
+        how='left'
+    )
+
+    em = em[(em['MentionTimeDate'] >= em['SQLDATE']) & (em['MentionTimeDate'] <= em['SQLDATE'] + mention_window)]
+
+    em = pd.merge(
+        em,
+        details,
+        left_on=mention_key,
+        right_on=document_key,
+        how='left'
+    )
+
+    return (
+        em
+        .groupby(
+            ['GlobalEventID', 'SQLDATE', 'EventBaseCode', 'QuadClass', 'GoldsteinScale', 'ActionGeo_CountryCode'],
+            as_index=False,
+            observed=True
         )
+        .agg(
+            MentionsCount=(mention_key, 'size'),
+            WordCount=('WordCount', 'sum'),
+            Negative=('Negative', 'sum'),
+            Positive=('Positive', 'sum'),
+            Finance=('Finance', 'sum')
+        )
+        .pipe(event_time)
+    )
+
+def collect_arrow(store, year: int, quarter: int, keys: str = "url") -> pd.DataFrame:
+    next_year, next_quarter = make_next_quarter(year, quarter)
+    collect_columns = make_collect_columns(keys)
+    mention_key, document_key = join_keys(keys)
+    attributes = ["EventBaseCode", "QuadClass", "GoldsteinScale", "ActionGeo_CountryCode"]
+
+    # an event with a null group key is dropped by the pandas group-by, so it is dropped before the join here
+    events = store.read_quarter("event", year, quarter, collect_columns["event"]).dropna(subset=attributes)
+    # the pandas engine groups on the attributes too, so an event id listed with different attributes stays apart
+    group_keys = ["GlobalEventID", "SQLDATE", *attributes]
+    events["group"] = events.groupby(group_keys, observed=True, sort=False).ngroup()
+
+    mentions = pd.concat([
+        store.read_quarter("mention", year, quarter, collect_columns["mention"]),
+        *iter_lookahead(store, "mention", next_year, next_quarter, collect_columns["mention"]),
+    ])
+    details = pd.concat([
+        store.read_quarter("detail", year, quarter, collect_columns["detail"]),
+        *iter_lookahead(store, "detail", next_year, next_quarter, collect_columns["detail"]),
+    ])
+    if keys == "check":
+        check_keys(mentions, details)
+
+    # an inner join plus the window filter keeps exactly the pairs the left join and its filter keep in collect_in_memory
+    em = pa.table({
+        "GlobalEventID": mentions["GlobalEventID"].to_numpy(),
+        "MentionTimeDate": mentions["MentionTimeDate"].to_numpy(),
+        mention_key: pa.array(mentions[mention_key], from_pandas=True),
+    }).join(pa.table({"GlobalEventID": events["GlobalEventID"].to_numpy(), "SQLDATE": events["SQLDATE"].to_numpy(), "group": events["group"].to_numpy()}), "GlobalEventID", join_type="inner")
+    del mentions
+    em = em.filter(pc.and_(
+        pc.greater_equal(em["MentionTimeDate"], em["SQLDATE"]),
+        pc.less_equal(em["MentionTimeDate"], pc.add(em["SQLDATE"], mention_window)),
+    ))
+    details = pa.Table.from_pandas(details[[document_key, *detail_values]], preserve_index=False)
+    em = em.join(details, mention_key, right_keys=document_key, join_type="left outer")
+    del details
+
+    sums = em.group_by("group").aggregate([
+        (mention_key, "count", pc.CountOptions(mode="all")),
+        *[(column, "sum", pc.ScalarAggregateOptions(min_count=0)) for column in detail_values],
+    ]).rename_columns(["group", "MentionsCount", *detail_values]).to_pandas()
+    # a mention without details turns its sums floating in pandas, so the same columns are floating here
+    sums = sums.astype({column: "float64" for column in detail_values if em[column].null_count > 0})
 
-        result = (
-            em
-            .groupby(
-                ['GlobalEventID', 'time_e', 'EventBaseCode', 'QuadClass', 'GoldsteinScale', 'ActionGeo_CountryCode'],
-                as_index=False
-            )
-            .agg(
-                MentionsCount=('MentionIdentifier', 'size'),
-                WordCount=('WordCount', 'sum'),
-                Negative=('Negative', 'sum'),
-                Positive=('Positive', 'sum'),
-                Finance=('Finance', 'sum')
-            )
-            .rename(columns={'time_e': 'Time'})
+    # the attributes are attached after the group-by, which only needs the group number
+    result = events.drop_duplicates("group")[["group", *group_keys]].merge(sums, on="group").drop(columns="group")
+    return event_time(result.sort_values(group_keys, kind="stable", ignore_index=True))
+
+def make_spill_path(year: int, quarter: int):
+    return os.path.join("data/cache/collect/", f"{str(year)}-{str(quarter)}")
+
+def spill(df: pd.DataFrame, key: str, partitions: int, schema: pa.Schema, writers: dict[int, pq.ParquetWriter], directory: str) -> None:
+    buckets = pd.util.hash_pandas_object(df[key], index=False).to_numpy() % partitions
+    for partition in np.unique(buckets):
+        if partition not in writers:
+            writers[partition] = pq.ParquetWriter(os.path.join(directory, f"part-{partition}.parquet"), schema)
+        writers[partition].write_table(pa.Table.from_pandas(df[buckets == partition], schema=schema, preserve_index=False))
+
+def collect_partitioned(store, year: int, quarter: int, partitions: int, rows: int, keys: str = "url") -> pd.DataFrame:
+    next_year, next_quarter = make_next_quarter(year, quarter)
+    collect_columns = make_collect_columns(keys)
+    mention_key, document_key = join_keys(keys)
+    key_type = pa.string() if keys == "url" else pa.int64()
+    identifiers = {"mention": [("MentionIdentifier", pa.string())], "detail": [("DocumentIdentifier", pa.string())]} if keys == "check" else {"mention": [], "detail": []}
+    spill_path = make_spill_path(year, quarter)
+    shutil.rmtree(spill_path, ignore_errors=True)
+    os.makedirs(os.path.join(spill_path, "mention"))
+    os.makedirs(os.path.join(spill_path, "detail"))
+
+    events = store.read_quarter("event", year, quarter, collect_columns["event"]).reset_index(drop=True)
+    windows = events[["GlobalEventID", "SQLDATE"]].rename_axis("_row").reset_index()
+
+    try:
+        # mentions are matched to their events and windowed chunk by chunk, then spilled by document so each
+        # partition joins against exactly the details that can match it
+        mention_schema = pa.schema([("_row", pa.int64()), (mention_key, key_type), *identifiers["mention"]])
+        writers: dict[int, pq.ParquetWriter] = {}
+        lower, upper = events["SQLDATE"].min(), events["SQLDATE"].max() + mention_window
+        for mentions in chain(store.iter_quarter("mention", year, quarter, collect_columns["mention"], rows), iter_lookahead(store, "mention", next_year, next_quarter, collect_columns["mention"], rows)):
+            mentions = mentions[(mentions["MentionTimeDate"] >= lower) & (mentions["MentionTimeDate"] <= upper)]
+            em = pd.merge(windows, mentions, on="GlobalEventID")
+            em = em[(em["MentionTimeDate"] >= em["SQLDATE"]) & (em["MentionTimeDate"] <= em["SQLDATE"] + mention_window)]
+            spill(em, mention_key, partitions, mention_schema, writers, os.path.join(spill_path, "mention"))
+        for writer in writers.values():
+            writer.close()
+
+        floating: set[str] = set()
+        detail_schema = pa.schema([(document_key, key_type), *identifiers["detail"], *[(column, pa.float64()) for column in detail_values]])
+        writers = {}
+        for details in chain(store.iter_quarter("detail", year, quarter, collect_columns["detail"], rows), iter_lookahead(store, "detail", next_year, next_quarter, collect_columns["detail"], rows)):
+            floating |= {column for column in detail_values if details[column].dtype.kind == "f"}
+            spill(details, document_key, partitions, detail_schema, writers, os.path.join(spill_path, "detail"))
+        for writer in writers.values():
+            writer.close()
+
+        partials = []
+        for partition in range(partitions):
+            mention_file = os.path.join(spill_path, "mention", f"part-{partition}.parquet")
+            detail_file = os.path.join(spill_path, "detail", f"part-{partition}.parquet")
+            if not os.path.exists(mention_file):
+                continue
+            em = pq.read_table(mention_file).to_pandas()
+            details = pq.read_table(detail_file).to_pandas() if os.path.exists(detail_file) else detail_schema.empty_table().to_pandas()
+            if keys == "check":
+                check_keys(em, details)
+            em = pd.merge(em, details, left_on=mention_key, right_on=document_key, how="left")
+            floating |= {column for column in detail_values if em[column].isna().any()}
+            partials.append(em.groupby("_row").agg(MentionsCount=(mention_key, "size"), **{column: (column, "sum") for column in detail_values}))
+    finally:
+        shutil.rmtree(spill_path, ignore_errors=True)
+
+    sums = pd.concat(partials).groupby(level=0).sum() if len(partials) > 0 else pd.DataFrame(columns=["MentionsCount", *detail_values], dtype="float64")
+    em = events.join(sums, how="inner")
+
+    result = (
+        em
+        .groupby(
+            ['GlobalEventID', 'SQLDATE', 'EventBaseCode', 'QuadClass', 'GoldsteinScale', 'ActionGeo_CountryCode'],
+            as_index=False,
+            observed=True
         )
+        .agg(
+            MentionsCount=('MentionsCount', 'sum'),
+            WordCount=('WordCount', 'sum'),
+            Negative=('Negative', 'sum'),
+            Positive=('Positive', 'sum'),
+            Finance=('Finance', 'sum')
+        )
+        .pipe(event_time)
+    )
+    # every summed column is integral, so the partial sums are exact and only the dtype has to match the in-memory join
+    return result.astype({"MentionsCount": "int64", **{column: "int64" for column in detail_values if column not in floating}})
+
+def collect_bytes(store, year: int, quarter: int) -> int:
+    next_year, next_quarter = make_next_quarter(year, quarter)
+    inputs = [("event", year, quarter)] + [(data_type, y, q) for data_type in ["mention", "detail"] for y, q in [(year, quarter), (next_year, next_quarter)]]
+    return sum(store.quarter_bytes(*input) for input in inputs if store.has_quarter(*input))
+
+def estimate_memory(store, year: int, quarter: int) -> int:
+    return collect_bytes(store, year, quarter) * memory_expansion
+
+def decode_quarter(data_type: str, year: int, quarter: int, storage: str = "csv", rows: int = 1000000, keys: str = "url") -> None:
+    DecodedStore(make_store(storage)).decode_quarter(data_type, year, quarter, make_collect_columns(keys)[data_type], rows)
 
-        collected_path = make_collected_path(year, quarter)
-        os.makedirs(os.path.dirname(collected_path), exist_ok=True)
-        result.to_csv(collected_path, index=False, compression="gzip")
+def collect_data(year: int, quarter: int, storage: str = "csv", memory_budget: int | None = None, decoded: bool = False, keys: str = "url", engine: str = "pandas"):
+    store = make_store(storage)
+    if decoded:
+        store = DecodedStore(store)
 
+    if store.has_quarter("event", year, quarter) and store.has_quarter("mention", year, quarter) and store.has_quarter("detail", year, quarter):
+        partitions = 1
+        if memory_budget is not None:
+            partitions = math.ceil(estimate_memory(store, year, quarter) / memory_budget)
 
-async def collect_all(quarters_in_years: list[tuple[list[int], int]], cache: bool = False) -> None:
+        if partitions <= 1:
+            collect = {"pandas": collect_in_memory, "pyarrow": collect_arrow}[engine]
+            result = collect(store, year, quarter, keys)
+        else:
+            result = collect_partitioned(store, year, quarter, partitions, max(10000, memory_budget // row_bytes), keys)
+
+        store.write_collected(apply_schema(result, "collected"), year, quarter)
+        return None, len(result)
+
+
+async def collect_all(quarters_in_years: list[tuple[list[int], int]], cache: bool = False, storage: str = "csv", memory_budget: int | None = None, keys: str = "url", executor: ResourceExecutor | None = None, engine: str = "pandas") -> None:
     old = gc.isenabled()
     gc.disable()
-    semaphore = asyncio.Semaphore(2)
+    own_executor = executor is None
+    if own_executor:
+        executor = ResourceExecutor()
+    # the executor admits jobs by memory, this only bounds how many decoded quarters sit on disk at once
+    semaphore = asyncio.Semaphore(executor.workers)
 
-    total = len(quarters_in_years) * 4
+    total = sum(len(quarters) for quarters, _ in quarters_in_years)
+    jobs = [(year, quarter) for quarters, year in quarters_in_years for quarter in quarters]
+    rows = max(10000, memory_budget // row_bytes) if memory_budget is not None else 1000000
+
+    # a mention or detail quarter is read by its own job and, as the lookahead, by the job of the quarter before it,
+    # so it is decoded once and evicted after both of them are done
+    store = make_store(storage)
+    decoded_store = DecodedStore(store)
+    decoded: dict[tuple[str, int, int], asyncio.Future] = {}
+    readers: dict[tuple[str, int, int], int] = {}
+    for year, quarter in jobs:
+        for data_type in ["mention", "detail"]:
+            for key in {(data_type, year, quarter), (data_type, *make_next_quarter(year, quarter))}:
+                if key[1:] in jobs:
+                    readers[key] = readers.get(key, 0) + 1
 
     progress = make_progress()
     task_id = progress.add_task(f"Collecting", total=total)
 
-    with progress:
-        with ProcessPoolExecutor(max_workers=2, initializer=_init_worker) as pool:
+    try:
+        with progress:
+            def _decode(key: tuple[str, int, int]) -> asyncio.Future:
+                if key not in decoded:
+                    size = store.quarter_bytes(*key) if store.has_quarter(*key) else 0
+                    decoded[key] = asyncio.ensure_future(executor.submit("decode", decode_quarter, *key, storage, rows, keys, input_bytes=size))
+                return decoded[key]
+
             async with asyncio.TaskGroup() as task_group:
                 for quarters, year in quarters_in_years:
                     async def _worker(y: int, q: int):
+                        inputs = [key for key in readers if key[1:] in [(y, q), make_next_quarter(y, q)]]
                         async with semaphore:
                             try:
-                                loop = asyncio.get_running_loop()
-                                await loop.run_in_executor(pool, collect_data, y, q)
+                                await asyncio.gather(*[_decode(key) for key in inputs])
+                                input_bytes = collect_bytes(store, y, q)
+                                await executor.submit("collect", collect_data, y, q, storage, memory_budget, True, keys, engine, input_bytes=input_bytes, cap=memory_budget)
+                                advance_bytes(progress, task_id, input_bytes)
                             finally:
+                                for key in inputs:
+                                    readers[key] -= 1
+                                    if readers[key] == 0:
+                                        decoded_store.evict(*key)
                                 progress.update(task_id, advance=1)
                     for quarter in quarters:
                         task_group.create_task(_worker(year, quarter))
+    finally:
+        for key in decoded:
+            decoded_store.evict(*key)
+        if own_executor:
+            executor.close()
     if old:
-        gc.enable()
\ No newline at end of file
+        gc.enable()
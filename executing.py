@@ -0,0 +1,123 @@
+import asyncio
+import faulthandler
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures.process import ProcessPoolExecutor
+from typing import Any, Callable
+
+from metrics import Metrics
+from scheduling import Resources
+
+# starting ratios of peak task memory to input bytes, replaced by measurements as tasks finish
+default_ratios: dict[str, float] = {
+    "parse": 24.0,
+    "quarterize": 4.0,
+    "decode": 8.0,
+    "collect": 10.0,
+    "financial": 16.0,
+}
+minimum_estimate = 64 * 1024 ** 2
+
+# imported once per worker when it starts, so the first task of every stage does not pay for them
+warm_modules: list[str] = ["pandas", "pyarrow", "pyarrow.parquet", "sklearn.preprocessing", "parsing", "quarterizing", "collecting", "financial", "aggregating"]
+
+def _init_worker(modules: list[str] | None = None):
+    faulthandler.enable()
+    sys.excepthook = lambda exc, val, tb: print("WORKER EXCEPTION:","".join(traceback.format_exception(exc, val, tb)),file=sys.stderr, flush=True)
+    for module in modules or []:
+        importlib.import_module(module)
+
+def make_history_path():
+    return os.path.join("data/cache/", "executor_history.json")
+
+def total_memory() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 8 * 1024 ** 3
+
+def _status(field: str) -> int:
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def _run_measured(fn: Callable, *args) -> (Any, int, float, int, int):
+    # resetting the high-water mark makes VmHWM the peak of this task alone, even in a reused worker
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+    before = _status("VmRSS")
+    cpu = time.process_time()
+    result = fn(*args)
+    peak = _status("VmHWM")
+    return result, max(0, peak - before), time.process_time() - cpu, peak, os.getpid()
+
+
+class ResourceExecutor:
+    def __init__(self, memory_budget: int | None = None, workers: int | None = None, smoothing: float = 0.3, metrics: Metrics | None = None):
+        self.workers = workers or os.cpu_count() or 4
+        self.memory_budget = memory_budget or int(total_memory() * 0.75)
+        self.smoothing = smoothing
+        self.ratios = {**default_ratios, **self._load_history()}
+        self.resources = Resources({"workers": self.workers, "memory": self.memory_budget})
+        self.metrics = metrics or Metrics()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(warm_modules,))
+
+    def _load_history(self) -> dict[str, float]:
+        if os.path.exists(make_history_path()):
+            with open(make_history_path()) as file:
+                return json.load(file)
+        return {}
+
+    def _save_history(self) -> None:
+        os.makedirs(os.path.dirname(make_history_path()), exist_ok=True)
+        with open(make_history_path() + ".tmp", "w") as file:
+            json.dump(self.ratios, file, indent=2)
+        os.replace(make_history_path() + ".tmp", make_history_path())
+
+    def estimate(self, kind: str, input_bytes: int, cap: int | None = None) -> int:
+        estimate = max(minimum_estimate, int(self.ratios.get(kind, max(default_ratios.values())) * input_bytes))
+        if cap is not None:
+            estimate = min(estimate, max(minimum_estimate, cap))
+        return min(estimate, self.memory_budget)
+
+    async def submit(self, kind: str, fn: Callable, *args, input_bytes: int = 0, cap: int | None = None, read_bytes: int | None = None) -> Any:
+        granted = await self.resources.acquire({"workers": 1, "memory": self.estimate(kind, input_bytes, cap)})
+        start = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, peak, cpu, rss, pid = await loop.run_in_executor(self.pool, _run_measured, fn, *args)
+        finally:
+            await self.resources.release(granted)
+
+        self.metrics.add(kind, start=start, tasks=1, task_seconds=time.time() - start, cpu_seconds=cpu, bytes_in=input_bytes if read_bytes is None else read_bytes, peak_task_memory=peak)
+        self.metrics.worker(pid, rss)
+        # tasks that count their rows return them as (rows_in, rows_out)
+        if isinstance(result, tuple) and len(result) == 2:
+            self.metrics.add(kind, rows_in=result[0], rows_out=result[1])
+
+        if input_bytes > 0 and peak > 0:
+            ratio = peak / input_bytes
+            self.ratios[kind] = (1 - self.smoothing) * self.ratios.get(kind, ratio) + self.smoothing * ratio
+        return result
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        self._save_history()
+
+    def __enter__(self) -> "ResourceExecutor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,61 +1,94 @@
-import asyncio
 import gc
+import glob
+import json
 import os
-from concurrent.futures.process import ProcessPoolExecutor
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
-import joblib
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from downloading import _init_worker
+from executing import ResourceExecutor
 from progress import make_progress
 
 def make_financial_path(name: str, is_raw: bool):
     return os.path.join("data/files/financial/", "raw" if is_raw else "processed", f"{name}.csv")
 
-def make_scaler_path(name: str):
-    return os.path.join("data/files/financial/processed/scalers", f"{name}.joblib.gz")
+def make_panel_path():
+    return os.path.join("data/files/financial/processed/", "panel.parquet")
 
-def process_financial_file(name: str):
-    df = pd.read_csv(make_financial_path(name, is_raw=True))
+def list_financial_files() -> list[str]:
+    return sorted(os.path.splitext(os.path.basename(path))[0] for path in glob.glob(make_financial_path("*", is_raw=True)))
 
-    df["Close"] = df["Price"].str.replace(",", "").astype(float)
-    df["CloseToClose"] = df["Close"].pct_change(periods=-1) * 100
-    scaler = MinMaxScaler(feature_range=(0, 1))
-    df["CloseToClose"] = scaler.fit_transform(df[["CloseToClose"]])
+def read_prices(names: list[str] | None = None, path: str | None = None, date_format: str = "%m/%d/%Y") -> pd.DataFrame:
+    # one long-format file has Date, Ticker and Price columns, raw files are one ticker each with Date and Price
+    if path is not None:
+        prices = pd.read_csv(path, usecols=["Date", "Ticker", "Price"], dtype={"Ticker": str, "Price": str})
+    else:
+        names = list_financial_files() if names is None else names
+        prices = pd.concat([pd.read_csv(make_financial_path(name, is_raw=True), usecols=["Date", "Price"], dtype={"Price": str}) for name in names], keys=names, names=["Ticker", None])
+        prices = prices.reset_index(level="Ticker")
 
-    df["Date"] = pd.to_datetime(df['Date'], format="%m/%d/%Y")
+    return pd.DataFrame({
+        "Date": pd.to_datetime(prices["Date"], format=date_format).to_numpy(),
+        "Ticker": prices["Ticker"].to_numpy(),
+        "Close": prices["Price"].str.replace(",", "", regex=False).astype(float).to_numpy(),
+    })
 
-    df = df[["Date", "CloseToClose"]]
+def make_panel(prices: pd.DataFrame) -> (pd.DataFrame, dict[str, dict[str, float]]):
+    # returns are taken against each ticker's own previous trading day, before the calendars are aligned
+    prices = prices.sort_values(["Ticker", "Date"], kind="stable")
+    returns = (prices["Close"] / prices.groupby("Ticker", sort=False)["Close"].shift(1) - 1) * 100
+    panel = prices.assign(CloseToClose=returns).pivot(index="Date", columns="Ticker", values="CloseToClose")
+    panel.columns.name = None
 
-    os.makedirs(os.path.dirname(make_financial_path(name, is_raw=False)), exist_ok=True)
-    df.to_csv(make_financial_path(name, is_raw=False), index=False)
+    # same arithmetic as MinMaxScaler, so scaled values match the per-ticker scalers bit for bit
+    data_min = panel.min()
+    data_max = panel.max()
+    data_range = data_max - data_min
+    scale = 1 / data_range.where(data_range != 0, 1)
+    panel = panel * scale + (-data_min * scale)
 
-    scaler_path = make_scaler_path(name)
-    os.makedirs(os.path.dirname(scaler_path), exist_ok=True)
-    joblib.dump(scaler, scaler_path)
+    scalers = {ticker: {"data_min": float(data_min[ticker]), "data_max": float(data_max[ticker])} for ticker in panel.columns}
+    return panel, scalers
 
-async def process_all_financial_files(names: list[str]):
+def save_panel(panel: pd.DataFrame, scalers: dict[str, dict[str, float]]) -> None:
+    table = pa.Table.from_pandas(panel.reset_index(), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"scalers": json.dumps(scalers).encode()})
+    os.makedirs(os.path.dirname(make_panel_path()), exist_ok=True)
+    pq.write_table(table, make_panel_path() + ".tmp", compression="zstd")
+    os.replace(make_panel_path() + ".tmp", make_panel_path())
+
+def load_panel(names: list[str] | None = None) -> (pd.DataFrame, dict[str, dict[str, float]]):
+    table = pq.read_table(make_panel_path(), columns=None if names is None else ["Date", *names])
+    scalers = json.loads(pq.read_schema(make_panel_path()).metadata[b"scalers"])
+    panel = table.to_pandas().set_index("Date")
+    return panel, {ticker: scalers[ticker] for ticker in panel.columns}
+
+def process_financial_files(names: list[str] | None = None, path: str | None = None, date_format: str = "%m/%d/%Y"):
+    prices = read_prices(names, path, date_format)
+    panel, scalers = make_panel(prices)
+    save_panel(panel, scalers)
+    return len(prices), len(panel)
+
+async def process_all_financial_files(names: list[str] | None = None, executor: ResourceExecutor | None = None, path: str | None = None):
     old = gc.isenabled()
     gc.disable()
-    semaphore = asyncio.Semaphore(16)
+    own_executor = executor is None
+    if own_executor:
+        executor = ResourceExecutor(workers=1)
 
-    total = len(names)
+    names = list_financial_files() if names is None and path is None else names
+    input_bytes = os.path.getsize(path) if path is not None else sum(os.path.getsize(make_financial_path(name, is_raw=True)) for name in names)
 
     progress = make_progress()
-    task_id = progress.add_task(f"Processing financial data", total=total)
-
-    with progress:
-        with ProcessPoolExecutor(max_workers=16, initializer=_init_worker) as pool:
-            async with asyncio.TaskGroup() as task_group:
-                async def _worker(n: str):
-                    async with semaphore:
-                        try:
-                            loop = asyncio.get_running_loop()
-                            await loop.run_in_executor(pool, process_financial_file, n)
-                        finally:
-                            progress.update(task_id, advance=1)
-                for name in names:
-                    task_group.create_task(_worker(name))
+    task_id = progress.add_task(f"Processing financial data", total=1)
+
+    try:
+        with progress:
+            await executor.submit("financial", process_financial_files, names, path, input_bytes=input_bytes)
+            progress.update(task_id, advance=1)
+    finally:
+        if own_executor:
+            executor.close()
 
     if old:
-        gc.enable()
\ No newline at end of file
+        gc.enable()
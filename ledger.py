@@ -0,0 +1,111 @@
+import os
+import sqlite3
+from typing import Iterable
+
+
+def make_ledger_path():
+    return os.path.join("data/manifest/", "ledger.sqlite")
+
+
+class Ledger:
+    def __init__(self, path: str | None = None):
+        path = path or make_ledger_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "storage TEXT NOT NULL, type TEXT NOT NULL, date TEXT NOT NULL, url TEXT, "
+            "size INTEGER, md5 TEXT, output_bytes INTEGER NOT NULL, keys TEXT, dimensions TEXT, "
+            "PRIMARY KEY (storage, type, date))"
+        )
+        # ledgers from before the parse options were recorded get the columns, their rows hold nulls
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(files)")}
+        for column in ["keys", "dimensions"]:
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE files ADD COLUMN {column} TEXT")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS failures ("
+            "storage TEXT NOT NULL, type TEXT NOT NULL, date TEXT NOT NULL, year TEXT NOT NULL, url TEXT NOT NULL, "
+            "size INTEGER, md5 TEXT, error TEXT NOT NULL, message TEXT, attempts INTEGER NOT NULL, permanent INTEGER NOT NULL, "
+            "PRIMARY KEY (storage, type, date))"
+        )
+
+    def _select(self, query: str, parameters: tuple, dates: Iterable[str] | None) -> list[tuple]:
+        if dates is None:
+            return self.connection.execute(query, parameters).fetchall()
+        # a caller that knows its files looks them up by primary key, so a live slice does not read every row of the table
+        dates = list(dates)
+        rows = []
+        for start in range(0, len(dates), 500):
+            chunk = dates[start:start + 500]
+            rows += self.connection.execute(f"{query} AND date IN ({', '.join('?' * len(chunk))})", (*parameters, *chunk)).fetchall()
+        return rows
+
+    def load(self, storage: str, data_type: str, dates: Iterable[str] | None = None) -> dict[str, tuple[int | None, str | None, int, str | None, str | None]]:
+        rows = self._select("SELECT date, size, md5, output_bytes, keys, dimensions FROM files WHERE storage = ? AND type = ?", (storage, data_type), dates)
+        return {date: (size, md5, output_bytes, keys, dimensions) for date, size, md5, output_bytes, keys, dimensions in rows}
+
+    def record(self, storage: str, data_type: str, date: str, url: str, size: int | None, md5: str | None, output_bytes: int, output: tuple[str, str] = ("", "")) -> None:
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (storage, data_type, date, url, size, md5, output_bytes, *output))
+            self.connection.execute("DELETE FROM failures WHERE storage = ? AND type = ? AND date = ?", (storage, data_type, date))
+
+    def record_many(self, storage: str, data_type: str, rows: list[tuple[str, str, int | None, str | None, int, str, str]]) -> None:
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [(storage, data_type, *row) for row in rows])
+
+    def record_failure(self, storage: str, data_type: str, year: str, date: str, url: str, size: int | None, md5: str | None, error: str, message: str, permanent: bool) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?) ON CONFLICT (storage, type, date) DO UPDATE SET "
+                "error = excluded.error, message = excluded.message, attempts = attempts + 1, permanent = excluded.permanent",
+                (storage, data_type, date, year, url, size, md5, error, message, int(permanent)),
+            )
+
+    def load_failures(self, storage: str, data_type: str, permanent: bool = False, dates: Iterable[str] | None = None) -> list[tuple[str, str, str, int | None, str | None]]:
+        rows = self._select("SELECT url, year, date, size, md5 FROM failures WHERE storage = ? AND type = ? AND permanent = ?", (storage, data_type, int(permanent)), dates)
+        return sorted(rows, key=lambda row: row[2])
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "Ledger":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def is_valid(entry: tuple[int | None, str | None, int, str | None, str | None] | None, store, data_type: str, year: str, date: str, md5: str | None = None, output: tuple[str, str] | None = None) -> bool:
+    # a stat against the recorded output size catches truncated files without parsing them again
+    if entry is None or not store.has_file(data_type, year, date):
+        return False
+    _, recorded, output_bytes, keys, dimensions = entry
+    if md5 is not None and recorded is not None and md5 != recorded:
+        return False
+    # a file parsed with other keys or GCAM dimensions has other columns, so it is parsed again
+    if output is not None and (keys, dimensions) != output:
+        return False
+    return store.file_bytes(data_type, year, date) == output_bytes
+
+def backfill(ledger: Ledger, entries: dict[str, tuple[int | None, str | None, int, str | None, str | None]], store, storage: str, data_type: str, files: Iterable[tuple[str, str, str, int | None, str | None]], output: tuple[str, str], columns: list[str]) -> int:
+    # outputs written before the ledger existed have no row, and rows written before the parse options were recorded have no options;
+    # a non-empty output with the columns this parse writes is trusted once and recorded with the masterlist checksum
+    rows = []
+    for url, year, date, size, md5 in files:
+        entry = entries.get(date)
+        if entry is not None and entry[3] is not None:
+            continue
+        if not store.has_file(data_type, year, date) or (output_bytes := store.file_bytes(data_type, year, date)) == 0:
+            continue
+        if set(store.file_columns(data_type, year, date)) != set(columns):
+            continue
+        if entry is not None:
+            size, md5, output_bytes = entry[:3]
+        rows.append((date, url, size, md5, output_bytes, *output))
+        entries[date] = (size, md5, output_bytes, *output)
+    if len(rows) > 0:
+        ledger.record_many(storage, data_type, rows)
+    return len(rows)
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import time
+import urllib.error
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from aggregating import aggregate_columns, categories, daily_sums, make_feature_frame, make_scaler_path, mention_columns, seconds_per_day, window_ratios
+from collecting import detail_values, join_keys, make_collect_columns, mention_window
+from downloading import download_all, make_session, master_files
+from executing import ResourceExecutor
+from financial import load_panel, make_panel_path
+from ledger import Ledger, backfill, is_valid
+from manifest import data_types, load_manifest
+from masterlist import download_lastupdate, index_masterlist
+from parsing import output_columns, output_format
+from progress import make_progress
+from quarterizing import clean_events
+from storing import make_store
+
+# the daily sums aggregate keeps for every category, in the order a day's cells store them
+sum_names = ["mentions", "goldstein", "words", "positive", "negative", "finance"]
+detail_sums = {"WordCount": "words", "Negative": "negative", "Positive": "positive", "Finance": "finance"}
+
+# collect drops events with a null group key
+group_columns = ["QuadClass", "GoldsteinScale", "ActionGeo_CountryCode"]
+
+def make_live_path(days: int):
+    return os.path.join("data/files/live/", f"{days}.csv")
+
+def epoch_seconds(values: pd.Series, format: str) -> np.ndarray:
+    return pd.to_datetime(values, format=format).to_numpy().astype("datetime64[s]").astype(np.int64)
+
+def scale_goldstein(values: pd.Series) -> np.ndarray:
+    goldstein = values.add(10).mul(10).to_numpy(dtype=np.float64)
+    if np.allclose(goldstein, np.rint(goldstein), rtol=0, atol=1e-4):
+        goldstein = np.rint(goldstein)
+    return goldstein
+
+
+class LiveAggregator:
+    def __init__(self, windows: list[int], keys: str = "url"):
+        self.windows = windows
+        self.keys = keys
+        self.mention_key, self.document_key = join_keys(keys)
+        self.days: dict[int, np.ndarray] = {}
+        self.events = pd.DataFrame({"day": pd.Series(dtype=np.int64), "category": pd.Series(dtype=np.int64), "goldstein": pd.Series(dtype=np.float64)}).rename_axis("GlobalEventID")
+        self.details = pd.DataFrame({**{column: pd.Series(dtype=np.float64) for column in detail_values}, "seen": pd.Series(dtype=np.int64)}).rename_axis(self.document_key)
+        self.pending = pd.DataFrame({self.mention_key: pd.Series(dtype=object), "day": pd.Series(dtype=np.int64), "category": pd.Series(dtype=np.int64), "seen": pd.Series(dtype=np.int64)})
+
+    def _add(self, day: np.ndarray, category: np.ndarray, **sums: np.ndarray) -> None:
+        if len(day) == 0:
+            return
+        cells = pd.DataFrame({"day": day, "category": category, **sums}).groupby(["day", "category"]).sum()
+        rows = [sum_names.index(name) for name in sums]
+        for (d, c), values in zip(cells.index, cells.to_numpy()):
+            self.days.setdefault(int(d), np.zeros((len(sum_names), categories)))[rows, c] += values
+
+    def seed(self, store, now: int) -> int:
+        # the newest collected quarters already hold the sums of past days, so only their tail is read back
+        start = now // seconds_per_day * seconds_per_day - (max(self.windows) + 7) * seconds_per_day
+        collected = [store.read_collected(year, quarter, ["GlobalEventID", *aggregate_columns]) for year, quarter in store.list_collected()[-2:]]
+        if len(collected) == 0:
+            return 0
+        events = pd.concat(collected, ignore_index=True)
+        events["Timestamp"] = epoch_seconds(events["Time"], "ISO8601") // seconds_per_day * seconds_per_day
+        events = events[events["Timestamp"] >= start]
+        if len(events) == 0:
+            return 0
+
+        total_days = (int(events["Timestamp"].max()) - start) // seconds_per_day + 1
+        cumulative = daily_sums(events, start, total_days)
+        daily = np.stack([np.diff(cumulative[name], axis=0) for name in sum_names], axis=1)
+        for offset in np.flatnonzero(daily.any(axis=(1, 2))):
+            self.days[start + int(offset) * seconds_per_day] = daily[offset]
+
+        events = events[(events["EventBaseCode"] >= 1) & (events["EventBaseCode"] <= categories)]
+        self.events = pd.DataFrame({
+            "day": events["Timestamp"].to_numpy(),
+            "category": events["EventBaseCode"].to_numpy(dtype=np.int64) - 1,
+            "goldstein": scale_goldstein(events["GoldsteinScale"]),
+        }, index=pd.Index(events["GlobalEventID"].to_numpy(), name="GlobalEventID"))
+        self.events = self.events[~self.events.index.duplicated()]
+        return len(events)
+
+    def replay(self, store, columns: dict[str, list[str]]) -> int:
+        # files parsed by an earlier live run are in the ledger but not in the manifest, so no collected quarter holds them yet
+        manifest = load_manifest()
+        with Ledger() as ledger:
+            files = []
+            for masterlist_type, data_type in data_types.items():
+                processed = set(manifest.loc[manifest["type"] == masterlist_type, "date"])
+                files += [(date, data_type) for date, entry in ledger.load(store.name, data_type).items() if date not in processed and is_valid(entry, store, data_type, date[:4], date, output=output_format(data_type, self.keys))]
+        if len(files) == 0:
+            return 0
+
+        # they are fed slice by slice like the live loop does, from the oldest slice that can still reach a window
+        order = list(data_types.values())
+        files.sort(key=lambda file: (file[0], order.index(file[1])))
+        times = epoch_seconds(pd.Series([date for date, _ in files]), "%Y%m%d%H%M%S")
+        first = int(times.max()) // seconds_per_day * seconds_per_day - (max(self.windows) + 7) * seconds_per_day
+        replayed = 0
+        for (date, data_type), now in zip(files, times):
+            if now < first:
+                continue
+            df = store.read_files(data_type, date[:4], [date], columns[data_type])
+            if data_type == "event":
+                self.add_events(df)
+            elif data_type == "mention":
+                self.add_mentions(df, int(now))
+            else:
+                self.add_details(df, int(now))
+            self.prune(int(now))
+            replayed += 1
+        return replayed
+
+    def add_events(self, events: pd.DataFrame) -> int:
+        events = clean_events(events.dropna(subset=group_columns))
+        events = events[(events["EventBaseCode"] >= 1) & (events["EventBaseCode"] <= categories)]
+        new = pd.DataFrame({
+            "day": events["SQLDATE"].to_numpy(dtype=np.int64),
+            "category": events["EventBaseCode"].to_numpy(dtype=np.int64) - 1,
+            "goldstein": scale_goldstein(events["GoldsteinScale"]),
+        }, index=pd.Index(events["GlobalEventID"].to_numpy(), name="GlobalEventID"))
+        new = new[~new.index.duplicated() & ~new.index.isin(self.events.index)]
+        self.events = pd.concat([self.events, new])
+        return len(new)
+
+    def add_mentions(self, mentions: pd.DataFrame, now: int) -> int:
+        mentions = mentions.join(self.events, on="GlobalEventID", how="inner")
+        time = mentions["MentionTimeDate"].to_numpy(dtype=np.int64)
+        mentions = mentions[(time >= mentions["day"].to_numpy()) & (time <= mentions["day"].to_numpy() + mention_window)]
+        day, category = mentions["day"].to_numpy(), mentions["category"].to_numpy()
+        self._add(day, category, mentions=np.ones(len(mentions)), goldstein=mentions["goldstein"].to_numpy())
+
+        # a mention's document usually arrives in the gkg file of the same slice, which is read after the mentions
+        known = mentions[self.mention_key].isin(self.details.index).to_numpy()
+        values = self.details.loc[mentions.loc[known, self.mention_key], detail_values]
+        self._add(day[known], category[known], **{detail_sums[name]: values[name].to_numpy() for name in detail_values})
+        pending = mentions.loc[~known, [self.mention_key, "day", "category"]].assign(seen=now)
+        self.pending = pd.concat([self.pending, pending], ignore_index=True)
+        return len(mentions)
+
+    def add_details(self, details: pd.DataFrame, now: int) -> int:
+        details = details.drop_duplicates(self.document_key).set_index(self.document_key)[detail_values].astype(np.float64).fillna(0)
+        matched = self.pending[self.mention_key].isin(details.index).to_numpy()
+        waiting = self.pending[matched]
+        values = details.loc[waiting[self.mention_key]]
+        self._add(waiting["day"].to_numpy(), waiting["category"].to_numpy(), **{detail_sums[name]: values[name].to_numpy() for name in detail_values})
+        self.pending = self.pending[~matched]
+        self.details = pd.concat([self.details[~self.details.index.isin(details.index)], details.assign(seen=now)])
+        return len(details)
+
+    def prune(self, now: int) -> None:
+        today = now // seconds_per_day * seconds_per_day
+        self.days = {day: cells for day, cells in self.days.items() if day > today - max(self.windows) * seconds_per_day}
+        self.events = self.events[self.events["day"] + mention_window >= today]
+        self.details = self.details[self.details["seen"] >= now - seconds_per_day]
+        self.pending = self.pending[self.pending["seen"] >= now - seconds_per_day]
+
+    def features(self, day: int) -> dict[int, pd.DataFrame]:
+        frames = {}
+        for window in self.windows:
+            sums = np.zeros((len(sum_names), categories))
+            for offset in range(window):
+                sums += self.days.get(day - offset * seconds_per_day, 0)
+            frames[window] = make_feature_frame(window_ratios({name: sums[None, i] for i, name in enumerate(sum_names)}), np.array([day]))
+        return frames
+
+
+def write_features(frames: dict[int, pd.DataFrame], scalers: dict, panel: pd.DataFrame | None, day: int) -> None:
+    for window, frame in frames.items():
+        if window in scalers:
+            frame[mention_columns] = scalers[window].transform(frame[mention_columns])
+        if panel is not None:
+            frame[panel.columns] = panel.reindex([pd.Timestamp(day, unit="s")]).to_numpy()
+
+        path = make_live_path(window)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        frame.to_csv(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+async def live(engine: str, storage: str, executor: ResourceExecutor, keys: str = "url", windows: list[int] = [1, 2, 3, 5, 8, 13, 21], names: list[str] = ["spx", "btc"], interval: float = 5.0, seed: bool = True, polls: int | None = None) -> None:
+    store = make_store(storage)
+    state = LiveAggregator(windows, keys)
+    columns = make_collect_columns(keys)
+    if seed:
+        print("Seeded events:", state.seed(store, int(time.time())))
+        print("Replayed files:", state.replay(store, columns))
+
+    scalers = {window: joblib.load(make_scaler_path(window)) for window in windows if os.path.exists(make_scaler_path(window))}
+    panel = load_panel(names)[0] if os.path.exists(make_panel_path()) else None
+
+    # downloads report to a progress that is never started, so each slice prints one line instead of a bar
+    progress = make_progress()
+    task_id = progress.add_task("Downloading", total=None)
+
+    session = make_session(8)
+    ledger = Ledger()
+    seen: set[str] = set()
+    try:
+        while polls is None or polls > 0:
+            if polls is not None:
+                polls -= 1
+            try:
+                update = index_masterlist(download_lastupdate())
+            except (urllib.error.URLError, OSError) as exc:
+                print("Polling failed:", exc)
+                await asyncio.sleep(interval)
+                continue
+
+            update = update[update["type"].isin(data_types.keys()) & ~update["url"].isin(seen)]
+            if len(update) == 0:
+                await asyncio.sleep(interval)
+                continue
+
+            detected = time.time()
+            now = int(update["timestamp"].max())
+            counts = {}
+            for masterlist_type, data_type in data_types.items():
+                rows = update[update["type"] == masterlist_type]
+                # files parsed before this run are part of a collected quarter or were replayed by the seed
+                files = master_files(rows)
+                entries = ledger.load(storage, data_type, [date for _, _, date, _, _ in files])
+                output = output_format(data_type, keys)
+                backfill(ledger, entries, store, storage, data_type, files, output, output_columns(data_type, keys))
+                fresh = [(str(year), str(date)) for year, date, md5 in rows[["year", "date", "md5"]].itertuples(False) if not is_valid(entries.get(str(date)), store, data_type, str(year), str(date), None if pd.isna(md5) else str(md5), output)]
+                await download_all(rows, data_type, cache=True, engine=engine, storage=storage, session=session, keys=keys, progress=progress, task_id=task_id, executor=executor)
+
+                counts[data_type] = 0
+                for year, date in fresh:
+                    if not store.has_file(data_type, year, date):
+                        continue
+                    df = store.read_files(data_type, year, [date], columns[data_type])
+                    if data_type == "event":
+                        counts[data_type] += state.add_events(df)
+                    elif data_type == "mention":
+                        counts[data_type] += state.add_mentions(df, now)
+                    else:
+                        counts[data_type] += state.add_details(df, now)
+            seen.update(update["url"])
+
+            state.prune(now)
+            day = now // seconds_per_day * seconds_per_day
+            write_features(state.features(day), scalers, panel, day)
+
+            latency = time.time() - detected
+            executor.metrics.add("live", start=detected, files=len(update), slices=1, events=counts["event"], mentions=counts["mention"], details=counts["detail"], latency_seconds=latency, peak_latency_seconds=latency)
+            print(f"{pd.Timestamp(now, unit='s')}: {counts['event']} events, {counts['mention']} mentions, {counts['detail']} details, features updated in {latency:.2f}s")
+            await asyncio.sleep(interval)
+    finally:
+        ledger.close()
+        await session.close()
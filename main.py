@@ -1,103 +1,91 @@
+import argparse
 import asyncio
 
-from colorama import Fore, Style
-
-from aggregating import aggregate
-from collecting import collect_all
-from financial import process_all_financial_files
-from masterlist import download_masterlist, process_masterlist, split_masterlist, get_years, split_into_years
-from downloading import download_all
-from quarterizing import quarterize
-
 
 async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", nargs="?", default="full", choices=["full", "incremental", "retry-failed", "live"])
+    # both in GiB; by default tasks are admitted against three quarters of the machine's memory and a collect gets a quarter of that
+    parser.add_argument("--memory-limit", type=float, default=None)
+    parser.add_argument("--collect-memory", type=float, default=None)
+    parser.add_argument("--engine", default="pandas", choices=["pandas", "pyarrow"])
+    parser.add_argument("--collect-engine", default="pandas", choices=["pandas", "pyarrow"])
+    args = parser.parse_args()
+
+    # imported here rather than at module scope, since spawn and forkserver workers re-import this script on startup
+    from colorama import Fore, Style
+    from executing import ResourceExecutor
+    from live import live
+    from masterlist import load_masterlist_index, query_masterlist
+    from metrics import Metrics
+    from pipeline import collect_budget, incremental, pipelined, retry_failed
+
     cache: bool = True
-    total_stages: int = 10
-    years_to_process: list[int] = [2021, 2022, 2023, 2024, 2025]
-    quarters_in_years: list[tuple[list[int], int]] = [([1, 2, 3, 4], year) for year in years_to_process]
+    engine: str = args.engine
+    collect_engine: str = args.collect_engine
+    storage: str = "csv"
+    memory_budget: int | None = int(args.collect_memory * 1024 ** 3) if args.collect_memory is not None else None
+    keys: str = "url"
+    memory_limit: int | None = int(args.memory_limit * 1024 ** 3) if args.memory_limit is not None else None
+    total_stages: int = 3
+    start: str = "2021-01-01"
+    end: str = "2026-01-01"
 
     print("Processing data")
+    print(f"Mode: {args.mode}")
     print("Using cache" if cache else "Not using cache")
+    print(f"Parsing with {engine}")
+    print(f"Collecting with {collect_engine}")
+    print(f"Storing as {storage}")
+    print(f"Joining on {keys} keys")
+    print("")
+
+    metrics = Metrics()
+
+    if args.mode == "incremental":
+        # one pool for every stage, so workers import pandas, pyarrow and sklearn once per run
+        with ResourceExecutor(memory_budget=memory_limit, metrics=metrics) as executor:
+            await incremental(start, engine, storage, executor, memory_budget or collect_budget(executor), keys, collect_engine)
+        print("Report:", metrics.save(mode=args.mode, engine=engine, storage=storage, keys=keys))
+        return
+
+    if args.mode == "retry-failed":
+        with ResourceExecutor(memory_budget=memory_limit, metrics=metrics) as executor:
+            await retry_failed(engine, storage, executor, keys)
+        print("Report:", metrics.save(mode=args.mode, engine=engine, storage=storage, keys=keys))
+        return
+
+    if args.mode == "live":
+        with ResourceExecutor(memory_budget=memory_limit, workers=3, metrics=metrics) as executor:
+            try:
+                await live(engine, storage, executor, keys)
+            finally:
+                print("Report:", metrics.save(mode=args.mode, engine=engine, storage=storage, keys=keys))
+        return
+
     print(f"Total stages: {total_stages}")
     print("")
 
-    masterlist = download_masterlist(cache=cache)
+    index = load_masterlist_index(cache=cache)
     print(Fore.GREEN + f"Progress 1/{total_stages}" + Style.RESET_ALL)
-    print("Finished downloading masterlist")
-    print("Total files:", len(masterlist))
+    print("Finished loading masterlist index")
+    print("Total files:", len(index))
     print("")
 
-    masterlist = process_masterlist(masterlist, cache=cache)
+    events = query_masterlist(index, "export", start, end)
+    mentions = query_masterlist(index, "mentions", start, end)
+    details = query_masterlist(index, "gkg", start, end)
     print(Fore.GREEN + f"Progress 2/{total_stages}" + Style.RESET_ALL)
-    print("Finished processing masterlist")
-    print("")
-
-    events, mentions, details = split_masterlist(masterlist, cache=cache)
-    print(Fore.GREEN + f"Progress 3/{total_stages}" + Style.RESET_ALL)
-    print("Finished splitting masterlist")
+    print(f"Selected files from {start} to {end}")
     print("Number of event files:", len(events))
     print("Number of mention files:", len(mentions))
     print("Number of detail files:", len(details))
     print("")
 
-    years = get_years(masterlist)
-    print(Fore.GREEN + f"Progress 4/{total_stages}" + Style.RESET_ALL)
-    print("Extracted years from masterlist")
-    print("Number of years:", len(years))
-    print("")
-
-    events = split_into_years(events, years)
-    mentions = split_into_years(mentions, years)
-    details = split_into_years(details, years)
-    print(Fore.GREEN + f"Progress 5/{total_stages}" + Style.RESET_ALL)
-    print("Finished splitting masterlist into years")
-    print("")
-
-    for year in years_to_process:
-        print(f"Downloading events for year {year}")
-        await download_all(events[year], "event", cache=cache)
-        print("")
-
-        print(f"Downloading details for year {year}")
-        await download_all(details[year], "detail", cache=cache)
-        print("")
-
-        print(f"Downloading mentions for year {year}")
-        await download_all(mentions[year], "mention", cache=cache)
-        print("")
-    print(Fore.GREEN + f"Progress 6/{total_stages}" + Style.RESET_ALL)
-    print("Finished downloading all data")
-    print("")
-
-    print(f"Quarterizing events")
-    await quarterize(quarters_in_years, "event", cache=cache)
-    print(f"Quarterizing details")
-    await quarterize(quarters_in_years, "detail", cache=cache)
-    print(f"Quarterizing mentions")
-    await quarterize(quarters_in_years, "mention", cache=cache)
-    print(Fore.GREEN + f"Progress 7/{total_stages}" + Style.RESET_ALL)
-    print("Finished quarterizing all data")
-    print("")
-
-    await collect_all(quarters_in_years, cache=cache)
-    print(Fore.GREEN + f"Progress 8/{total_stages}" + Style.RESET_ALL)
-    print("Finished collecting all data")
-    print("")
-
-    await process_all_financial_files(["spx", "btc"])
-    print(Fore.GREEN + f"Progress 9/{total_stages}" + Style.RESET_ALL)
-    print("Finished processing financial files")
-    print("")
-
-    aggregate(["spx", "btc"], days=1)
-    aggregate(["spx", "btc"], days=2)
-    aggregate(["spx", "btc"], days=3)
-    aggregate(["spx", "btc"], days=5)
-    aggregate(["spx", "btc"], days=8)
-    aggregate(["spx", "btc"], days=13)
-    aggregate(["spx", "btc"], days=21)
-    print(Fore.GREEN + f"Progress 10/{total_stages}" + Style.RESET_ALL)
-    print("Finished aggregating data all data")
+    await pipelined(index, start, end, cache, engine, storage, memory_budget, keys, memory_limit, metrics, collect_engine)
+    print(Fore.GREEN + f"Progress 3/{total_stages}" + Style.RESET_ALL)
+    print("Finished downloading, quarterizing, collecting and aggregating all data")
+    print("Report:", metrics.save(mode=args.mode, engine=engine, storage=storage, keys=keys, start=start, end=end))
     print("")
 
     print("Done")
@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+
+from ledger import Ledger, is_valid
+from parsing import output_format
+from storing import make_store, quarter_of
+
+data_types = {"export": "event", "mentions": "mention", "gkg": "detail"}
+manifest_columns = ["url", "type", "year", "date", "size", "md5"]
+
+def make_manifest_path():
+    return os.path.join("data/manifest/", "processed.csv.gz")
+
+def make_pending_path():
+    return os.path.join("data/manifest/", "pending.csv.gz")
+
+def make_offset_path():
+    return os.path.join("data/manifest/", "masterlist_offset.txt")
+
+def _read(path: str) -> pd.DataFrame:
+    if os.path.exists(path):
+        return pd.read_csv(path, dtype=str).reindex(columns=manifest_columns)
+    return pd.DataFrame(columns=manifest_columns, dtype=str)
+
+def concat_rows(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    # an empty manifest or pending list is left out, so its object columns do not decide the dtypes
+    return pd.concat([df for df in frames if len(df) > 0] or frames[:1])
+
+def _write(df: pd.DataFrame, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.reindex(columns=manifest_columns).to_csv(path + ".tmp", index=False, compression="gzip")
+    os.replace(path + ".tmp", path)
+
+def load_manifest() -> pd.DataFrame:
+    return _read(make_manifest_path())
+
+def load_pending() -> pd.DataFrame:
+    return _read(make_pending_path())
+
+def load_offset() -> int:
+    if os.path.exists(make_offset_path()):
+        with open(make_offset_path()) as file:
+            return int(file.read().strip() or 0)
+    return 0
+
+def save_offset(offset: int) -> None:
+    os.makedirs(os.path.dirname(make_offset_path()), exist_ok=True)
+    with open(make_offset_path(), "w") as file:
+        file.write(str(offset))
+
+def diff_masterlist(masterlist: pd.DataFrame, manifest: pd.DataFrame) -> pd.DataFrame:
+    masterlist = masterlist[masterlist["type"].isin(data_types.keys())]
+    masterlist = masterlist.drop_duplicates("url")
+    return masterlist[~masterlist["url"].isin(manifest["url"])]
+
+def record_processed(rows: pd.DataFrame, storage: str = "csv", keys: str = "url") -> pd.DataFrame:
+    store = make_store(storage)
+    rows = rows.reindex(columns=manifest_columns)
+    with Ledger() as ledger:
+        entries = {data_type: ledger.load(storage, data_type, rows.loc[rows["type"] == t, "date"].astype(str)) for t, data_type in data_types.items()}
+    # only files the ledger vouches for count as processed, a truncated one stays pending and is fetched again
+    valid = [is_valid(entries[data_types[t]].get(str(d)), store, data_types[t], str(y), str(d), None if pd.isna(m) else str(m), output_format(data_types[t], keys)) for t, y, d, m in rows[["type", "year", "date", "md5"]].itertuples(False)]
+    processed = rows[pd.Series(valid, index=rows.index, dtype=bool)]
+    pending = rows[~rows["url"].isin(processed["url"])]
+
+    manifest = concat_rows([load_manifest(), processed.astype({"year": str, "date": str})]).drop_duplicates("url")
+    _write(manifest, make_manifest_path())
+    _write(pending.astype({"year": str, "date": str}), make_pending_path())
+
+    return processed
+
+def previous_quarter(year: int, quarter: int) -> (int, int):
+    if quarter == 1:
+        return year - 1, 4
+    return year, quarter - 1
+
+def affected_quarters(rows: pd.DataFrame) -> dict[str, set[tuple[int, int]]]:
+    affected: dict[str, set[tuple[int, int]]] = {data_type: set() for data_type in data_types.values()}
+    for t, y, d in rows[["type", "year", "date"]].itertuples(False):
+        affected[data_types[t]].add((int(y), quarter_of(str(d))))
+    return affected
+
+def collect_quarters(affected: dict[str, set[tuple[int, int]]]) -> set[tuple[int, int]]:
+    quarters = set(affected["event"]) | affected["mention"] | affected["detail"]
+    # mentions and details of a quarter also feed the one-week lookahead of the quarter before it
+    quarters |= {previous_quarter(year, quarter) for year, quarter in affected["mention"] | affected["detail"]}
+    return quarters
+
+def group_quarters(quarters: set[tuple[int, int]]) -> list[tuple[list[int], int]]:
+    years = sorted({year for year, _ in quarters})
+    return [(sorted(quarter for y, quarter in quarters if y == year), year) for year in years]
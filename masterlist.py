@@ -1,7 +1,14 @@
+import io
 import os
+import urllib.error
+import urllib.request
 
 import pandas as pd
-from pandas import DataFrame
+import pyarrow as pa
+import pyarrow.compute as pc
+
+masterlist_url = "http://data.gdeltproject.org/gdeltv2/masterfilelist.txt"
+lastupdate_url = "http://data.gdeltproject.org/gdeltv2/lastupdate.txt"
 
 
 def download_masterlist(cache: bool = False) -> pd.DataFrame:
@@ -9,8 +16,7 @@ def download_masterlist(cache: bool = False) -> pd.DataFrame:
         if os.path.exists("data/masterlist/masterlist_raw.csv.gz"):
             return pd.read_csv("data/masterlist/masterlist_raw.csv.gz")
 
-    masterlist: pd.DataFrame = pd.read_csv("http://data.gdeltproject.org/gdeltv2/masterfilelist.txt", sep=" ", header=None, low_memory=False, dtype=str, names=[0, 1, "url"])
-    masterlist = masterlist.drop(columns=[0, 1])
+    masterlist: pd.DataFrame = pd.read_csv(masterlist_url, sep=" ", header=None, low_memory=False, dtype=str, names=["size", "md5", "url"])
 
     if cache:
         os.makedirs("data/masterlist", exist_ok=True)
@@ -18,56 +24,94 @@ def download_masterlist(cache: bool = False) -> pd.DataFrame:
 
     return masterlist
 
-def process_masterlist(masterlist: pd.DataFrame, cache: bool = False) -> pd.DataFrame:
+def download_masterlist_tail(offset: int = 0) -> (pd.DataFrame, int):
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(masterlist_url, headers=headers)) as response:
+            body = response.read()
+            if offset > 0 and response.status != 206:
+                body = body[offset:]
+    except urllib.error.HTTPError as exc:
+        if exc.code != 416:
+            raise
+        body = b""
+
+    # the masterlist only ever grows, so everything up to the last complete line is settled
+    end = body.rfind(b"\n") + 1
+    if end == 0:
+        return pd.DataFrame(columns=["size", "md5", "url"], dtype=str), offset
+
+    masterlist: pd.DataFrame = pd.read_csv(io.BytesIO(body[:end]), sep=" ", header=None, low_memory=False, dtype=str, names=["size", "md5", "url"])
+
+    return masterlist, offset + end
+
+def download_lastupdate() -> pd.DataFrame:
+    # the newest export, mentions and gkg slice, in the same format as the masterlist
+    with urllib.request.urlopen(lastupdate_url) as response:
+        body = response.read()
+    if body.strip() == b"":
+        return pd.DataFrame(columns=["size", "md5", "url"], dtype=str)
+    return pd.read_csv(io.BytesIO(body), sep=" ", header=None, low_memory=False, dtype=str, names=["size", "md5", "url"])
+
+def make_index_path():
+    return os.path.join("data/masterlist/", "masterlist_index.feather")
+
+def to_timestamp(value: str | pd.Timestamp | int) -> int:
+    if isinstance(value, int):
+        return value
+    return pd.Timestamp(value).value // 1000000000
+
+def index_masterlist(masterlist: pd.DataFrame, cache: bool = False) -> pd.DataFrame:
     if cache:
-        if os.path.exists("data/masterlist/masterlist_processed.csv.gz"):
-            return pd.read_csv("data/masterlist/masterlist_processed.csv.gz")
-
-    masterlist["date"] = masterlist["url"].str.split("/").str[4].str.split(".", n=1).str[0]
-
-    masterlist["year"]   = masterlist["date"].str[0:4]
-    masterlist["month"]  = masterlist["date"].str[4:6]
-    masterlist["day"]    = masterlist["date"].str[6:8]
-    masterlist["hour"]   = masterlist["date"].str[8:10]
-    masterlist["minute"] = masterlist["date"].str[10:12]
-    masterlist["second"] = masterlist["date"].str[12:14]
-
-    masterlist["type"] = masterlist["url"].str.split("/").str[4].str.split(".", n=2).str[1]
+        if os.path.exists(make_index_path()):
+            return pd.read_feather(make_index_path())
+
+    # a masterlist cached before the size and md5 columns were kept has neither, and its files are not verified
+    masterlist = masterlist.reindex(columns=["size", "md5", "url"])
+    urls = pa.array(masterlist["url"], type=pa.string(), from_pandas=True)
+    parts = pc.extract_regex(urls, r"/(?P<date>\d{14})\.(?P<type>[^./]+)\.[^/]*$")
+    valid = pc.is_valid(parts)
+    urls = urls.filter(valid)
+    parts = parts.filter(valid)
+    dates = pc.struct_field(parts, "date")
+    masterlist = masterlist[valid.to_numpy(zero_copy_only=False)]
+
+    index = pd.DataFrame({
+        "url": urls.to_pandas().astype("string[pyarrow]"),
+        "type": pc.dictionary_encode(pc.struct_field(parts, "type")).to_pandas(),
+        "date": pc.cast(dates, pa.int64()).to_numpy(),
+        "timestamp": pc.cast(pc.strptime(dates, format="%Y%m%d%H%M%S", unit="s"), pa.int64()).to_numpy(),
+        "size": pd.to_numeric(masterlist["size"], errors="coerce").astype("Int64").array,
+        "md5": masterlist["md5"].astype("string[pyarrow]").array,
+    })
+    index["year"] = (index["date"] // 10000000000).astype("int16")
+    index = index.sort_values("timestamp", kind="stable", ignore_index=True)
 
     if cache:
-        os.makedirs("data/masterlist", exist_ok=True)
-        masterlist.to_csv("data/masterlist/masterlist_processed.csv.gz", index=False, compression="gzip")
+        os.makedirs(os.path.dirname(make_index_path()), exist_ok=True)
+        index.to_feather(make_index_path())
 
-    return masterlist
+    return index
 
-def split_masterlist(masterlist: pd.DataFrame, cache: bool = False) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
+def load_masterlist_index(cache: bool = False) -> pd.DataFrame:
     if cache:
-        if os.path.exists("data/masterlist/masterlist_events.csv.gz") and os.path.exists("data/masterlist/masterlist_mentions.csv.gz") and os.path.exists("data/masterlist/masterlist_details.csv.gz"):
-            events = pd.read_csv("data/masterlist/masterlist_events.csv.gz")
-            mentions = pd.read_csv("data/masterlist/masterlist_mentions.csv.gz")
-            details = pd.read_csv("data/masterlist/masterlist_details.csv.gz")
-
-            return events, mentions, details
-
-    events: pd.DataFrame = masterlist[masterlist["type"] == "export"]
-    mentions: pd.DataFrame = masterlist[masterlist["type"] == "mentions"]
-    details: pd.DataFrame = masterlist[masterlist["type"] == "gkg"]
-
-    if cache:
-        os.makedirs("data/masterlist", exist_ok=True)
-        events.to_csv("data/masterlist/masterlist_events.csv.gz", index=False, compression="gzip")
-        mentions.to_csv("data/masterlist/masterlist_mentions.csv.gz", index=False, compression="gzip")
-        details.to_csv("data/masterlist/masterlist_details.csv.gz", index=False, compression="gzip")
+        if os.path.exists(make_index_path()):
+            return pd.read_feather(make_index_path())
 
-    return events, mentions, details
+    return index_masterlist(download_masterlist(cache=cache), cache=cache)
 
-def get_years(masterlist: pd.DataFrame) -> list[int]:
-    return masterlist["year"].dropna().unique().astype(int).tolist()
+def query_masterlist(index: pd.DataFrame, masterlist_type: str | None = None, start: str | pd.Timestamp | int | None = None, end: str | pd.Timestamp | int | None = None) -> pd.DataFrame:
+    timestamps = index["timestamp"].to_numpy()
+    lower = 0 if start is None else timestamps.searchsorted(to_timestamp(start), side="left")
+    upper = len(index) if end is None else timestamps.searchsorted(to_timestamp(end), side="left")
+    selected = index.iloc[lower:upper]
 
-def split_into_years(masterlist: pd.DataFrame, years: list[int]) -> dict[int, pd.DataFrame]:
-    to_return: dict[int, pd.DataFrame] = {}
+    if masterlist_type is not None:
+        selected = selected[selected["type"] == masterlist_type]
 
-    for year in years:
-        to_return[year] = masterlist[masterlist["year"] == year]
+    return selected
 
-    return to_return
\ No newline at end of file
+def quarters_between(start: str | pd.Timestamp, end: str | pd.Timestamp) -> list[tuple[list[int], int]]:
+    periods = pd.period_range(pd.Timestamp(start), pd.Timestamp(end) - pd.Timedelta(seconds=1), freq="Q")
+    years = sorted({period.year for period in periods})
+    return [([period.quarter for period in periods if period.year == year], year) for year in years]
@@ -0,0 +1,87 @@
+import json
+import os
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+seconds_per_day = 60 * 60 * 24
+
+def make_matrix_path(days: int):
+    return os.path.join("data/files/aggregated/", str(days), "features.bin")
+
+def make_schema_path(days: int):
+    return os.path.join("data/files/aggregated/", str(days), "features.json")
+
+def has_matrix(days: int) -> bool:
+    return os.path.exists(make_matrix_path(days)) and os.path.exists(make_schema_path(days))
+
+def load_schema(days: int) -> dict:
+    with open(make_schema_path(days)) as file:
+        return json.load(file)
+
+def _save_schema(schema: dict, days: int) -> None:
+    with open(make_schema_path(days) + ".tmp", "w") as file:
+        json.dump(schema, file, indent=2)
+    os.replace(make_schema_path(days) + ".tmp", make_schema_path(days))
+
+def write_matrix(df: pd.DataFrame, days: int, start: int, targets: list[str] | None = None) -> None:
+    # rows are consecutive days from start, stored row-major so a window of days is one contiguous slice
+    schema = {
+        "dtype": "float64",
+        "rows": len(df),
+        "columns": df.columns.tolist(),
+        "types": {column: str(dtype) for column, dtype in df.dtypes.items()},
+        "targets": targets or [],
+        "start": int(start),
+        "step": seconds_per_day,
+    }
+    os.makedirs(os.path.dirname(make_matrix_path(days)), exist_ok=True)
+    with open(make_matrix_path(days) + ".tmp", "wb") as file:
+        file.write(np.ascontiguousarray(df.to_numpy(dtype=np.float64)).tobytes())
+    os.replace(make_matrix_path(days) + ".tmp", make_matrix_path(days))
+    _save_schema(schema, days)
+
+def append_matrix(df: pd.DataFrame, days: int, keep: int | None = None) -> None:
+    schema = load_schema(days)
+    if df.columns.tolist() != schema["columns"]:
+        raise ValueError(f"Columns do not match the feature matrix for {days} days")
+
+    # the schema is only updated after the rows are on disk, so bytes past its row count are from an interrupted append,
+    # and rows past keep are replaced by the new ones
+    rows = schema["rows"] if keep is None else min(keep, schema["rows"])
+    row_bytes = len(schema["columns"]) * np.dtype(schema["dtype"]).itemsize
+    with open(make_matrix_path(days), "r+b") as file:
+        file.truncate(rows * row_bytes)
+        file.seek(0, os.SEEK_END)
+        file.write(np.ascontiguousarray(df.to_numpy(dtype=schema["dtype"])).tobytes())
+    _save_schema({**schema, "rows": rows + len(df)}, days)
+
+def load_matrix(days: int) -> (np.memmap, dict):
+    schema = load_schema(days)
+    shape = (schema["rows"], len(schema["columns"]))
+    if schema["rows"] == 0:
+        return np.zeros(shape, dtype=schema["dtype"]), schema
+    return np.memmap(make_matrix_path(days), dtype=schema["dtype"], mode="r", shape=shape), schema
+
+def matrix_timestamps(schema: dict) -> np.ndarray:
+    return schema["start"] + np.arange(schema["rows"], dtype=np.int64) * schema["step"]
+
+def iter_windows(days: int, lookback: int, targets: list[str] | None = None, horizon: int = 1, batch_size: int = 256, shuffle: bool = False, seed: int = 0) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    matrix, schema = load_matrix(days)
+    targets = targets or schema["targets"]
+    target_columns = [schema["columns"].index(target) for target in targets]
+
+    # window i covers rows i .. i + lookback - 1 and is paired with the targets horizon rows after its last row
+    samples = schema["rows"] - lookback - horizon + 1
+    if samples <= 0:
+        return
+    windows = np.lib.stride_tricks.sliding_window_view(matrix, lookback, axis=0).transpose(0, 2, 1)
+    starts = np.arange(0, samples, batch_size)
+    if shuffle:
+        np.random.default_rng(seed).shuffle(starts)
+
+    for first in starts:
+        last = min(first + batch_size, samples)
+        # slicing the strided view keeps the windows on the memory map, only the targets are gathered
+        yield windows[first:last], matrix[first + lookback - 1 + horizon:last + lookback - 1 + horizon][:, target_columns]
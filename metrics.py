@@ -0,0 +1,63 @@
+import json
+import os
+import time
+
+
+def make_report_path(started: float):
+    return os.path.join("data/reports/", time.strftime("%Y%m%d%H%M%S", time.localtime(started)) + ".json")
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.stages: dict[str, dict[str, float]] = {}
+        self.spans: dict[str, tuple[float, float]] = {}
+        self.workers: dict[int, int] = {}
+
+    def add(self, stage: str, start: float | None = None, end: float | None = None, **counters: float | None) -> None:
+        totals = self.stages.setdefault(stage, {})
+        for name, value in counters.items():
+            if value is None:
+                continue
+            # peaks are maxima over the tasks of a stage, everything else adds up
+            if name.startswith("peak_"):
+                totals[name] = max(totals.get(name, 0), value)
+            else:
+                totals[name] = totals.get(name, 0) + value
+
+        end = end or time.time()
+        start = start or end
+        first, last = self.spans.get(stage, (start, end))
+        self.spans[stage] = (min(first, start), max(last, end))
+
+    def worker(self, pid: int, peak_rss: int) -> None:
+        self.workers[pid] = max(self.workers.get(pid, 0), peak_rss)
+
+    def report(self, **run) -> dict:
+        stages = {}
+        for stage, totals in self.stages.items():
+            first, last = self.spans[stage]
+            wall = last - first
+            stages[stage] = {"wall_seconds": wall, **totals}
+            if wall > 0:
+                for counter, rate in [("files", "files_per_second"), ("tasks", "tasks_per_second"), ("bytes_in", "bytes_per_second"), ("bytes_downloaded", "download_bytes_per_second")]:
+                    if counter in totals:
+                        stages[stage][rate] = totals[counter] / wall
+
+        finished = time.time()
+        return {
+            **run,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(finished)),
+            "wall_seconds": finished - self.started,
+            "stages": stages,
+            "workers": {str(pid): {"peak_rss": rss} for pid, rss in sorted(self.workers.items())},
+        }
+
+    def save(self, **run) -> str:
+        path = make_report_path(self.started)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.report(**run), file, indent=2)
+        os.replace(path + ".tmp", path)
+        return path
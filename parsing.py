@@ -0,0 +1,362 @@
+import gzip
+import re
+import zipfile
+from typing import IO
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from pandas.errors import ParserError
+
+from schema import apply_schema, column_types, from_gdelt
+from storing import make_store
+
+event_cols = [
+    "GlobalEventID",           # 01 – unique 64-bit identifier for this event row
+    "SQLDATE",                 # 02 – event date (YYYYMMDD) taken from the text
+    "MonthYear",               # 03 – same date in YYYYMM format
+    "Year",                    # 04 – four-digit year of the event
+    "FractionDate",            # 05 – YYYY.fraction_of_year (approximate)
+
+    # -------- actor 1 ---------------------------------------------------
+    "Actor1Code",              # 06 – full CAMEO actor code (geo+role+type chain)
+    "Actor1Name",              # 07 – canonical actor name (“UNITED STATES”, “HAMAS”)
+    "Actor1CountryCode",       # 08 – 3-letter CAMEO country for actor 1
+    "Actor1KnownGroupCode",    # 09 – if actor 1 is a known org/rebel group
+    "Actor1EthnicCode",        # 10 – ethnic affiliation code (rarely filled)
+    "Actor1Religion1Code",     # 11 – primary religion code
+    "Actor1Religion2Code",     # 12 – secondary religion code (e.g., Catholic)
+    "Actor1Type1Code",         # 13 – primary role / type (GOV, BUS, MIL, REF …)
+    "Actor1Type2Code",         # 14 – secondary role / qualifier
+    "Actor1Type3Code",         # 15 – tertiary role (seldom used)
+
+    # -------- actor 2 ---------------------------------------------------
+    "Actor2Code",              # 16 – full CAMEO code for actor 2 (may be blank)
+    "Actor2Name",              # 17 – canonical name of actor 2
+    "Actor2CountryCode",       # 18 – country of actor 2
+    "Actor2KnownGroupCode",    # 19 – known org code for actor 2
+    "Actor2EthnicCode",        # 20 – ethnic code for actor 2
+    "Actor2Religion1Code",     # 21 – primary religion code actor 2
+    "Actor2Religion2Code",     # 22 – secondary religion code actor 2
+    "Actor2Type1Code",         # 23 – primary role / type actor 2
+    "Actor2Type2Code",         # 24 – secondary role actor 2
+    "Actor2Type3Code",         # 25 – tertiary role actor 2
+
+    # -------- event action attributes ----------------------------------
+    "IsRootEvent",             # 26 – 1 if sentence is in lead paragraph, else 0
+    "EventCode",               # 27 – 4-digit CAMEO action code (e.g., 1730)
+    "EventBaseCode",           # 28 – level-2 parent of the action code
+    "EventRootCode",           # 29 – level-1 root of the action code
+    "QuadClass",               # 30 – 1=VerbalCoop 2=MatCoop 3=VerbConf 4=MatConf
+    "GoldsteinScale",          # 31 – impact weight (–10 … +10) assigned to action
+    "NumMentions",             # 32 – mentions in the 15-min ingest slice
+    "NumSources",              # 33 – distinct sources in that slice
+    "NumArticles",             # 34 – distinct documents in that slice
+    "AvgTone",                 # 35 – mean doc-level tone (–100 … +100)
+
+    # -------- geography : actor 1 --------------------------------------
+    "Actor1Geo_Type",          # 36 – 1=country, 2=US-state, 3=US-city, 4=world-city, 5=world-state
+    "Actor1Geo_Fullname",      # 37 – “City/Region, ADM1, Country” human label
+    "Actor1Geo_CountryCode",   # 38 – 2-letter FIPS10-4 country code
+    "Actor1Geo_ADM1Code",      # 39 – Country+ADM1 FIPS (e.g., ‘USNY’)
+    "Actor1Geo_ADM2Code",      # 40 – GAUL ADM2 or US county code
+    "Actor1Geo_Lat",           # 41 – centroid latitude
+    "Actor1Geo_Long",          # 42 – centroid longitude
+    "Actor1Geo_FeatureID",     # 43 – GNS/GNIS feature ID
+
+    # -------- geography : actor 2 --------------------------------------
+    "Actor2Geo_Type",          # 44 – location resolution for actor 2
+    "Actor2Geo_Fullname",      # 45 – human-readable place name
+    "Actor2Geo_CountryCode",   # 46 – country code
+    "Actor2Geo_ADM1Code",      # 47 – ADM1 code
+    "Actor2Geo_ADM2Code",      # 48 – ADM2 code
+    "Actor2Geo_Lat",           # 49 – latitude
+    "Actor2Geo_Long",          # 50 – longitude
+    "Actor2Geo_FeatureID",     # 51 – feature ID
+
+    # -------- geography : action location ------------------------------
+    "ActionGeo_Type",          # 52 – resolution of the action location
+    "ActionGeo_Fullname",      # 53 – place tied to the verb phrase
+    "ActionGeo_CountryCode",   # 54 – country code
+    "ActionGeo_ADM1Code",      # 55 – ADM1 code
+    "ActionGeo_ADM2Code",      # 56 – ADM2 code
+    "ActionGeo_Lat",           # 57 – latitude
+    "ActionGeo_Long",          # 58 – longitude
+    "ActionGeo_FeatureID",     # 59 – feature ID
+
+    # -------- bookkeeping ----------------------------------------------
+    "DATEADDED",               # 60 – UTC timestamp (YYYYMMDDhhmmss) when row entered GDELT
+    "SOURCEURL"                # 61 – first article or citation that generated the event
+]
+
+mentions_cols = [
+    "GlobalEventID",            # 01 – unique 64-bit identifier for this event row
+    "SQLDATE",                  # 02 – event’s SQLDATE (YYYYMMDDhhmmss)
+    "MentionTimeDate",          # 03 – when THIS mention was published / first seen (YYYYMMDDhhmmss)
+    "MentionType",              # 04 – 1=story lead, 2=story text, 3=blog, etc.
+    "MentionSourceName",        # 05 – outlet ID (domain-style string)
+    "MentionIdentifier",        # 06 – the article URL (or broadcast clip ID)
+    "SentenceID",               # 07 – which sentence inside the article (1-based)
+    "Actor1CharOffset",         # 08 – character offset where Actor1 starts in that sentence
+    "Actor2CharOffset",         # 09 – …Actor2 starts
+    "ActionCharOffset",         # 10 – …the action verb starts
+    "InRawText",                # 11 – 1 if the verb phrase appears verbatim, 0 if inferred
+    "Confidence",               # 12 – system confidence (0-100)
+    "MentionDocLen",            # 13 – entire document length in words
+    "MentionDocTone",           # 14 – tone score of the whole document (–100 … +100)
+    "MentionDocTranslationInfo",# 15 – (usually blank) info on machine-translated text
+    "Extras"                    # 16 – JSON bundle for future fields (blank pre-2023)
+]
+
+details_cols = [
+    "GKGRECORDID",                 # 01 – unique ID = yyyymmddhhmmss-sequence
+    "DATE",                        # 02 – ingest timestamp (UTC, YYYYMMDDhhmmss)
+    "SourceCollectionIdentifier",  # 03 – 1=Web, 2=Broadcast/Print, 15=Twitter, etc.
+    "SourceCommonName",            # 04 – outlet/domain name (“nytimes.com”)
+    "DocumentIdentifier",          # 05 – URL or broadcast citation
+
+    # —–– COUNT & THEME VECTORS ––––––––––––––––––––––––––––––––––––––––––
+    "Counts",                      # 06 – legacy CAMEO “theme,count” pairs
+    "V2Counts",                    # 07 – enhanced counts (with char offsets)
+    "Themes",                      # 08 – legacy pipe-delimited themes
+    "V2Themes",                    # 09 – enhanced themes (semicolon list)
+
+    # —–– LOCATION & ENTITY LISTS ––––––––––––––––––––––––––––––––––––––––
+    "Locations",                   # 10 – legacy location tuples
+    "V2Locations",                 # 11 – enhanced locations (with offsets & conf)
+    "Persons",                     # 12 – legacy person list
+    "V2Persons",                   # 13 – enhanced persons (name,offset)
+    "Organizations",               # 14 – legacy org list
+    "V2Organizations",             # 15 – enhanced orgs (name,offset)
+
+    # —–– TEXT-LEVEL SENTIMENT & DATES –––––––––––––––––––––––––––––––––––
+    "V2Tone",                      # 16 – “wc:###,c1.1:#,c1.2:#, …”  (word-count + GCAM vector)
+    "Dates",                       # 17 – legacy date expressions
+    "GCAM",                        # 18 – “wc:###,c1.1:#,c1.2:#, …”  (word-count + GCAM vector)
+
+    # —–– MEDIA & EMBEDS ––––––––––––––––––––––––––––––––––––––––––––––––
+    "SharingImage",                # 19 – canonical OpenGraph/Twitter card image URL (if any)
+    "RelatedImages",               # 20 – other images scraped from the page (comma list)
+    "SocialImageEmbeds",           # 21 – embedded social-platform images
+    "SocialVideoEmbeds",           # 22 – embedded social videos (YouTube, Vimeo, …)
+
+    # —–– QUOTATIONS –––––––––––––––––––––––––––––––––––––––––––––––––––––
+    "QuotedPersons",               # 23 – raw quoted-speaker names (“John Smith; …”)
+    "QuotedPersonsCanonical",      # 24 – canonical person IDs if resolvable
+    "Quotations",                  # 25 – the quotation strings themselves
+
+    # —–– NER / MONEY / TRANS ––––––––––––––––––––––––––––––––––––––––––––
+    "AllNames",                    # 26 – every proper name string (not just persons/orgs)
+    "Amounts",                     # 27 – money and quantity expressions (“USD 5 million”)
+    "TranslationInfo",             # 28 – details if the page was machine-translated
+    "Extras"                       # 29 – JSON bundle reserved for future fields
+]
+
+pattern = re.compile(r"(?:^|,)wc:(\d+)|c3\.1:(\d+)|c3\.2:(\d+)|c4\.16:(\d+)")
+
+def extract_gcam(gcam: str):
+    wc = negative = positive = finance = 0
+    for m in pattern.finditer(gcam):
+        if m.group(1):   # wc      WORD COUNT
+            wc = int(m.group(1))
+        elif m.group(2): # c3.1    NEGATIVE
+            negative = int(m.group(2))
+        elif m.group(3): # c3.2    POSITIVE
+            positive = int(m.group(3))
+        elif m.group(4): # c4.16   FINANCE
+            finance = int(m.group(4))
+    return pd.Series([wc, negative, positive, finance])
+
+gcam_dimensions: dict[str, str] = {
+    "wc": "WordCount",  # WORD COUNT
+    "c3.1": "Negative", # NEGATIVE
+    "c3.2": "Positive", # POSITIVE
+    "c4.16": "Finance", # FINANCE
+}
+
+def extract_gcam_arrays(values: pa.Array | pa.ChunkedArray, dimensions: dict[str, str] = gcam_dimensions) -> dict[str, np.ndarray]:
+    # every value is split into code:value tokens once and the wanted codes are pivoted out, so the cost does not grow with the codes
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    pairs = pc.split_pattern(values, ",")
+    rows = pc.list_parent_indices(pairs)
+    parts = pc.split_pattern(pc.list_flatten(pairs), ":", max_splits=1)
+    codes = pc.index_in(pc.list_element(parts, 0), value_set=pa.array(list(dimensions), parts.type.value_type))
+    wanted = pc.and_(pc.is_valid(codes), pc.equal(pc.list_value_length(parts), 2))
+    found = pc.extract_regex(pc.list_element(pc.filter(parts, wanted), 1), r"^(?P<value>\d+)")
+    valid = pc.is_valid(found).to_numpy(zero_copy_only=False)
+    rows = pc.filter(rows, wanted).to_numpy()[valid]
+    codes = pc.filter(codes, wanted).to_numpy().astype(np.int64)[valid]
+    numbers = pc.cast(pc.struct_field(pc.drop_null(found), [0]), pa.int64()).to_numpy()
+    # tokens stay in order within a row, so a repeated code keeps its first value like a regex search would
+    _, first = np.unique(codes * len(values) + rows, return_index=True)
+    table = np.zeros((len(dimensions), len(values)), dtype=np.int64)
+    table[codes[first], rows[first]] = numbers[first]
+    return dict(zip(dimensions.values(), table))
+
+def extract_gcam_columns(gcam: pd.Series, dimensions: dict[str, str] = gcam_dimensions) -> pd.DataFrame:
+    values = pa.array(gcam, type=pa.large_string(), from_pandas=True)
+    return pd.DataFrame(extract_gcam_arrays(values, dimensions), index=gcam.index)
+
+def _magic(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read(4)
+
+def _open_plain(path: str) -> IO[bytes]:
+    # the archive is inflated while the reader consumes it, so the plain text never sits in memory whole
+    magic = _magic(path)
+    if magic[:2] == b"\x1f\x8b":
+        return gzip.open(path, "rb")
+
+    if magic == b"PK\x03\x04":
+        zf = zipfile.ZipFile(path)
+        return zf.open(zf.namelist()[0])
+
+    return open(path, "rb")
+
+def _open_stream(path: str) -> pa.NativeFile:
+    magic = _magic(path)
+    if magic[:2] == b"\x1f\x8b":
+        return pa.input_stream(path, compression="gzip")
+
+    if magic == b"PK\x03\x04":
+        return pa.PythonFile(_open_plain(path), mode="r")
+
+    return pa.memory_map(path)
+
+
+parse_columns: dict[str, list[str]] = {
+    "event": ["GlobalEventID", "SQLDATE", "EventBaseCode", "QuadClass", "GoldsteinScale", "ActionGeo_CountryCode"],
+    "mention": ["GlobalEventID", "MentionTimeDate", "MentionIdentifier"],
+    "detail": ["DocumentIdentifier", "GCAM"],
+}
+
+parse_types: dict[str, pa.DataType] = {**column_types["file"], "GCAM": pa.large_string()}
+
+def _skip_invalid_row(row) -> str:
+    return "skip"
+
+def read_pandas(path: str, data_type: str, dimensions: dict[str, str] = gcam_dimensions) -> pd.DataFrame:
+    names = {"event": event_cols, "mention": mentions_cols, "detail": details_cols}[data_type]
+
+    df: pd.DataFrame = pd.DataFrame()
+    for enc in ("utf-8", "latin-1", None):
+        try:
+            with _open_plain(path) as plain:
+                df = pd.read_csv(
+                    plain,
+                    sep="\t",
+                    header=None,
+                    names=names,
+                    encoding=enc if enc is not None else "utf-8",
+                    encoding_errors="replace" if enc is not None else "strict",
+                )
+            break
+        except UnicodeDecodeError:
+            pass
+
+    if data_type == "detail":
+        df = df[df['GCAM'].notna()]
+        df[list(dimensions.values())] = extract_gcam_columns(df["GCAM"], dimensions)
+
+    return df
+
+def _binary_type(dtype: pa.DataType) -> pa.DataType:
+    if pa.types.is_dictionary(dtype):
+        dtype = dtype.value_type
+    if pa.types.is_large_string(dtype):
+        return pa.large_binary()
+    if pa.types.is_string(dtype):
+        return pa.binary()
+    return dtype
+
+def _decode_binary(table: pa.Table, types: dict[str, pa.DataType]) -> pa.Table:
+    # invalid bytes are replaced value by value, as the pandas reader does, so valid URLs in the same file still join
+    for name, dtype in types.items():
+        if table.schema.field(name).type != dtype:
+            values = table[name].to_pandas().str.decode("utf-8", errors="replace")
+            table = table.set_column(table.schema.get_field_index(name), name, pa.array(values, type=dtype, from_pandas=True))
+    return table
+
+def read_pyarrow(path: str, data_type: str, dimensions: dict[str, str] = gcam_dimensions) -> pd.DataFrame:
+    names = {"event": event_cols, "mention": mentions_cols, "detail": details_cols}[data_type]
+    include = parse_columns[data_type]
+    types = {name: parse_types[name] for name in include}
+
+    table: pa.Table | None = None
+    for binary in (False, True):
+        try:
+            with _open_stream(path) as plain:
+                table = pa_csv.read_csv(
+                    plain,
+                    read_options=pa_csv.ReadOptions(column_names=names),
+                    parse_options=pa_csv.ParseOptions(delimiter="\t", quote_char=False, invalid_row_handler=_skip_invalid_row),
+                    convert_options=pa_csv.ConvertOptions(
+                        include_columns=include,
+                        column_types={name: _binary_type(dtype) if binary else dtype for name, dtype in types.items()},
+                        strings_can_be_null=True,
+                    ),
+                )
+            break
+        except pa.ArrowInvalid as exc:
+            if "UTF8" not in str(exc) or binary:
+                raise ParserError(str(exc)) from exc
+    table = _decode_binary(table, types)
+
+    if data_type == "detail":
+        table = table.filter(pc.is_valid(table["GCAM"]))
+        return pd.DataFrame({
+            "DocumentIdentifier": table["DocumentIdentifier"].to_pandas(),
+            **extract_gcam_arrays(table["GCAM"], dimensions),
+        })
+
+    return table.to_pandas()
+
+key_columns: dict[str, tuple[str, str]] = {
+    "mention": ("MentionIdentifier", "MentionKey"),
+    "detail": ("DocumentIdentifier", "DocumentKey"),
+}
+
+def hash_keys(values: pd.Series) -> pd.Series:
+    # hash_pandas_object uses a fixed hash key, so the same URL maps to the same key in every file and every run
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    return pd.Series(hashes.view(np.int64), index=values.index, name=values.name)
+
+def encode_keys(df: pd.DataFrame, data_type: str, keys: str = "url") -> pd.DataFrame:
+    if keys == "url" or data_type not in key_columns:
+        return df
+    url, key = key_columns[data_type]
+    df = df.assign(**{key: hash_keys(df[url])})
+    if keys == "hash":
+        df = df.drop(columns=[url])
+    return df
+
+def output_columns(data_type: str, keys: str = "url", dimensions: dict[str, str] = gcam_dimensions) -> list[str]:
+    columns = {**parse_columns, "detail": ["DocumentIdentifier", *dimensions.values()]}[data_type]
+    if keys == "url" or data_type not in key_columns:
+        return columns
+    url, key = key_columns[data_type]
+    return [column for column in columns if keys == "check" or column != url] + [key]
+
+def output_format(data_type: str, keys: str = "url", dimensions: dict[str, str] = gcam_dimensions) -> (str, str):
+    # only the options that change a file's columns are part of its identity, so events are reused under any keys
+    return (keys if data_type in key_columns else "", ",".join(f"{code}:{name}" for code, name in dimensions.items()) if data_type == "detail" else "")
+
+def parse_csv(path: str, data_type: str, year: str, date: str, dimensions: dict[str, str] = gcam_dimensions, engine: str = "pandas", storage: str = "csv", keys: str = "url") -> (int, int):
+    columns = {
+        "event": parse_columns["event"],
+        "mention": parse_columns["mention"],
+        "detail": ["DocumentIdentifier", *dimensions.values()]
+    }[data_type]
+
+    read = {"pandas": read_pandas, "pyarrow": read_pyarrow}[engine]
+    df = read(path, data_type, dimensions)
+    rows = len(df)
+
+    df = df[columns]
+    df = apply_schema(encode_keys(from_gdelt(df), data_type, keys), "file")
+
+    make_store(storage).write_file(df, data_type, year, date)
+    return rows, len(df)
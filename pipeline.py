@@ -0,0 +1,186 @@
+import asyncio
+import os
+import time
+from functools import partial
+
+import pandas as pd
+from colorama import Fore, Style
+
+from aggregating import aggregate
+from collecting import collect_all, collect_bytes, collect_data, decode_quarter, make_next_quarter, row_bytes
+from financial import make_financial_path, process_all_financial_files, process_financial_files
+from manifest import (concat_rows, load_manifest, load_pending, load_offset, save_offset, diff_masterlist, record_processed,
+                      affected_quarters, collect_quarters, group_quarters, previous_quarter, data_types)
+from masterlist import download_masterlist_tail, index_masterlist, query_masterlist, quarters_between
+from downloading import download_all, make_session
+from executing import ResourceExecutor
+from ledger import Ledger
+from metrics import Metrics
+from progress import advance_bytes
+from quarterizing import batch_bytes, join_files, quarterize
+from scheduling import Scheduler
+from storing import DecodedStore, make_store, quarter_of
+
+
+def collect_budget(executor: ResourceExecutor) -> int:
+    # a collect that fits a quarter of the admission budget runs in memory, a larger one is partitioned
+    return executor.memory_budget // 4
+
+
+async def incremental(start: str, engine: str, storage: str, executor: ResourceExecutor, memory_budget: int | None = None, keys: str = "url", collect_engine: str = "pandas") -> None:
+    total_stages: int = 6
+
+    masterlist, offset = download_masterlist_tail(load_offset())
+    masterlist = query_masterlist(index_masterlist(masterlist), start=start)
+    new_files = diff_masterlist(concat_rows([load_pending(), masterlist]), load_manifest())
+    print(Fore.GREEN + f"Progress 1/{total_stages}" + Style.RESET_ALL)
+    print("Finished diffing masterlist against manifest")
+    print("New files:", len(new_files))
+    print("")
+
+    for masterlist_type, data_type in data_types.items():
+        print(f"Downloading new {data_type} files")
+        await download_all(new_files[new_files["type"] == masterlist_type], data_type, cache=True, engine=engine, storage=storage, keys=keys, executor=executor)
+        print("")
+    processed = record_processed(new_files, storage=storage, keys=keys)
+    save_offset(offset)
+    print(Fore.GREEN + f"Progress 2/{total_stages}" + Style.RESET_ALL)
+    print("Finished downloading new data")
+    print("Processed files:", len(processed))
+    print("Pending files:", len(new_files) - len(processed))
+    print("")
+
+    affected = affected_quarters(processed)
+    for data_type, quarters in affected.items():
+        if len(quarters) > 0:
+            print(f"Quarterizing {data_type}s")
+            await quarterize(group_quarters(quarters), data_type, cache=True, storage=storage, executor=executor)
+    print(Fore.GREEN + f"Progress 3/{total_stages}" + Style.RESET_ALL)
+    print("Finished quarterizing affected quarters")
+    print("")
+
+    quarters = collect_quarters(affected)
+    if len(quarters) > 0:
+        await collect_all(group_quarters(quarters), cache=True, storage=storage, memory_budget=memory_budget, keys=keys, executor=executor, engine=collect_engine)
+    print(Fore.GREEN + f"Progress 4/{total_stages}" + Style.RESET_ALL)
+    print("Finished collecting affected quarters")
+    print("Collected quarters:", len(quarters))
+    print("")
+
+    await process_all_financial_files(["spx", "btc"], executor=executor)
+    print(Fore.GREEN + f"Progress 5/{total_stages}" + Style.RESET_ALL)
+    print("Finished processing financial files")
+    print("")
+
+    started, cpu = time.time(), time.process_time()
+    aggregate(["spx", "btc"], days=[1, 2, 3, 5, 8, 13, 21], storage=storage, append=True)
+    executor.metrics.add("aggregate", start=started, tasks=1, cpu_seconds=time.process_time() - cpu)
+    print(Fore.GREEN + f"Progress 6/{total_stages}" + Style.RESET_ALL)
+    print("Finished appending aggregates")
+    print("")
+
+    print("Done")
+
+
+async def retry_failed(engine: str, storage: str, executor: ResourceExecutor, keys: str = "url") -> None:
+    with Ledger() as ledger:
+        failures = {masterlist_type: ledger.load_failures(storage, data_type) for masterlist_type, data_type in data_types.items()}
+    print("Failed files:", sum(len(rows) for rows in failures.values()))
+    print("")
+
+    retried = []
+    for masterlist_type, data_type in data_types.items():
+        rows = pd.DataFrame(failures[masterlist_type], columns=["url", "year", "date", "size", "md5"]).assign(type=masterlist_type)
+        if len(rows) > 0:
+            print(f"Retrying failed {data_type} files")
+            await download_all(rows, data_type, cache=True, engine=engine, storage=storage, keys=keys, executor=executor)
+            retried.append(rows)
+            print("")
+
+    # pending files that were not retried stay pending
+    if len(retried) > 0:
+        processed = record_processed(concat_rows([load_pending(), *retried]).drop_duplicates("url"), storage=storage, keys=keys)
+        print("Processed files:", len(processed))
+        print("")
+
+    print("Done")
+
+
+async def pipelined(index: pd.DataFrame, start: str, end: str, cache: bool, engine: str, storage: str, memory_budget: int | None, keys: str, memory_limit: int | None, metrics: Metrics | None = None, collect_engine: str = "pandas") -> None:
+    store = make_store(storage)
+    scheduler = Scheduler({"network": 2})
+    quarters = [(year, quarter) for quarters, year in quarters_between(start, end) for quarter in quarters]
+    session = make_session(64)
+    downloaded: list[pd.DataFrame] = []
+
+    with ResourceExecutor(memory_budget=memory_limit, metrics=metrics) as executor:
+        memory_budget = memory_budget or collect_budget(executor)
+        rows = max(10000, memory_budget // row_bytes)
+
+        async def _download(masterlist: pd.DataFrame, data_type: str) -> None:
+            stage = scheduler.stage(f"Downloading {data_type}s")
+            await download_all(masterlist, data_type, cache=cache, engine=engine, storage=storage, session=session, keys=keys, progress=scheduler.progress, task_id=stage, executor=executor)
+            downloaded.append(masterlist)
+
+        async def _record() -> None:
+            # the manifest is written once after every download, and like in incremental the offset only moves past
+            # masterlist rows that are now processed or pending, so files after the end of the run stay pending
+            tail, offset = await asyncio.to_thread(download_masterlist_tail, load_offset())
+            tail = query_masterlist(index_masterlist(tail), start=start)
+            record_processed(diff_masterlist(concat_rows([load_pending(), *downloaded, tail]), load_manifest()), storage=storage, keys=keys)
+            save_offset(offset)
+
+        async def _quarterize(data_type: str, year: int, quarter: int) -> None:
+            dates = [date for date in store.list_files(data_type, str(year)) if quarter_of(date) == quarter]
+            read_bytes = sum(store.file_bytes(data_type, str(year), date) for date in dates)
+            await executor.submit("quarterize", join_files, dates, data_type, year, quarter, storage, input_bytes=batch_bytes(store, dates, data_type, year), read_bytes=read_bytes)
+            executor.metrics.add("quarterize", bytes_out=store.quarter_bytes(data_type, year, quarter) if store.has_quarter(data_type, year, quarter) else 0)
+            advance_bytes(scheduler.progress, scheduler.stage("Quarterizing"), read_bytes)
+
+        async def _decode(data_type: str, year: int, quarter: int) -> None:
+            await executor.submit("decode", decode_quarter, data_type, year, quarter, storage, rows, keys, input_bytes=store.quarter_bytes(data_type, year, quarter) if store.has_quarter(data_type, year, quarter) else 0)
+
+        async def _collect(year: int, quarter: int) -> None:
+            input_bytes = collect_bytes(store, year, quarter)
+            await executor.submit("collect", collect_data, year, quarter, storage, memory_budget, True, keys, collect_engine, input_bytes=input_bytes, cap=memory_budget)
+            advance_bytes(scheduler.progress, scheduler.stage("Collecting"), input_bytes)
+
+        async def _evict(data_type: str, year: int, quarter: int) -> None:
+            DecodedStore(store).evict(data_type, year, quarter)
+
+        async def _financial(names: list[str]) -> None:
+            await executor.submit("financial", process_financial_files, names, input_bytes=sum(os.path.getsize(make_financial_path(name, is_raw=True)) for name in names))
+
+        async def _aggregate() -> None:
+            await executor.submit("aggregate", aggregate, ["spx", "btc"], [1, 2, 3, 5, 8, 13, 21], storage)
+
+        for year, quarter in quarters:
+            next_year, next_quarter = make_next_quarter(year, quarter)
+            quarter_start = max(pd.Timestamp(start), pd.Timestamp(year=year, month=quarter * 3 - 2, day=1))
+            quarter_end = min(pd.Timestamp(end), pd.Timestamp(year=next_year, month=next_quarter * 3 - 2, day=1))
+
+            for masterlist_type, data_type in data_types.items():
+                masterlist = query_masterlist(index, masterlist_type, quarter_start, quarter_end)
+                scheduler.add(f"download {data_type} {year}-{quarter}", partial(_download, masterlist, data_type), needs={"network": 1}, stage=f"Downloading {data_type}s", units=len(masterlist), advance=False)
+                scheduler.add(f"quarterize {data_type} {year}-{quarter}", partial(_quarterize, data_type, year, quarter), after=[f"download {data_type} {year}-{quarter}"], stage="Quarterizing")
+
+            # the mentions and details of a quarter are decoded once and read by its own collect and by the one before it
+            for data_type in ["mention", "detail"]:
+                scheduler.add(f"decode {data_type} {year}-{quarter}", partial(_decode, data_type, year, quarter), after=[f"quarterize {data_type} {year}-{quarter}"])
+                readers = [f"collect {y}-{q}" for y, q in [(year, quarter), previous_quarter(year, quarter)] if (y, q) in quarters]
+                scheduler.add(f"evict {data_type} {year}-{quarter}", partial(_evict, data_type, year, quarter), after=readers)
+
+            inputs = [f"quarterize event {year}-{quarter}"]
+            inputs += [f"decode {data_type} {y}-{q}" for data_type in ["mention", "detail"] for y, q in [(year, quarter), (next_year, next_quarter)] if (y, q) in quarters]
+            scheduler.add(f"collect {year}-{quarter}", partial(_collect, year, quarter), after=inputs, stage="Collecting")
+
+        scheduler.add("record", _record, after=[f"download {data_type} {year}-{quarter}" for year, quarter in quarters for data_type in data_types.values()], needs={"network": 1})
+
+        scheduler.add("financial", partial(_financial, ["spx", "btc"]), stage="Processing financial data")
+
+        scheduler.add("aggregate", _aggregate, after=[f"collect {year}-{quarter}" for year, quarter in quarters] + ["financial"], stage="Aggregating")
+
+        try:
+            await scheduler.run()
+        finally:
+            await session.close()
@@ -1,5 +1,6 @@
+from rich import filesize
 from rich.progress import (Progress, BarColumn, TimeElapsedColumn, TimeRemainingColumn, TaskProgressColumn,
-                           TextColumn, ProgressColumn, Task, MofNCompleteColumn)
+                           TextColumn, ProgressColumn, Task, TaskID, MofNCompleteColumn)
 from rich.text import Text
 
 
@@ -10,6 +11,18 @@ class SpeedColumn(ProgressColumn):
             return Text("?", style="progress.data.speed")
         return Text(f"{int(speed)}/s", style="progress.data.speed")
 
+
+class ByteSpeedColumn(ProgressColumn):
+    def render(self, task: "Task") -> Text:
+        elapsed = task.finished_time or task.elapsed
+        if "bytes" not in task.fields or not elapsed:
+            return Text("", style="progress.data.speed")
+        return Text(f"{filesize.decimal(int(task.fields['bytes'] / elapsed))}/s", style="progress.data.speed")
+
+def advance_bytes(progress: Progress, task_id: TaskID, amount: int) -> None:
+    # stages that share a row add to the same counter
+    progress.update(task_id, bytes=progress.tasks[task_id].fields.get("bytes", 0) + amount)
+
 def make_progress() -> Progress:
     return Progress(
         TextColumn("[progress.description]{task.description}"),
@@ -17,6 +30,7 @@ def make_progress() -> Progress:
         TaskProgressColumn(),
         MofNCompleteColumn(),
         SpeedColumn(),
+        ByteSpeedColumn(),
         TimeElapsedColumn(),
         TimeRemainingColumn(),
         transient=True,
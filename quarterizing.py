@@ -1,71 +1,81 @@
 import asyncio
 import gc
-import os
-from concurrent.futures.process import ProcessPoolExecutor
-import pandas as pd
+from typing import Iterator
 
-from downloading import _init_worker, make_file_path
-from progress import make_progress
+import pandas as pd
 
-def make_quarter_path(data_type: str, year: int, quarter: int):
-    return os.path.join("data/files/quarters/", data_type, f"{str(year)}-{str(quarter)}.csv.gz")
+from executing import ResourceExecutor
+from progress import advance_bytes, make_progress
+from schema import apply_schema
+from storing import make_store, quarter_of
 
-def join_files(files: list[str], dirname: str, data_type: str, year: int, quarter: int) -> None:
-    data = list(map(pd.read_csv, [os.path.join(dirname, file) for file in files]))
-    print(f"Files in {quarter} quarter of {year} year: {len(data)}")
+def clean_events(df: pd.DataFrame) -> pd.DataFrame:
+    df = df[df["EventBaseCode"] != ""]
+    df = df[df["EventBaseCode"] != "---"]
+    df["EventBaseCode"] = df["EventBaseCode"].astype(str).str.zfill(3).str[0:2].astype(int)
+    return df
 
-    if len(data) > 0:
-        df = pd.concat(data)
+def iter_batches(store, dates: list[str], data_type: str, year: int, files_per_batch: int, counts: list[int]) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(dates), files_per_batch):
+        df = store.read_files(data_type, str(year), dates[start:start + files_per_batch])
+        counts[0] += len(df)
 
         if data_type == "event":
-            df = df[df["EventBaseCode"] != ""]
-            df = df[df["EventBaseCode"] != "---"]
-            df["EventBaseCode"] = df["EventBaseCode"].astype(str).str.zfill(3).str[0:2].astype(int)
+            df = clean_events(df)
+        df = apply_schema(df, "quarter")
+
+        counts[1] += len(df)
+        yield df
 
-        path = make_quarter_path(data_type, year, quarter)
+def batch_bytes(store, dates: list[str], data_type: str, year: int, files_per_batch: int = 96) -> int:
+    # batches are joined one at a time, so the largest one bounds the memory of a join
+    return max([sum(store.file_bytes(data_type, str(year), date) for date in dates[start:start + files_per_batch]) for start in range(0, len(dates), files_per_batch)], default=0)
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        df.to_csv(path, index=False, compression="gzip")
+def join_files(dates: list[str], data_type: str, year: int, quarter: int, storage: str = "csv", files_per_batch: int = 96) -> (int, int):
+    store = make_store(storage)
+    print(f"Files in {quarter} quarter of {year} year: {len(dates)}")
 
+    counts = [0, 0]
+    if len(dates) > 0:
+        store.write_quarter_batches(iter_batches(store, dates, data_type, year, files_per_batch, counts), data_type, year, quarter)
+    return counts[0], counts[1]
 
-async def quarterize(quarters_in_years: list[tuple[list[int], int]], data_type: str, cache: bool = False) -> None:
+
+async def quarterize(quarters_in_years: list[tuple[list[int], int]], data_type: str, cache: bool = False, storage: str = "csv", executor: ResourceExecutor | None = None) -> None:
     old = gc.isenabled()
     gc.disable()
-    semaphore = asyncio.Semaphore(4)
+    own_executor = executor is None
+    if own_executor:
+        executor = ResourceExecutor()
+    store = make_store(storage)
 
-    total = len(quarters_in_years) * 4
+    total = sum(len(quarters) for quarters, _ in quarters_in_years)
 
     progress = make_progress()
     task_id = progress.add_task(f"Quarterizing", total=total)
 
-    with progress:
-        with ProcessPoolExecutor(max_workers=4, initializer=_init_worker) as pool:
+    try:
+        with progress:
             async with asyncio.TaskGroup() as task_group:
                 for quarters, year in quarters_in_years:
-                    dirname = os.path.dirname(make_file_path(data_type, str(year), ""))
-                    files = os.listdir(dirname)
                     quarterized_files = [[], [], [], []]
-                    for file in files:
-                        month = int(file[4:6])
-                        if month < 4:
-                            quarterized_files[0].append(file)
-                        elif month < 7:
-                            quarterized_files[1].append(file)
-                        elif month < 10:
-                            quarterized_files[2].append(file)
-                        else:
-                            quarterized_files[3].append(file)
-
-                    async def _worker(f: list[str], d: str, dt: str, y: int, q: int):
-                        async with semaphore:
-                            try:
-                                loop = asyncio.get_running_loop()
-                                await loop.run_in_executor(pool, join_files, f, d, dt, y, q)
-                            finally:
-                                progress.update(task_id, advance=1)
-
-                    for index, file_list in enumerate(quarterized_files):
-                        task_group.create_task(_worker(file_list, dirname, data_type, year, index + 1))
+                    for date in store.list_files(data_type, str(year)):
+                        quarterized_files[quarter_of(date) - 1].append(date)
+
+                    async def _worker(f: list[str], dt: str, y: int, q: int):
+                        try:
+                            read_bytes = sum(store.file_bytes(dt, str(y), d) for d in f)
+                            await executor.submit("quarterize", join_files, f, dt, y, q, storage, input_bytes=batch_bytes(store, f, dt, y), read_bytes=read_bytes)
+                            executor.metrics.add("quarterize", bytes_out=store.quarter_bytes(dt, y, q) if store.has_quarter(dt, y, q) else 0)
+                            advance_bytes(progress, task_id, read_bytes)
+                        finally:
+                            progress.update(task_id, advance=1)
+
+                    for quarter in quarters:
+                        task_group.create_task(_worker(quarterized_files[quarter - 1], data_type, year, quarter))
+    finally:
+        if own_executor:
+            executor.close()
 
     if old:
         gc.enable()
@@ -0,0 +1,93 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from rich.progress import TaskID
+
+from progress import make_progress
+
+
+class Resources:
+    def __init__(self, limits: dict[str, int]):
+        self.limits = limits
+        self.used = {name: 0 for name in limits}
+        self._condition = asyncio.Condition()
+
+    def _fits(self, request: dict[str, int]) -> bool:
+        return all(self.used[name] + amount <= self.limits[name] for name, amount in request.items())
+
+    async def acquire(self, request: dict[str, int]) -> dict[str, int]:
+        # a task asking for more than a whole limit still runs, just alone
+        request = {name: min(amount, self.limits[name]) for name, amount in request.items()}
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._fits(request))
+            for name, amount in request.items():
+                self.used[name] += amount
+        return request
+
+    async def release(self, request: dict[str, int]) -> None:
+        async with self._condition:
+            for name, amount in request.items():
+                self.used[name] -= amount
+            self._condition.notify_all()
+
+
+class Scheduler:
+    def __init__(self, limits: dict[str, int]):
+        self.resources = Resources(limits)
+        self.progress = make_progress()
+        self.nodes: dict[str, tuple[Callable[[], Awaitable[None]], list[str], dict[str, int | Callable[[], int]], str | None, bool]] = {}
+        self.stages: dict[str, TaskID] = {}
+
+    def stage(self, stage: str) -> TaskID:
+        if stage not in self.stages:
+            self.stages[stage] = self.progress.add_task(stage, total=0)
+        return self.stages[stage]
+
+    def add(self, name: str, run: Callable[[], Awaitable[None]], after: list[str] | None = None, needs: dict[str, int | Callable[[], int]] | None = None, stage: str | None = None, units: int = 1, advance: bool = True) -> None:
+        if name in self.nodes:
+            raise ValueError(f"Task {name} is already scheduled")
+        if stage is not None:
+            task_id = self.stage(stage)
+            self.progress.update(task_id, total=self.progress.tasks[task_id].total + units)
+        self.nodes[name] = (run, list(after or []), dict(needs or {}), stage, advance)
+
+    def _validate(self) -> None:
+        for name, (_, after, needs, _, _) in self.nodes.items():
+            missing = [dependency for dependency in after if dependency not in self.nodes]
+            if len(missing) > 0:
+                raise ValueError(f"Task {name} depends on unknown tasks {missing}")
+            unknown = [resource for resource in needs if resource not in self.resources.limits]
+            if len(unknown) > 0:
+                raise ValueError(f"Task {name} needs unknown resources {unknown}")
+
+        remaining = {name: set(after) for name, (_, after, _, _, _) in self.nodes.items()}
+        while len(remaining) > 0:
+            ready = [name for name, after in remaining.items() if len(after) == 0]
+            if len(ready) == 0:
+                raise ValueError(f"Tasks {sorted(remaining)} depend on each other")
+            for name in ready:
+                del remaining[name]
+            for after in remaining.values():
+                after.difference_update(ready)
+
+    async def run(self) -> None:
+        self._validate()
+
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def _run(name: str) -> None:
+            run, after, needs, stage, advance = self.nodes[name]
+            await asyncio.gather(*[tasks[dependency] for dependency in after])
+            # estimates can depend on the outputs of earlier tasks, so they are taken when the task is ready
+            granted = await self.resources.acquire({resource: amount() if callable(amount) else amount for resource, amount in needs.items()})
+            try:
+                await run()
+            finally:
+                await self.resources.release(granted)
+            if stage is not None and advance:
+                self.progress.update(self.stages[stage], advance=1)
+
+        with self.progress:
+            async with asyncio.TaskGroup() as task_group:
+                for name in self.nodes:
+                    tasks[name] = task_group.create_task(_run(name))
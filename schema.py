@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+country_type = pa.dictionary(pa.int32(), pa.string())
+seconds_per_day = 60 * 60 * 24
+
+# event days and mention times are stored as epoch seconds from parse onwards, so every later stage compares plain integers;
+# GDELT writes them as yyyymmdd and yyyymmddHHMMSS numbers, with these many digits
+epoch_columns: dict[str, int] = {"SQLDATE": 8, "MentionTimeDate": 14}
+# on disk the seconds go under their own names, so a file says which form it holds and the values never have to be guessed
+stored_names: dict[str, str] = {name: f"{name}Seconds" for name in epoch_columns}
+
+# every stage reads and writes its columns with these types, so codes, scores and countries stay narrow from parse to aggregate
+column_types: dict[str, dict[str, pa.DataType]] = {
+    "file": {
+        "GlobalEventID": pa.int64(),
+        "SQLDATE": pa.int64(),
+        "EventBaseCode": pa.string(),
+        "QuadClass": pa.int8(),
+        "GoldsteinScale": pa.float32(),
+        "ActionGeo_CountryCode": country_type,
+        "MentionTimeDate": pa.int64(),
+        "MentionIdentifier": pa.string(),
+        "DocumentIdentifier": pa.string(),
+        "MentionKey": pa.int64(),
+        "DocumentKey": pa.int64(),
+        "WordCount": pa.int32(),
+        "Negative": pa.int32(),
+        "Positive": pa.int32(),
+        "Finance": pa.int32(),
+    },
+    "quarter": {
+        "GlobalEventID": pa.int64(),
+        "SQLDATE": pa.int64(),
+        "EventBaseCode": pa.int8(),
+        "QuadClass": pa.int8(),
+        "GoldsteinScale": pa.float32(),
+        "ActionGeo_CountryCode": country_type,
+        "MentionTimeDate": pa.int64(),
+        "MentionIdentifier": pa.string(),
+        "DocumentIdentifier": pa.string(),
+        "MentionKey": pa.int64(),
+        "DocumentKey": pa.int64(),
+        "WordCount": pa.int32(),
+        "Negative": pa.int32(),
+        "Positive": pa.int32(),
+        "Finance": pa.int32(),
+    },
+    "collected": {
+        "GlobalEventID": pa.int64(),
+        "Time": pa.timestamp("ns"),
+        "EventBaseCode": pa.int8(),
+        "QuadClass": pa.int8(),
+        "GoldsteinScale": pa.float32(),
+        "ActionGeo_CountryCode": country_type,
+        "MentionsCount": pa.int64(),
+        "WordCount": pa.int64(),
+        "Negative": pa.int64(),
+        "Positive": pa.int64(),
+        "Finance": pa.int64(),
+    },
+}
+
+def pandas_types(layer: str) -> dict[str, object]:
+    types = {}
+    for name, dtype in column_types[layer].items():
+        if pa.types.is_dictionary(dtype):
+            types[name] = "category"
+        elif pa.types.is_timestamp(dtype):
+            types[name] = np.dtype(f"datetime64[{dtype.unit}]")
+        elif not pa.types.is_string(dtype):
+            types[name] = np.dtype(dtype.to_pandas_dtype())
+    return types
+
+def to_epoch(values: np.ndarray, digits: int) -> np.ndarray:
+    # the digits are split arithmetically, which is far cheaper than formatting and parsing them as strings
+    values = values.astype(np.int64)
+    seconds = np.zeros(len(values), dtype=np.int64)
+    if digits == 14:
+        clock, values = values % 1000000, values // 1000000
+        seconds = clock // 10000 * 3600 + clock // 100 % 100 * 60 + clock % 100
+    months = (values // 10000 - 1970) * 12 + values // 100 % 100 - 1
+    days = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + values % 100 - 1
+    return days * seconds_per_day + seconds
+
+def from_gdelt(df: pd.DataFrame) -> pd.DataFrame:
+    return df.assign(**{name: to_epoch(df[name].to_numpy(), digits) for name, digits in epoch_columns.items() if name in df.columns})
+
+def to_stored(df: pd.DataFrame) -> pd.DataFrame:
+    return df.rename(columns=stored_names)
+
+def from_stored(df: pd.DataFrame) -> pd.DataFrame:
+    # files written before the seconds had their own names still hold the GDELT numbers under the GDELT names
+    return from_gdelt(df).rename(columns={stored: name for name, stored in stored_names.items()})
+
+def stored_columns(columns: list[str] | None, names: list[str]) -> list[str] | None:
+    if columns is None:
+        return None
+    return [stored_names[name] if stored_names.get(name) in names else name for name in columns]
+
+def apply_schema(df: pd.DataFrame, layer: str) -> pd.DataFrame:
+    casts = {}
+    for name, dtype in pandas_types(layer).items():
+        if name not in df.columns or df[name].dtype == dtype:
+            continue
+        if dtype == "category":
+            casts[name] = dtype
+        elif dtype.kind == "M":
+            df = df.assign(**{name: pd.to_datetime(df[name], format="ISO8601").astype(dtype)})
+        # only integers are narrowed to integers, floating columns like sums over mentions without details stay floating
+        elif dtype.kind in "iu" and df[name].dtype.kind not in "iu":
+            continue
+        else:
+            casts[name] = dtype
+    return df.astype(casts) if len(casts) > 0 else df
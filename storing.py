@@ -0,0 +1,307 @@
+import os
+import glob
+import gzip
+from typing import Iterable, Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from schema import apply_schema, column_types, from_stored, stored_columns, stored_names, to_stored
+
+def make_file_path(data_type: str, year: str, date: str):
+    return os.path.join("data/files/", data_type, year, f"{date}.csv.gz")
+
+def make_quarter_path(data_type: str, year: int, quarter: int):
+    return os.path.join("data/files/quarters/", data_type, f"{str(year)}-{str(quarter)}.csv.gz")
+
+def make_collected_path(year: int, quarter: int):
+    return os.path.join("data/files/collected/", f"{str(year)}-{str(quarter)}.csv.gz")
+
+def make_aggregated_path(days: int):
+    return os.path.join("data/files/aggregated/", str(days), f"aggregate.csv")
+
+def make_decoded_path(data_type: str, year: int, quarter: int):
+    return os.path.join("data/cache/decoded/", data_type, f"{str(year)}-{str(quarter)}.arrow")
+
+def make_dataset_path(layer: str, **partitions) -> str:
+    return os.path.join("data/dataset/", layer, *[f"{key}={value}" for key, value in partitions.items()])
+
+def quarter_of(date: str) -> int:
+    return (int(date[4:6]) - 1) // 3 + 1
+
+def _usecols(columns: list[str] | None):
+    # a CSV header holds either name of a time column, depending on when the file was written
+    if columns is None:
+        return None
+    wanted = {*columns, *[stored_names[name] for name in columns if name in stored_names]}
+    return lambda name: name in wanted
+
+
+class CsvStore:
+    name = "csv"
+
+    def has_file(self, data_type: str, year: str, date: str) -> bool:
+        return os.path.exists(make_file_path(data_type, year, date))
+
+    def write_file(self, df: pd.DataFrame, data_type: str, year: str, date: str) -> None:
+        path = make_file_path(data_type, year, date)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        to_stored(df).to_csv(path, index=False, compression="gzip")
+
+    def list_files(self, data_type: str, year: str) -> list[str]:
+        dirname = os.path.dirname(make_file_path(data_type, year, ""))
+        if not os.path.exists(dirname):
+            return []
+        return sorted(file.split(".", 1)[0] for file in os.listdir(dirname))
+
+    def read_files(self, data_type: str, year: str, dates: list[str], columns: list[str] | None = None) -> pd.DataFrame:
+        data = [from_stored(pd.read_csv(make_file_path(data_type, year, date), usecols=_usecols(columns))) for date in dates]
+        return apply_schema(pd.concat(data), "file") if len(data) > 0 else pd.DataFrame(columns=columns)
+
+    def file_bytes(self, data_type: str, year: str, date: str) -> int:
+        return os.path.getsize(make_file_path(data_type, year, date))
+
+    def file_columns(self, data_type: str, year: str, date: str) -> list[str]:
+        return from_stored(pd.read_csv(make_file_path(data_type, year, date), nrows=0)).columns.tolist()
+
+    def has_quarter(self, data_type: str, year: int, quarter: int) -> bool:
+        return os.path.exists(make_quarter_path(data_type, year, quarter))
+
+    def write_quarter(self, df: pd.DataFrame, data_type: str, year: int, quarter: int) -> None:
+        path = make_quarter_path(data_type, year, quarter)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        to_stored(df).to_csv(path, index=False, compression="gzip")
+
+    def write_quarter_batches(self, batches: Iterable[pd.DataFrame], data_type: str, year: int, quarter: int) -> None:
+        path = make_quarter_path(data_type, year, quarter)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path + ".tmp", "wt", newline="") as file:
+            for index, df in enumerate(batches):
+                to_stored(df).to_csv(file, index=False, header=index == 0)
+        os.replace(path + ".tmp", path)
+
+    def read_quarter(self, data_type: str, year: int, quarter: int, columns: list[str] | None = None) -> pd.DataFrame:
+        return apply_schema(from_stored(pd.read_csv(make_quarter_path(data_type, year, quarter), usecols=_usecols(columns))), "quarter")
+
+    def iter_quarter(self, data_type: str, year: int, quarter: int, columns: list[str] | None = None, rows: int = 1000000) -> Iterator[pd.DataFrame]:
+        with pd.read_csv(make_quarter_path(data_type, year, quarter), usecols=_usecols(columns), chunksize=rows) as reader:
+            for chunk in reader:
+                yield apply_schema(from_stored(chunk), "quarter")
+
+    def quarter_bytes(self, data_type: str, year: int, quarter: int) -> int:
+        return os.path.getsize(make_quarter_path(data_type, year, quarter))
+
+    def write_collected(self, df: pd.DataFrame, year: int, quarter: int) -> None:
+        path = make_collected_path(year, quarter)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_csv(path, index=False, compression="gzip")
+
+    def list_collected(self) -> list[tuple[int, int]]:
+        dirname = os.path.dirname(make_collected_path(0, 0))
+        if not os.path.exists(dirname):
+            return []
+        names = [file.split(".", 1)[0].split("-") for file in os.listdir(dirname)]
+        return sorted((int(year), int(quarter)) for year, quarter in names)
+
+    def read_collected(self, year: int, quarter: int, columns: list[str] | None = None) -> pd.DataFrame:
+        return apply_schema(pd.read_csv(make_collected_path(year, quarter), usecols=columns), "collected")
+
+    def write_aggregated(self, df: pd.DataFrame, days: int) -> None:
+        path = make_aggregated_path(days)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_csv(path, index=False)
+
+    def has_aggregated(self, days: int) -> bool:
+        return os.path.exists(make_aggregated_path(days))
+
+    def read_aggregated(self, days: int) -> pd.DataFrame:
+        return pd.read_csv(make_aggregated_path(days), float_precision="round_trip")
+
+    def append_aggregated(self, df: pd.DataFrame, days: int, keep: int | None = None) -> None:
+        # the header and the first keep rows stay on disk as they are, everything after them is replaced
+        if keep is not None:
+            with open(make_aggregated_path(days), "r+b") as file:
+                for _ in range(keep + 1):
+                    file.readline()
+                file.truncate(file.tell())
+        df.to_csv(make_aggregated_path(days), index=False, mode="a", header=False)
+
+
+class ParquetStore:
+    name = "parquet"
+
+    def __init__(self, compression: str = "zstd"):
+        self.compression = compression
+
+    def _table(self, df: pd.DataFrame, types: dict[str, pa.DataType]) -> pa.Table:
+        strings = {name: df[name].astype("string") for name, dtype in types.items() if name in df.columns and pa.types.is_string(dtype)}
+        table = pa.Table.from_pandas(to_stored(df.assign(**strings)), preserve_index=False)
+        schema = pa.schema([pa.field(name, types.get(name, table.schema.field(name).type)) for name in table.column_names])
+        return table.cast(schema)
+
+    def _write(self, df: pd.DataFrame, path: str, types: dict[str, pa.DataType]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(self._table(df, types), path, compression=self.compression)
+
+    def _read(self, paths: str | list[str], columns: list[str] | None = None, layer: str | None = None) -> pd.DataFrame:
+        # each file is read with its own column names, so files written before the times were stored as seconds mix with newer ones
+        frames = []
+        for path in [paths] if isinstance(paths, str) else paths:
+            file = pq.ParquetFile(path)
+            frames.append(from_stored(file.read(columns=stored_columns(columns, file.schema_arrow.names)).to_pandas()))
+        df = pd.concat(frames) if len(frames) > 1 else frames[0]
+        # outputs written before the schema was narrowed are converted as they are read
+        return apply_schema(df, layer) if layer is not None else df
+
+    def _file_path(self, data_type: str, year: str, date: str) -> str:
+        partition = make_dataset_path("files", type=data_type, year=year, quarter=quarter_of(date), day=date[0:8])
+        return os.path.join(partition, f"{date}.parquet")
+
+    def has_file(self, data_type: str, year: str, date: str) -> bool:
+        return os.path.exists(self._file_path(data_type, year, date))
+
+    def write_file(self, df: pd.DataFrame, data_type: str, year: str, date: str) -> None:
+        self._write(df, self._file_path(data_type, year, date), column_types["file"])
+
+    def list_files(self, data_type: str, year: str) -> list[str]:
+        pattern = os.path.join(make_dataset_path("files", type=data_type, year=year), "quarter=*", "day=*", "*.parquet")
+        return sorted(os.path.basename(path).split(".", 1)[0] for path in glob.glob(pattern))
+
+    def read_files(self, data_type: str, year: str, dates: list[str], columns: list[str] | None = None) -> pd.DataFrame:
+        if len(dates) == 0:
+            return pd.DataFrame(columns=columns)
+        return self._read([self._file_path(data_type, year, date) for date in dates], columns, "file")
+
+    def file_bytes(self, data_type: str, year: str, date: str) -> int:
+        return os.path.getsize(self._file_path(data_type, year, date))
+
+    def file_columns(self, data_type: str, year: str, date: str) -> list[str]:
+        return from_stored(pq.read_schema(self._file_path(data_type, year, date)).empty_table().to_pandas()).columns.tolist()
+
+    def _quarter_path(self, data_type: str, year: int, quarter: int) -> str:
+        return os.path.join(make_dataset_path("quarters", type=data_type, year=year, quarter=quarter), "part-0.parquet")
+
+    def has_quarter(self, data_type: str, year: int, quarter: int) -> bool:
+        return os.path.exists(self._quarter_path(data_type, year, quarter))
+
+    def write_quarter(self, df: pd.DataFrame, data_type: str, year: int, quarter: int) -> None:
+        self._write(df, self._quarter_path(data_type, year, quarter), column_types["quarter"])
+
+    def write_quarter_batches(self, batches: Iterable[pd.DataFrame], data_type: str, year: int, quarter: int) -> None:
+        path = self._quarter_path(data_type, year, quarter)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        writer = None
+        try:
+            for df in batches:
+                table = self._table(df, column_types["quarter"])
+                if writer is None:
+                    writer = pq.ParquetWriter(path + ".tmp", table.schema, compression=self.compression)
+                writer.write_table(table.cast(writer.schema))
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is not None:
+            os.replace(path + ".tmp", path)
+
+    def read_quarter(self, data_type: str, year: int, quarter: int, columns: list[str] | None = None) -> pd.DataFrame:
+        return self._read(self._quarter_path(data_type, year, quarter), columns, "quarter")
+
+    def iter_quarter(self, data_type: str, year: int, quarter: int, columns: list[str] | None = None, rows: int = 1000000) -> Iterator[pd.DataFrame]:
+        file = pq.ParquetFile(self._quarter_path(data_type, year, quarter))
+        for batch in file.iter_batches(batch_size=rows, columns=stored_columns(columns, file.schema_arrow.names)):
+            yield apply_schema(from_stored(batch.to_pandas()), "quarter")
+
+    def quarter_bytes(self, data_type: str, year: int, quarter: int) -> int:
+        return os.path.getsize(self._quarter_path(data_type, year, quarter))
+
+    def _collected_path(self, year: int, quarter: int) -> str:
+        return os.path.join(make_dataset_path("collected", year=year, quarter=quarter), "part-0.parquet")
+
+    def write_collected(self, df: pd.DataFrame, year: int, quarter: int) -> None:
+        self._write(df, self._collected_path(year, quarter), column_types["collected"])
+
+    def list_collected(self) -> list[tuple[int, int]]:
+        pattern = os.path.join(make_dataset_path("collected"), "year=*", "quarter=*", "part-0.parquet")
+        partitions = [os.path.normpath(path).split(os.sep)[-3:-1] for path in glob.glob(pattern)]
+        return sorted((int(year.split("=")[1]), int(quarter.split("=")[1])) for year, quarter in partitions)
+
+    def read_collected(self, year: int, quarter: int, columns: list[str] | None = None) -> pd.DataFrame:
+        return self._read(self._collected_path(year, quarter), columns, "collected")
+
+    def _aggregated_path(self, days: int) -> str:
+        return os.path.join(make_dataset_path("aggregated", days=days), "aggregate.parquet")
+
+    def write_aggregated(self, df: pd.DataFrame, days: int) -> None:
+        self._write(df, self._aggregated_path(days), {})
+
+    def has_aggregated(self, days: int) -> bool:
+        return os.path.exists(self._aggregated_path(days))
+
+    def read_aggregated(self, days: int) -> pd.DataFrame:
+        return self._read(self._aggregated_path(days))
+
+    def append_aggregated(self, df: pd.DataFrame, days: int, keep: int | None = None) -> None:
+        self.write_aggregated(pd.concat([self.read_aggregated(days).iloc[:keep], df]), days)
+
+
+class DecodedStore:
+    def __init__(self, store: CsvStore | ParquetStore):
+        self.store = store
+
+    def __getattr__(self, name: str):
+        return getattr(self.store, name)
+
+    def has_decoded(self, data_type: str, year: int, quarter: int) -> bool:
+        return os.path.exists(make_decoded_path(data_type, year, quarter))
+
+    def decode_quarter(self, data_type: str, year: int, quarter: int, columns: list[str] | None = None, rows: int = 1000000) -> None:
+        path = make_decoded_path(data_type, year, quarter)
+        if not self.store.has_quarter(data_type, year, quarter):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        writer, schema = None, None
+        try:
+            with pa.OSFile(path + ".tmp", "wb") as sink:
+                for chunk in self.store.iter_quarter(data_type, year, quarter, columns, rows):
+                    table = pa.Table.from_pandas(to_stored(chunk), preserve_index=False)
+                    # an IPC file cannot change a dictionary between batches, so categoricals are stored as plain strings
+                    table = table.cast(pa.schema([pa.field(field.name, field.type.value_type) if pa.types.is_dictionary(field.type) else field for field in table.schema]))
+                    if writer is None:
+                        writer, schema = ipc.new_file(sink, table.schema), table.schema
+                    writer.write_table(table.cast(schema))
+                if writer is not None:
+                    writer.close()
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # chunks that do not share one schema are left to the underlying store
+            os.remove(path + ".tmp")
+            return
+        if writer is None:
+            os.remove(path + ".tmp")
+            return
+        os.replace(path + ".tmp", path)
+
+    def evict(self, data_type: str, year: int, quarter: int) -> None:
+        if self.has_decoded(data_type, year, quarter):
+            os.remove(make_decoded_path(data_type, year, quarter))
+
+    def _decoded(self, data_type: str, year: int, quarter: int, columns: list[str] | None = None) -> pa.Table:
+        table = ipc.open_file(pa.memory_map(make_decoded_path(data_type, year, quarter))).read_all()
+        return table.select(stored_columns(columns, table.column_names)) if columns is not None else table
+
+    def read_quarter(self, data_type: str, year: int, quarter: int, columns: list[str] | None = None) -> pd.DataFrame:
+        if not self.has_decoded(data_type, year, quarter):
+            return self.store.read_quarter(data_type, year, quarter, columns)
+        return apply_schema(from_stored(self._decoded(data_type, year, quarter, columns).to_pandas()), "quarter")
+
+    def iter_quarter(self, data_type: str, year: int, quarter: int, columns: list[str] | None = None, rows: int = 1000000) -> Iterator[pd.DataFrame]:
+        if not self.has_decoded(data_type, year, quarter):
+            yield from self.store.iter_quarter(data_type, year, quarter, columns, rows)
+            return
+        for batch in self._decoded(data_type, year, quarter, columns).to_batches(max_chunksize=rows):
+            yield apply_schema(from_stored(batch.to_pandas()), "quarter")
+
+
+def make_store(storage: str = "csv") -> CsvStore | ParquetStore:
+    return {"csv": CsvStore, "parquet": ParquetStore}[storage]()
@@ -0,0 +1,64 @@
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+
+from aggregating import categories, seconds_per_day, window_features
+
+def make_events(rows: int = 3000, days: int = 40, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Timestamp": 1704067200 + rng.integers(0, days, rows) * seconds_per_day,
+        "EventBaseCode": rng.integers(1, categories + 1, rows),
+        "MentionsCount": rng.integers(1, 50, rows),
+        "GoldsteinScale": rng.integers(-100, 101, rows) / 10,
+        "WordCount": rng.integers(0, 2000, rows),
+        "Positive": rng.integers(0, 50, rows),
+        "Negative": rng.integers(0, 50, rows),
+        "Finance": rng.integers(0, 20, rows),
+    })
+
+def loop_window(events: pd.DataFrame, timestamp: int, days: int, category: int) -> dict[str, float]:
+    # the per-date, per-category loop aggregate() replaced
+    window = events[events["Timestamp"].between(timestamp - days * seconds_per_day, timestamp, inclusive="right")]
+    window = window[window["EventBaseCode"] == category]
+    mentions = window["MentionsCount"].sum()
+    words = window["WordCount"].sum()
+    return {
+        "mentions": mentions,
+        "goldstein": window["MentionsCount"].mul(window["GoldsteinScale"].add(10)).sum() / (mentions * 20) if mentions > 0 else 0.5,
+        "positive": window["Positive"].sum() / words if words > 0 else 0,
+        "negative": window["Negative"].sum() / words if words > 0 else 0,
+        "finance": window["Finance"].sum() / words if words > 0 else 0,
+    }
+
+def test_windows_match_the_per_date_loop():
+    events = make_events()
+    timestamps = 1704067200 + np.arange(14, 40) * seconds_per_day
+
+    # collected quarters hand the scores back as float32
+    features = window_features(events.astype({"GoldsteinScale": np.float32}), timestamps, [1, 5, 21])
+
+    for days, values in features.items():
+        for row, timestamp in enumerate(timestamps):
+            for category in range(1, categories + 1):
+                expected = loop_window(events, int(timestamp), days, category)
+                for name in ["mentions", "positive", "negative", "finance"]:
+                    assert values[name][row, category - 1] == expected[name]
+                # the loop adds up inexact float products, the windows sum whole tenths, so the loop is off by a few ulps
+                np.testing.assert_allclose(values["goldstein"][row, category - 1], expected["goldstein"], rtol=1e-14, atol=0)
+
+def test_goldstein_is_the_exactly_rounded_ratio():
+    events = make_events(seed=1)
+    timestamps = 1704067200 + np.arange(21, 40) * seconds_per_day
+    tenths = np.rint((events["GoldsteinScale"] + 10) * 10).astype(np.int64) * events["MentionsCount"]
+
+    features = window_features(events.astype({"GoldsteinScale": np.float32}), timestamps, [21])
+
+    for row, timestamp in enumerate(timestamps):
+        window = events["Timestamp"].between(timestamp - 21 * seconds_per_day, timestamp, inclusive="right")
+        for category in range(1, categories + 1):
+            selected = window & (events["EventBaseCode"] == category)
+            mentions = int(events.loc[selected, "MentionsCount"].sum())
+            expected = float(Fraction(int(tenths[selected].sum()), mentions * 200)) if mentions > 0 else 0.5
+            assert features[21]["goldstein"][row, category - 1] == expected
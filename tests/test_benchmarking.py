@@ -0,0 +1,75 @@
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+import masterlist
+from benchmarking import benchmark_gcam, benchmark_pipeline, generate_files, serve_mirror
+from masterlist import download_masterlist, index_masterlist
+from parsing import details_cols, event_cols, mentions_cols
+
+def read_zip(body: bytes) -> list[list[str]]:
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        text = archive.read(archive.namelist()[0]).decode()
+    return [line.split("\t") for line in text.splitlines()]
+
+def test_generated_files_follow_the_gdelt_layout(monkeypatch):
+    files = generate_files("2024-01-01", "2024-01-02", "6h", events=20, mentions=60, details=30)
+
+    assert files == generate_files("2024-01-01", "2024-01-02", "6h", events=20, mentions=60, details=30)
+    assert files != generate_files("2024-01-01", "2024-01-02", "6h", events=20, mentions=60, details=30, seed=1)
+    assert sorted(files)[:3] == ["20240101000000.export.CSV.zip", "20240101000000.gkg.csv.zip", "20240101000000.mentions.CSV.zip"]
+    assert len(files) == 4 * 3
+
+    events, mentions = set(), set()
+    for name, body in sorted(files.items()):
+        rows = read_zip(body)
+        columns = {"export": event_cols, "mentions": mentions_cols, "gkg": details_cols}[name.split(".")[1]]
+        assert all(len(row) == len(columns) for row in rows)
+        if name.split(".")[1] == "export":
+            assert len(rows) == 20
+            events |= {row[0] for row in rows}
+        elif name.split(".")[1] == "mentions":
+            assert len(rows) == 60
+            mentions |= {row[0] for row in rows}
+    # mentions only point at events that were already published
+    assert mentions <= events
+
+    server = serve_mirror(files)
+    monkeypatch.setattr(masterlist, "masterlist_url", f"http://127.0.0.1:{server.server_address[1]}/gdeltv2/masterfilelist.txt")
+    try:
+        index = index_masterlist(download_masterlist())
+    finally:
+        server.shutdown()
+
+    assert len(index) == len(files)
+    for url, size, md5 in zip(index["url"], index["size"], index["md5"]):
+        body = files[url.rsplit("/", 1)[1]]
+        assert (size, md5) == (len(body), hashlib.md5(body).hexdigest())
+
+def test_gcam_benchmark_checks_the_vectorized_extraction():
+    assert set(benchmark_gcam(rows=200)) == {"apply", "vectorized", "vectorized_wide"}
+
+def test_pipeline_runs_every_stage_against_the_mirror(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    url = masterlist.masterlist_url
+
+    # the aggregate needs more days than its widest window
+    timings = benchmark_pipeline("2024-01-01", "2024-02-10", "1D", events=30, mentions=90, details=45, workdir=str(tmp_path / "benchmark"))
+
+    assert list(timings) == ["download_masterlist", "index_masterlist", "download_event", "download_mention", "download_detail",
+                             "quarterize_event", "quarterize_mention", "quarterize_detail", "collect", "financial", "aggregate"]
+    assert os.getcwd() == str(tmp_path)
+    assert masterlist.masterlist_url == url
+
+    os.chdir(tmp_path / "benchmark")
+    assert len(os.listdir("data/files/event/2024")) == 40
+    assert os.path.exists("data/files/collected/2024-1.csv.gz")
+    assert sorted(os.listdir("data/files/aggregated"), key=int) == ["1", "2", "3", "5", "8", "13", "21"]
+    (report,) = os.listdir("data/reports")
+    with open(os.path.join("data/reports", report)) as file:
+        saved = json.load(file)
+    assert saved["mode"] == "benchmark"
+    assert saved["timings"] == timings
+    assert {"download", "parse", "quarterize", "collect"} <= set(saved["stages"])
@@ -0,0 +1,128 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from benchmarking import generate_files
+import collecting
+from collecting import (collect_arrow, collect_data, collect_in_memory, collect_partitioned, decode_quarter, estimate_memory, iter_lookahead,
+                        make_collect_columns)
+from manifest import data_types
+from parsing import parse_csv
+from quarterizing import join_files
+from schema import from_gdelt
+from storing import CsvStore, DecodedStore, make_dataset_path, make_decoded_path, make_file_path, make_store, quarter_of
+
+def write_quarter(tmp_path, monkeypatch, events: pd.DataFrame) -> CsvStore:
+    monkeypatch.chdir(tmp_path)
+    store = CsvStore()
+    store.write_quarter(from_gdelt(events), "event", 2024, 1)
+    store.write_quarter(from_gdelt(pd.DataFrame({
+        "GlobalEventID": [1, 1, 2, 2, 3],
+        "MentionTimeDate": [20240101010000, 20240102010000, 20240105000000, 20240120000000, 20240103000000],
+        "MentionIdentifier": ["a", "b", "c", "d", "e"],
+    })), "mention", 2024, 1)
+    store.write_quarter(pd.DataFrame({
+        "DocumentIdentifier": ["a", "c", "e"],
+        "WordCount": [100, 200, 300],
+        "Negative": [1, 2, 3],
+        "Positive": [4, 5, 6],
+        "Finance": [7, 8, 9],
+    }), "detail", 2024, 1)
+    return store
+
+def parse_quarters(tmp_path, monkeypatch, storage: str):
+    # the files run past the end of the first quarter by more than its lookahead
+    monkeypatch.chdir(tmp_path)
+    for name, body in generate_files("2024-03-20", "2024-04-14", "12h", events=40, mentions=120, details=60).items():
+        date, masterlist_type = name.split(".")[:2]
+        (tmp_path / name).write_bytes(body)
+        parse_csv(str(tmp_path / name), data_types[masterlist_type], date[:4], date, storage=storage)
+    store = make_store(storage)
+    for data_type in ["event", "mention", "detail"]:
+        for quarter in [1, 2]:
+            join_files([date for date in store.list_files(data_type, "2024") if quarter_of(date) == quarter], data_type, 2024, quarter, storage)
+    return store
+
+def test_engines_agree_on_an_event_id_with_conflicting_attributes(tmp_path, monkeypatch):
+    # event 1 is listed twice with different attributes, event 2 twice with the same ones
+    store = write_quarter(tmp_path, monkeypatch, pd.DataFrame({
+        "GlobalEventID": [1, 1, 2, 2, 3],
+        "SQLDATE": [20240101, 20240101, 20240104, 20240104, 20240102],
+        "EventBaseCode": [4, 19, 4, 4, 1],
+        "QuadClass": [1, 4, 1, 1, 1],
+        "GoldsteinScale": [2.5, -10.0, 2.5, 2.5, 1.0],
+        "ActionGeo_CountryCode": ["US", "FR", "US", "US", "DE"],
+    }))
+
+    expected = collect_in_memory(store, 2024, 1)
+
+    assert len(expected[expected["GlobalEventID"] == 1]) == 2
+    pd.testing.assert_frame_equal(collect_arrow(store, 2024, 1), expected)
+    pd.testing.assert_frame_equal(collect_partitioned(store, 2024, 1, 2, 2), expected)
+
+@pytest.mark.parametrize("storage", ["csv", "parquet"])
+def test_partitioned_collect_matches_the_in_memory_join(tmp_path, monkeypatch, storage):
+    store = parse_quarters(tmp_path, monkeypatch, storage)
+    expected = collect_in_memory(store, 2024, 1)
+
+    pd.testing.assert_frame_equal(collect_partitioned(store, 2024, 1, 3, 500), expected)
+
+    collect_data(2024, 1, storage)
+    in_memory = store.read_collected(2024, 1)
+    # a budget below the estimate splits the join into partitions
+    collect_data(2024, 1, storage, memory_budget=estimate_memory(store, 2024, 1) // 3)
+    pd.testing.assert_frame_equal(store.read_collected(2024, 1), in_memory)
+    assert in_memory["MentionsCount"].sum() > 0
+
+@pytest.mark.parametrize("storage", ["csv", "parquet"])
+def test_lookahead_reads_only_the_head_of_the_next_quarter(tmp_path, monkeypatch, storage):
+    store = parse_quarters(tmp_path, monkeypatch, storage)
+    columns = make_collect_columns()["mention"]
+    until = (pd.Timestamp("2024-04-01") + collecting.lookahead).value // 10 ** 9
+
+    times = pd.concat(iter_lookahead(store, "mention", 2024, 2, columns))["MentionTimeDate"]
+    assert times.min() >= pd.Timestamp("2024-04-01").value // 10 ** 9
+    assert times.max() < until
+    assert (store.read_quarter("mention", 2024, 2, columns)["MentionTimeDate"] >= until).any()
+
+    # reading the whole next quarter finds no mention the head missed
+    expected = collect_in_memory(store, 2024, 1)
+    monkeypatch.setattr(collecting, "lookahead", pd.Timedelta(days=91))
+    pd.testing.assert_frame_equal(collect_in_memory(store, 2024, 1), expected)
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+
+    # without per-file outputs the head comes from the quarter file, which stops at the first chunk past it
+    for data_type in ["mention", "detail"]:
+        shutil.rmtree(os.path.dirname(make_file_path(data_type, "2024", "")) if storage == "csv" else make_dataset_path("files", type=data_type))
+    assert store.list_files("mention", "2024") == []
+    assert pd.concat(iter_lookahead(store, "mention", 2024, 2, columns, rows=100))["MentionTimeDate"].max() < until
+    pd.testing.assert_frame_equal(collect_in_memory(store, 2024, 1), expected)
+
+@pytest.mark.parametrize("storage", ["csv", "parquet"])
+def test_decoded_quarters_read_and_collect_like_the_store(tmp_path, monkeypatch, storage):
+    store = parse_quarters(tmp_path, monkeypatch, storage)
+    columns = make_collect_columns()
+    collect_data(2024, 1, storage)
+    expected = store.read_collected(2024, 1)
+
+    decoded = DecodedStore(store)
+    for data_type in ["mention", "detail"]:
+        for quarter in [1, 2]:
+            decode_quarter(data_type, 2024, quarter, storage, rows=100)
+            assert decoded.has_decoded(data_type, 2024, quarter)
+            pd.testing.assert_frame_equal(decoded.read_quarter(data_type, 2024, quarter, columns[data_type]), store.read_quarter(data_type, 2024, quarter, columns[data_type]))
+            pd.testing.assert_frame_equal(pd.concat(decoded.iter_quarter(data_type, 2024, quarter, columns[data_type], rows=100), ignore_index=True),
+                                          store.read_quarter(data_type, 2024, quarter, columns[data_type]))
+    # events are read once per collect and are left to the store
+    assert not decoded.has_decoded("event", 2024, 1)
+
+    collect_data(2024, 1, storage, decoded=True)
+    pd.testing.assert_frame_equal(store.read_collected(2024, 1), expected)
+
+    decoded.evict("mention", 2024, 2)
+    assert not os.path.exists(make_decoded_path("mention", 2024, 2))
+    collect_data(2024, 1, storage, decoded=True)
+    pd.testing.assert_frame_equal(store.read_collected(2024, 1), expected)
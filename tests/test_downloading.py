@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+
+import aiohttp
+import pandas as pd
+import pytest
+from aiohttp import ClientResponseError, web
+
+import downloading
+from benchmarking import make_event_lines, make_zip, serve_mirror
+from downloading import AdaptiveLimit, download_all, fetch_to_file
+from executing import ResourceExecutor
+from ledger import Ledger
+
+def test_fetch_writes_and_hashes_off_the_event_loop(tmp_path, monkeypatch):
+    body = os.urandom(5 * 1024 ** 2 + 123)
+    server = serve_mirror({"file.zip": body})
+    threads = []
+    write_chunk = downloading._write_chunk
+
+    def _write_chunk(file, digest, chunk):
+        threads.append(threading.get_ident())
+        write_chunk(file, digest, chunk)
+
+    monkeypatch.setattr(downloading, "_write_chunk", _write_chunk)
+
+    async def fetch():
+        async with aiohttp.ClientSession() as session:
+            return await fetch_to_file(session, f"http://127.0.0.1:{server.server_address[1]}/gdeltv2/file.zip", str(tmp_path / "raw" / "file.zip"))
+
+    try:
+        size, md5 = asyncio.run(fetch())
+    finally:
+        server.shutdown()
+
+    assert (size, md5) == (len(body), hashlib.md5(body).hexdigest())
+    assert (tmp_path / "raw" / "file.zip").read_bytes() == body
+    assert 0 < len(threads) <= 7
+    assert threading.get_ident() not in threads
+
+async def serve(delays: dict[str, float]) -> (web.AppRunner, str, dict[str, int]):
+    served = {"active": 0, "peak": 0}
+
+    async def handle(request):
+        served["active"] += 1
+        served["peak"] = max(served["peak"], served["active"])
+        try:
+            await asyncio.sleep(delays.get(request.match_info["name"], 0.0))
+        finally:
+            served["active"] -= 1
+        if request.match_info["name"] == "busy":
+            raise web.HTTPServiceUnavailable()
+        return web.Response(body=b"x" * 1024)
+
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}", served
+
+async def fetch(session: aiohttp.ClientSession, limit: AdaptiveLimit, url: str) -> None:
+    async with limit.fetching():
+        async with session.get(url) as r:
+            r.raise_for_status()
+            await r.read()
+
+def test_limit_grows_while_latency_holds_and_shrinks_when_it_rises_or_fails():
+    async def run():
+        runner, base, _ = await serve({"fast": 0.02, "slow": 0.2, "busy": 0.0})
+        limit = AdaptiveLimit(4, minimum=2, maximum=8)
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(20):
+                    await fetch(session, limit, f"{base}/fast")
+                grown = limit.limit
+
+                for _ in range(5):
+                    await fetch(session, limit, f"{base}/slow")
+                slowed = limit.limit
+
+                for _ in range(3):
+                    with pytest.raises(ClientResponseError):
+                        await fetch(session, limit, f"{base}/busy")
+        finally:
+            await runner.cleanup()
+        return grown, slowed, limit
+
+    grown, slowed, limit = asyncio.run(run())
+
+    assert 6 < grown <= 8
+    assert slowed <= grown - 2
+    assert limit.limit == 2
+    assert limit.active == 0
+
+def test_limit_caps_the_requests_in_flight():
+    async def run():
+        runner, base, served = await serve({"fast": 0.05})
+        limit = AdaptiveLimit(3, maximum=5)
+        try:
+            async with aiohttp.ClientSession() as session:
+                await asyncio.gather(*[fetch(session, limit, f"{base}/fast") for _ in range(40)])
+        finally:
+            await runner.cleanup()
+        return served, limit
+
+    served, limit = asyncio.run(run())
+
+    assert 3 <= served["peak"] <= 5
+    assert limit.active == 0
+
+def test_failures_are_recorded_retried_and_cleared(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    body = make_zip(make_event_lines(random.Random(0), pd.Timestamp("2024-01-01"), [1, 2, 3]), "file.export.CSV")
+    # each file answers with its statuses in turn and then keeps the last one
+    statuses = {"good": [200], "flaky": [503, 503, 200], "gone": [404], "down": [503], "short": [200]}
+    requests = {name: 0 for name in statuses}
+
+    async def handle(request):
+        name = request.match_info["name"]
+        status = statuses[name][min(requests[name], len(statuses[name]) - 1)]
+        requests[name] += 1
+        return web.Response(body=body, status=status)
+
+    async def run(base: str, executor: ResourceExecutor) -> None:
+        master = pd.DataFrame({
+            "url": [f"{base}/{name}" for name in statuses],
+            "year": "2024",
+            "date": [f"202401010{index}0000" for index in range(len(statuses))],
+            "size": [len(body), len(body), len(body), len(body), len(body) + 1],
+            "md5": hashlib.md5(body).hexdigest(),
+        })
+        await download_all(master, "event", cache=True, max_concurrency=4, executor=executor, retries=2, backoff=0.001)
+
+    async def runs() -> list[dict]:
+        app = web.Application()
+        app.router.add_get("/{name}", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        seen = []
+        try:
+            with ResourceExecutor(workers=1) as executor:
+                for fixed in [None, None, "down"]:
+                    if fixed is not None:
+                        statuses[fixed] = [200]
+                    await run(base, executor)
+                    seen.append(dict(requests))
+        finally:
+            await runner.cleanup()
+        return seen
+
+    first, second, third = asyncio.run(runs())
+
+    assert first == {"good": 1, "flaky": 3, "gone": 1, "down": 3, "short": 3}
+    # valid files and permanent failures are not fetched again, transient ones are
+    assert second == {"good": 1, "flaky": 3, "gone": 1, "down": 6, "short": 6}
+    assert third == {"good": 1, "flaky": 3, "gone": 1, "down": 7, "short": 9}
+    with Ledger() as ledger:
+        assert sorted(ledger.load("csv", "event")) == ["20240101000000", "20240101010000", "20240101030000"]
+        assert [row[2] for row in ledger.load_failures("csv", "event")] == ["20240101040000"]
+        assert [row[2] for row in ledger.load_failures("csv", "event", permanent=True)] == ["20240101020000"]
+        attempts = dict(ledger.connection.execute("SELECT date, attempts FROM failures").fetchall())
+    assert attempts == {"20240101020000": 1, "20240101040000": 9}
@@ -0,0 +1,57 @@
+import asyncio
+
+import executing
+from executing import ResourceExecutor, minimum_estimate
+from scheduling import Resources
+
+def test_default_budget_follows_machine_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(executing, "total_memory", lambda: 8 * 1024 ** 3)
+
+    with ResourceExecutor(workers=1) as executor:
+        assert executor.memory_budget == 6 * 1024 ** 3
+    with ResourceExecutor(memory_budget=2 * 1024 ** 3, workers=1) as executor:
+        assert executor.memory_budget == 2 * 1024 ** 3
+
+def test_estimates_are_bounded_by_minimum_cap_and_budget(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    with ResourceExecutor(memory_budget=1024 ** 3, workers=1) as executor:
+        executor.ratios["parse"] = 10.0
+        assert executor.estimate("parse", 0) == minimum_estimate
+        assert executor.estimate("parse", 20 * 1024 ** 2) == 200 * 1024 ** 2
+        assert executor.estimate("parse", 20 * 1024 ** 2, cap=100 * 1024 ** 2) == 100 * 1024 ** 2
+        assert executor.estimate("parse", 1024 ** 3) == 1024 ** 3
+
+def test_tasks_are_admitted_while_their_memory_fits():
+    async def run() -> int:
+        resources = Resources({"workers": 4, "memory": 100})
+        running, peak = 0, 0
+
+        async def task(memory: int) -> None:
+            nonlocal running, peak
+            granted = await resources.acquire({"workers": 1, "memory": memory})
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            await resources.release(granted)
+
+        # a task larger than the whole budget is clamped and runs alone
+        await asyncio.gather(*[task(40) for _ in range(6)], task(500))
+        assert resources.used == {"workers": 0, "memory": 0}
+        return peak
+
+    assert asyncio.run(run()) == 2
+
+def test_submit_runs_in_a_worker_and_keeps_the_ratios(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    with ResourceExecutor(memory_budget=1024 ** 3, workers=1) as executor:
+        assert asyncio.run(executor.submit("collect", divmod, 7, 2, input_bytes=1)) == (3, 1)
+        assert executor.metrics.stages["collect"]["tasks"] == 1
+        assert executor.resources.used == {"workers": 0, "memory": 0}
+        executor.ratios["collect"] = 3.0
+
+    with ResourceExecutor(workers=1) as executor:
+        assert executor.ratios["collect"] == 3.0
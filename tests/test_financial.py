@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+from benchmarking import generate_financial
+from financial import load_panel, make_financial_path, make_panel, process_financial_files, read_prices
+
+def write_raw(tmp_path) -> dict[str, pd.DataFrame]:
+    financials = generate_financial("2024-01-01", "2024-03-01")
+    # stocks do not trade on weekends, so the tickers have different calendars
+    spx = financials["spx"]
+    financials["spx"] = spx[pd.to_datetime(spx["Date"], format="%m/%d/%Y").dt.dayofweek < 5].reset_index(drop=True)
+    for name, prices in financials.items():
+        path = tmp_path / make_financial_path(name, is_raw=True)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        prices.to_csv(path, index=False)
+    return financials
+
+def per_ticker(prices: pd.DataFrame) -> (pd.Series, MinMaxScaler):
+    # the raw files are newest first, and each ticker used to be scaled on its own
+    close = prices["Price"].str.replace(",", "").astype(float)
+    returns = close.pct_change(periods=-1) * 100
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    scaled = scaler.fit_transform(returns.to_frame())[:, 0]
+    return pd.Series(scaled, index=pd.to_datetime(prices["Date"], format="%m/%d/%Y")).sort_index(), scaler
+
+def test_panel_matches_the_per_ticker_scalers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    financials = write_raw(tmp_path)
+
+    prices = read_prices()
+    long = financials["btc"].assign(Ticker="btc")[["Ticker", "Date", "Price"]]
+    long = pd.concat([financials["spx"].assign(Ticker="spx")[["Ticker", "Date", "Price"]], long])
+    long.to_csv(tmp_path / "long.csv", index=False)
+    pd.testing.assert_frame_equal(read_prices(path=str(tmp_path / "long.csv")).sort_values(["Ticker", "Date"], ignore_index=True),
+                                  prices.sort_values(["Ticker", "Date"], ignore_index=True))
+
+    panel, scalers = make_panel(prices)
+
+    assert panel.columns.tolist() == ["btc", "spx"]
+    assert panel.index.is_monotonic_increasing
+    assert panel.index.equals(pd.DatetimeIndex(sorted(pd.to_datetime(financials["btc"]["Date"], format="%m/%d/%Y")), name="Date"))
+    for name in ["btc", "spx"]:
+        expected, scaler = per_ticker(financials[name])
+        # a weekend has no spx close, and the first day of a ticker has no return
+        column = panel[name].dropna()
+        assert column.index.equals(expected.dropna().index)
+        np.testing.assert_array_equal(column.to_numpy(), expected.dropna().to_numpy())
+        assert scalers[name] == {"data_min": scaler.data_min_[0], "data_max": scaler.data_max_[0]}
+
+    assert process_financial_files() == (len(prices), len(panel))
+    loaded, loaded_scalers = load_panel()
+    pd.testing.assert_frame_equal(loaded, panel, check_freq=False)
+    assert loaded_scalers == scalers
+
+    only, only_scalers = load_panel(["spx"])
+    assert only.columns.tolist() == ["spx"]
+    assert list(only_scalers) == ["spx"]
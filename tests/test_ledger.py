@@ -0,0 +1,94 @@
+import pandas as pd
+
+from ledger import Ledger, backfill, is_valid
+from parsing import output_columns, output_format
+from storing import CsvStore
+
+def write_file(store: CsvStore, date: str, keys: str = "url") -> int:
+    df = pd.DataFrame({"GlobalEventID": [1, 2], "MentionTimeDate": [1704067200, 1704067200], "MentionIdentifier": ["a", "b"]})
+    if keys == "hash":
+        df = df.rename(columns={"MentionIdentifier": "MentionKey"}).assign(MentionKey=[1, 2])
+    store.write_file(df, "mention", "2024", date)
+    return store.file_bytes("mention", "2024", date)
+
+def test_valid_entry_needs_matching_md5_output_size_and_format(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = CsvStore()
+    output_bytes = write_file(store, "20240101000000")
+    url = output_format("mention", "url")
+
+    with Ledger() as ledger:
+        ledger.record("csv", "mention", "20240101000000", "url", 10, "abc", output_bytes, url)
+        entry = ledger.load("csv", "mention")["20240101000000"]
+
+    assert is_valid(entry, store, "mention", "2024", "20240101000000", "abc", url)
+    assert not is_valid(entry, store, "mention", "2024", "20240101000000", "def", url)
+    assert not is_valid(entry, store, "mention", "2024", "20240101000000", "abc", output_format("mention", "hash"))
+    assert not is_valid(None, store, "mention", "2024", "20240101000000", "abc", url)
+    assert not is_valid(entry, store, "mention", "2024", "20240101001500", "abc", url)
+
+    with open("data/files/mention/2024/20240101000000.csv.gz", "r+b") as file:
+        file.truncate(output_bytes - 1)
+    assert not is_valid(entry, store, "mention", "2024", "20240101000000", "abc", url)
+
+def test_only_the_options_that_change_columns_are_part_of_the_format():
+    assert output_format("event", "url") == output_format("event", "hash")
+    assert output_format("mention", "url") != output_format("mention", "hash")
+    assert output_format("detail", "url") != output_format("detail", "url", {"wc": "WordCount"})
+    assert output_columns("mention", "hash") == ["GlobalEventID", "MentionTimeDate", "MentionKey"]
+    assert output_columns("detail", "check", {"wc": "WordCount"}) == ["DocumentIdentifier", "WordCount", "DocumentKey"]
+
+def test_backfill_records_existing_outputs_with_the_columns_of_this_parse(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = CsvStore()
+    output_bytes = write_file(store, "20240101000000")
+    write_file(store, "20240101001500")
+    write_file(store, "20240101003000", keys="hash")
+    open("data/files/mention/2024/20240101004500.csv.gz", "wb").close()
+    hashed = write_file(store, "20240101010000", keys="hash")
+    url = output_format("mention", "url")
+
+    with Ledger() as ledger:
+        ledger.record("csv", "mention", "20240101001500", "url-2", 20, "recorded", 5, url)
+        # a row from before the parse options were recorded
+        ledger.connection.execute("INSERT INTO files VALUES ('csv', 'mention', '20240101010000', 'url-6', 60, 'old', ?, NULL, NULL)", (hashed,))
+        entries = ledger.load("csv", "mention")
+        files = [
+            ("url-1", "2024", "20240101000000", 10, "abc"),
+            ("url-2", "2024", "20240101001500", 20, "def"),
+            ("url-3", "2024", "20240101003000", 30, "ghi"),
+            ("url-4", "2024", "20240101004500", 40, "jkl"),
+            ("url-5", "2024", "20240101005500", 50, "mno"),
+            ("url-6", "2024", "20240101010000", 60, "pqr"),
+        ]
+
+        assert backfill(ledger, entries, store, "csv", "mention", files, url, output_columns("mention", "url")) == 1
+        assert backfill(ledger, entries, store, "csv", "mention", files[5:], output_format("mention", "hash"), output_columns("mention", "hash")) == 1
+        reloaded = ledger.load("csv", "mention")
+
+    # a recorded row and files with other columns, no content or no file at all are left for is_valid to judge
+    assert reloaded == entries
+    assert set(reloaded) == {"20240101000000", "20240101001500", "20240101010000"}
+    assert reloaded["20240101000000"] == (10, "abc", output_bytes, "url", "")
+    assert reloaded["20240101001500"] == (20, "recorded", 5, "url", "")
+    assert reloaded["20240101010000"] == (60, "old", hashed, "hash", "")
+    assert is_valid(reloaded["20240101000000"], store, "mention", "2024", "20240101000000", "abc", url)
+
+def test_load_only_the_requested_dates(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dates = [f"2024010{day}000000" for day in range(1, 10)] + [f"202401{day}000000" for day in range(10, 32)]
+
+    with Ledger() as ledger:
+        ledger.record_many("csv", "mention", [(date, f"url{date}", 10, "abc", 20, "url", "") for date in dates])
+        ledger.record_many("csv", "event", [(dates[0], "url", 10, "abc", 20, "", "")])
+        for date in reversed(dates):
+            ledger.record_failure("csv", "detail", "2024", date, f"url{date}", 10, "abc", "timeout", "", permanent=False)
+
+        # more dates than one lookup takes, with some of them missing
+        wanted = dates[::3] + [f"2023{index:010d}" for index in range(1200)]
+        assert ledger.load("csv", "mention", wanted) == {date: (10, "abc", 20, "url", "") for date in dates[::3]}
+        assert ledger.load("csv", "mention", []) == {}
+        assert list(ledger.load("csv", "event", dates)) == [dates[0]]
+        assert len(ledger.load("csv", "mention")) == len(dates)
+        assert [row[2] for row in ledger.load_failures("csv", "detail", dates=wanted)] == dates[::3]
+        assert [row[2] for row in ledger.load_failures("csv", "detail")] == dates
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from aggregating import make_feature_frame, seconds_per_day, window_features
+from benchmarking import generate_files
+from collecting import collect_data, make_collect_columns
+from ledger import Ledger
+from live import LiveAggregator
+from manifest import data_types
+from parsing import output_format, parse_csv
+from quarterizing import join_files
+from storing import CsvStore
+
+windows = [1, 2, 3]
+# the mentions of an event count for it up to a week later, so the last day is read well after the first events
+start, end = "2024-01-01", "2024-01-10"
+day = pd.Timestamp("2024-01-09").value // 10 ** 9
+
+def parse_slices(tmp_path) -> (CsvStore, list[tuple[str, str, int]]):
+    files = generate_files(start, end, "6h", events=30, mentions=90, details=45)
+    slices = []
+    with Ledger() as ledger:
+        for name, body in sorted(files.items(), key=lambda item: (item[0].split(".")[0], list(data_types).index(item[0].split(".")[1]))):
+            date, masterlist_type = name.split(".")[:2]
+            path = tmp_path / name
+            path.write_bytes(body)
+            parse_csv(str(path), data_types[masterlist_type], date[:4], date)
+            ledger.record("csv", data_types[masterlist_type], date, name, len(body), None, CsvStore().file_bytes(data_types[masterlist_type], date[:4], date), output_format(data_types[masterlist_type]))
+            slices.append((date, data_types[masterlist_type], int(pd.Timestamp(date).value // 10 ** 9)))
+    return CsvStore(), slices
+
+def batch_features(store: CsvStore) -> dict[int, np.ndarray]:
+    for data_type in ["event", "mention", "detail"]:
+        join_files(store.list_files(data_type, "2024"), data_type, 2024, 1)
+    collect_data(2024, 1)
+    events = store.read_collected(2024, 1)
+    events["Timestamp"] = events["Time"].to_numpy().astype("datetime64[D]").astype("datetime64[s]").astype(np.int64)
+    return {window: make_feature_frame(features, np.array([day])).to_numpy(np.float64) for window, features in window_features(events, np.array([day]), windows).items()}
+
+def live_features(state: LiveAggregator) -> dict[int, np.ndarray]:
+    return {window: frame.to_numpy(np.float64) for window, frame in state.features(day).items()}
+
+def test_live_state_matches_the_batch_aggregate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store, slices = parse_slices(tmp_path)
+    columns = make_collect_columns()
+
+    # slices are fed and pruned one by one, like the live loop does
+    state = LiveAggregator(windows)
+    for date, data_type, now in slices:
+        df = store.read_files(data_type, date[:4], [date], columns[data_type])
+        if data_type == "event":
+            state.add_events(df)
+        elif data_type == "mention":
+            state.add_mentions(df, now)
+        else:
+            state.add_details(df, now)
+        state.prune(now)
+    followed = live_features(state)
+
+    assert min(state.days) > day - max(windows) * seconds_per_day
+    assert (state.events["day"] >= day - 7 * seconds_per_day).all()
+
+    # a restarted run reads the files of the earlier one back from the ledger
+    replayed = LiveAggregator(windows)
+    assert replayed.replay(store, columns) > 0
+    replayed_features = live_features(replayed)
+
+    batch = batch_features(store)
+    # once collected, a restarted run starts from the quarter instead
+    seeded = LiveAggregator(windows)
+    assert seeded.seed(store, day + seconds_per_day - 1) > 0
+    seeded_features = live_features(seeded)
+
+    for window in windows:
+        np.testing.assert_allclose(followed[window], batch[window], rtol=1e-12)
+        np.testing.assert_allclose(replayed_features[window], batch[window], rtol=1e-12)
+        np.testing.assert_allclose(seeded_features[window], batch[window], rtol=1e-12)
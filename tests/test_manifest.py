@@ -0,0 +1,116 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregating import aggregate, make_scaler_path, mention_columns
+from benchmarking import generate_financial
+from financial import make_financial_path, process_financial_files
+from ledger import Ledger
+from manifest import (affected_quarters, collect_quarters, diff_masterlist, group_quarters, load_manifest, load_offset, load_pending,
+                      record_processed, save_offset)
+from matrix import load_matrix
+from parsing import output_format
+from storing import CsvStore, make_store
+
+def make_rows(names: list[tuple[str, str]]) -> pd.DataFrame:
+    return pd.DataFrame({
+        "url": [f"http://data.gdeltproject.org/gdeltv2/{date}.{t}.zip" for t, date in names],
+        "type": [t for t, _ in names],
+        "year": [date[:4] for _, date in names],
+        "date": [date for _, date in names],
+        "size": "10",
+        "md5": "abc",
+    })
+
+def test_new_files_are_diffed_recorded_and_mapped_to_quarters(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = CsvStore()
+    rows = make_rows([("export", "20240101000000"), ("mentions", "20240101000000"), ("gkg", "20240401000000"), ("translation", "20240101000000")])
+
+    new_files = diff_masterlist(pd.concat([rows, rows.iloc[:1]]), load_manifest())
+    assert new_files["date"].tolist() == ["20240101000000", "20240101000000", "20240401000000"]
+
+    # the event and the mention file are parsed and in the ledger, the detail file never arrived
+    store.write_file(pd.DataFrame({"GlobalEventID": [1], "Day": [19723]}), "event", "2024", "20240101000000")
+    store.write_file(pd.DataFrame({"GlobalEventID": [1], "MentionTime": [1704067200], "MentionIdentifier": ["a"]}), "mention", "2024", "20240101000000")
+    with Ledger() as ledger:
+        for data_type in ["event", "mention"]:
+            ledger.record("csv", data_type, "20240101000000", "url", 10, "abc", store.file_bytes(data_type, "2024", "20240101000000"), output_format(data_type))
+
+    processed = record_processed(new_files)
+
+    assert processed["type"].tolist() == ["export", "mentions"]
+    assert load_manifest()["url"].tolist() == processed["url"].tolist()
+    assert load_pending()["type"].tolist() == ["gkg"]
+    assert len(diff_masterlist(pd.concat([load_pending(), rows]), load_manifest())) == 1
+
+    affected = affected_quarters(processed)
+    assert affected == {"event": {(2024, 1)}, "mention": {(2024, 1)}, "detail": set()}
+    # the quarter before a new mention quarter reads it for its lookahead
+    assert collect_quarters(affected) == {(2024, 1), (2023, 4)}
+    assert group_quarters({(2024, 1), (2023, 4), (2024, 2)}) == [([4], 2023), ([1, 2], 2024)]
+
+    assert load_offset() == 0
+    save_offset(1234)
+    assert load_offset() == 1234
+
+def make_collected(days: pd.DatetimeIndex) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    rows = len(days) * 40
+    return pd.DataFrame({
+        "GlobalEventID": np.arange(rows),
+        "Time": np.repeat(days.to_numpy(), 40),
+        "EventBaseCode": rng.integers(1, 21, rows),
+        "QuadClass": 1,
+        "GoldsteinScale": rng.integers(-100, 101, rows) / 10,
+        "ActionGeo_CountryCode": "US",
+        "MentionsCount": rng.integers(2, 50, rows),
+        "WordCount": rng.integers(0, 2000, rows),
+        "Negative": rng.integers(0, 50, rows),
+        "Positive": rng.integers(0, 50, rows),
+        "Finance": rng.integers(0, 20, rows),
+    })
+
+def run(root, storage: str, events: pd.DataFrame, ends: list[pd.Timestamp]) -> list[pd.DataFrame]:
+    os.makedirs(root)
+    os.chdir(root)
+    for name, prices in generate_financial("2024-01-01", "2024-06-01").items():
+        os.makedirs(os.path.dirname(make_financial_path(name, is_raw=True)), exist_ok=True)
+        prices.to_csv(make_financial_path(name, is_raw=True), index=False)
+    process_financial_files(["spx", "btc"])
+
+    store = make_store(storage)
+    for index, end in enumerate(ends):
+        collected = events[events["Time"] <= end].copy()
+        # mentions of the last days keep arriving after a run, so an earlier run saw fewer of them
+        if index < len(ends) - 1:
+            collected.loc[collected["Time"] >= end - pd.Timedelta(days=3), "MentionsCount"] //= 2
+        for (year, quarter), quarter_events in collected.groupby([collected["Time"].dt.year, collected["Time"].dt.quarter]):
+            store.write_collected(quarter_events.reset_index(drop=True), year, quarter)
+        aggregate(["spx", "btc"], [1, 5], storage, append=index > 0)
+
+    frames = []
+    for window in [1, 5]:
+        df = store.read_aggregated(window)
+        # appended mention counts are scaled by the first run's scaler, so they are compared unscaled
+        df[mention_columns] = joblib.load(make_scaler_path(window)).inverse_transform(df[mention_columns])
+        matrix, schema = load_matrix(window)
+        assert schema["rows"] == len(df)
+        frames.append(df)
+    return frames
+
+@pytest.mark.parametrize("storage", ["csv", "parquet"])
+def test_appended_aggregate_matches_a_full_run(tmp_path, monkeypatch, storage):
+    monkeypatch.chdir(tmp_path)
+    days = pd.date_range("2024-01-01", "2024-04-20")
+    events = make_collected(days)
+
+    appended = run(tmp_path / "appended", storage, events, [pd.Timestamp("2024-02-10"), days[-1]])
+    full = run(tmp_path / "full", storage, events, [days[-1]])
+
+    for appended_df, full_df in zip(appended, full):
+        assert len(appended_df) == len(days) - 14
+        pd.testing.assert_frame_equal(appended_df, full_df, check_dtype=False, rtol=1e-9)
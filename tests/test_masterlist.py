@@ -0,0 +1,55 @@
+import pandas as pd
+
+import masterlist
+from benchmarking import serve_mirror
+from masterlist import download_masterlist_tail, index_masterlist, query_masterlist, quarters_between
+
+def make_masterlist(names: list[str]) -> pd.DataFrame:
+    return pd.DataFrame({"size": [str(100 + index) for index in range(len(names))], "md5": [f"md5{index}" for index in range(len(names))], "url": [f"http://data.gdeltproject.org/gdeltv2/{name}" for name in names]})
+
+def test_index_parses_sorts_and_selects_by_type_and_range():
+    index = index_masterlist(make_masterlist([
+        "20240101001500.mentions.CSV.zip",
+        "20231231234500.export.CSV.zip",
+        "20240101000000.gkg.csv.zip",
+        "20240101000000.export.CSV.zip",
+        "masterfilelist.txt",
+        "20240401000000.export.CSV.zip",
+    ]))
+
+    assert index["date"].tolist() == [20231231234500, 20240101000000, 20240101000000, 20240101001500, 20240401000000]
+    assert index["type"].astype(str).tolist() == ["export", "gkg", "export", "mentions", "export"]
+    assert index["year"].tolist() == [2023, 2024, 2024, 2024, 2024]
+    assert index["timestamp"].tolist() == [pd.Timestamp(str(date)).value // 10 ** 9 for date in index["date"]]
+    assert index["size"].tolist() == [101, 102, 103, 100, 105]
+    assert index["md5"].tolist() == ["md51", "md52", "md53", "md50", "md55"]
+
+    # the range is closed at the start and open at the end
+    assert query_masterlist(index, "export", "2024-01-01", "2024-04-01")["date"].tolist() == [20240101000000]
+    assert query_masterlist(index, start="2024-01-01")["date"].tolist() == [20240101000000, 20240101000000, 20240101001500, 20240401000000]
+    assert query_masterlist(index, end=pd.Timestamp("2024-01-01"))["date"].tolist() == [20231231234500]
+    assert len(query_masterlist(index, "mentions", "2024-02-01", "2024-03-01")) == 0
+
+def test_quarters_between_groups_quarters_by_year():
+    assert quarters_between("2023-11-15", "2024-04-01") == [([4], 2023), ([1], 2024)]
+    assert quarters_between("2024-01-01", "2025-01-02") == [([1, 2, 3, 4], 2024), ([1], 2025)]
+
+def test_tail_reads_past_the_offset_up_to_the_last_complete_line(monkeypatch):
+    server = serve_mirror({f"2024010100{minute:02d}00.export.CSV.zip": b"x" for minute in [0, 15]})
+    monkeypatch.setattr(masterlist, "masterlist_url", f"http://127.0.0.1:{server.server_address[1]}/gdeltv2/masterfilelist.txt")
+    try:
+        first, offset = download_masterlist_tail(0)
+        assert offset == len(server.mirror["masterfilelist.txt"])
+        assert len(first) == 2
+
+        # the mirror ignores the range and sends the whole list, and a line still being written is left for the next read
+        complete = "1 abc http://127.0.0.1/gdeltv2/20240101003000.export.CSV.zip\n".encode()
+        server.mirror["masterfilelist.txt"] += complete + b"2 def http://127.0.0.1/gdeltv2/2024"
+        tail, tail_offset = download_masterlist_tail(offset)
+        assert tail["url"].tolist() == ["http://127.0.0.1/gdeltv2/20240101003000.export.CSV.zip"]
+        assert tail_offset == offset + len(complete)
+
+        assert len(download_masterlist_tail(tail_offset)[0]) == 0
+        assert download_masterlist_tail(tail_offset)[1] == tail_offset
+    finally:
+        server.shutdown()
@@ -0,0 +1,110 @@
+import mmap
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregating import aggregate
+from benchmarking import generate_financial
+from financial import make_financial_path, process_financial_files
+from matrix import append_matrix, iter_windows, load_matrix, make_matrix_path, matrix_timestamps, write_matrix
+from storing import CsvStore
+
+def test_append_replaces_rows_past_keep(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_matrix(pd.DataFrame({"a": [1.0, 2.0, 3.0], "b": [4.0, 5.0, 6.0]}), 1, 0)
+
+    append_matrix(pd.DataFrame({"a": [30.0, 40.0], "b": [60.0, 70.0]}), 1, keep=2)
+
+    matrix, schema = load_matrix(1)
+    assert schema["rows"] == 4
+    np.testing.assert_array_equal(matrix, [[1.0, 4.0], [2.0, 5.0], [30.0, 60.0], [40.0, 70.0]])
+
+def test_csv_append_replaces_rows_past_keep(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = CsvStore()
+    store.write_aggregated(pd.DataFrame({"a": [1.5, 2.5, 3.5]}), 1)
+
+    store.append_aggregated(pd.DataFrame({"a": [30.5, 40.5]}), 1, keep=2)
+
+    assert store.read_aggregated(1)["a"].tolist() == [1.5, 2.5, 30.5, 40.5]
+
+def test_windows_are_views_paired_with_the_targets_after_them(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    df = pd.DataFrame({"a": np.arange(20.0), "spx": np.arange(20.0) * 10, "btc": np.arange(20.0) * 100})
+    write_matrix(df, 3, 1704067200, ["spx", "btc"])
+
+    matrix, schema = load_matrix(3)
+    assert schema["columns"] == ["a", "spx", "btc"]
+    assert schema["targets"] == ["spx", "btc"]
+    assert matrix_timestamps(schema).tolist() == [1704067200 + day * 86400 for day in range(20)]
+
+    batches = list(iter_windows(3, lookback=4, horizon=2, batch_size=5))
+    assert [len(windows) for windows, _ in batches] == [5, 5, 5]
+    windows = np.concatenate([windows for windows, _ in batches])
+    targets = np.concatenate([targets for _, targets in batches])
+    np.testing.assert_array_equal(windows, [df.to_numpy()[first:first + 4] for first in range(15)])
+    np.testing.assert_array_equal(targets, df[["spx", "btc"]].to_numpy()[5:20])
+    # the windows are strided views on the memory map, not copies
+    base = batches[0][0]
+    while base.base is not None and not isinstance(base.base, mmap.mmap):
+        base = base.base
+    assert isinstance(base.base, mmap.mmap)
+
+    ((_, only),) = iter_windows(3, lookback=4, targets=["a"], batch_size=100)
+    np.testing.assert_array_equal(only[:, 0], np.arange(4.0, 20.0))
+
+    shuffled = list(iter_windows(3, lookback=4, horizon=2, batch_size=5, shuffle=True, seed=1))
+    assert sorted(targets[0, 0] for _, targets in shuffled) == [targets[0, 0] for _, targets in batches]
+    assert [targets[0, 0] for _, targets in shuffled] == [targets[0, 0] for _, targets in iter_windows(3, lookback=4, horizon=2, batch_size=5, shuffle=True, seed=1)]
+
+    assert list(iter_windows(3, lookback=19, horizon=2)) == []
+
+def test_append_ignores_bytes_of_an_interrupted_append(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_matrix(pd.DataFrame({"a": [1.0, 2.0]}), 1, 0)
+    with open(make_matrix_path(1), "ab") as file:
+        file.write(np.array([99.0]).tobytes()[:5])
+
+    append_matrix(pd.DataFrame({"a": [3.0]}), 1)
+
+    np.testing.assert_array_equal(load_matrix(1)[0], [[1.0], [2.0], [3.0]])
+    with pytest.raises(ValueError, match="Columns do not match"):
+        append_matrix(pd.DataFrame({"b": [4.0]}), 1)
+
+def test_aggregate_writes_the_matrix_of_its_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name, prices in generate_financial("2024-01-01", "2024-03-01").items():
+        os.makedirs(os.path.dirname(make_financial_path(name, is_raw=True)), exist_ok=True)
+        prices.to_csv(make_financial_path(name, is_raw=True), index=False)
+    process_financial_files(["spx", "btc"])
+
+    rng = np.random.default_rng(0)
+    days = pd.date_range("2024-01-01", "2024-02-20")
+    rows = len(days) * 20
+    CsvStore().write_collected(pd.DataFrame({
+        "GlobalEventID": np.arange(rows),
+        "Time": np.repeat(days.to_numpy(), 20),
+        "EventBaseCode": rng.integers(1, 21, rows),
+        "QuadClass": 1,
+        "GoldsteinScale": rng.integers(-100, 101, rows) / 10,
+        "ActionGeo_CountryCode": "US",
+        "MentionsCount": rng.integers(2, 50, rows),
+        "WordCount": rng.integers(0, 2000, rows),
+        "Negative": rng.integers(0, 50, rows),
+        "Positive": rng.integers(0, 50, rows),
+        "Finance": rng.integers(0, 20, rows),
+    }), 2024, 1)
+
+    aggregate(["spx", "btc"], [1, 5])
+
+    for window in [1, 5]:
+        df = CsvStore().read_aggregated(window)
+        matrix, schema = load_matrix(window)
+        assert schema["columns"] == df.columns.tolist()
+        assert schema["targets"] == ["spx", "btc"]
+        np.testing.assert_array_equal(np.asarray(matrix), df.to_numpy(np.float64))
+        # the first two weeks only warm up the windows, so the rows start after them
+        assert matrix_timestamps(schema)[0] == pd.Timestamp("2024-01-15").value // 10 ** 9
+        assert len(df) == len(days) - 14
@@ -0,0 +1,49 @@
+import asyncio
+import json
+import os
+
+from executing import ResourceExecutor
+from metrics import Metrics
+
+def test_counters_add_up_and_peaks_keep_the_maximum(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metrics = Metrics()
+    metrics.add("parse", start=100.0, end=104.0, files=2, bytes_in=400, peak_task_memory=30)
+    metrics.add("parse", start=102.0, end=110.0, files=3, bytes_in=800, peak_task_memory=20, rows_out=None)
+    metrics.add("download", start=101.0, end=101.0, files=1)
+    metrics.worker(7, 100)
+    metrics.worker(7, 50)
+    metrics.worker(3, 80)
+
+    report = metrics.report(mode="quarterize", storage="csv")
+
+    assert report["mode"] == "quarterize" and report["storage"] == "csv"
+    # the wall time of a stage spans its first start to its last end, so overlapping tasks are not counted twice
+    assert report["stages"]["parse"] == {"wall_seconds": 10.0, "files": 5, "bytes_in": 1200, "peak_task_memory": 30, "files_per_second": 0.5, "bytes_per_second": 120.0}
+    assert report["stages"]["download"] == {"wall_seconds": 0.0, "files": 1}
+    assert report["workers"] == {"3": {"peak_rss": 80}, "7": {"peak_rss": 100}}
+
+    path = metrics.save(mode="quarterize")
+    assert os.path.dirname(path) == "data/reports"
+    with open(path) as file:
+        saved = json.load(file)
+    assert saved["stages"] == json.loads(json.dumps(report["stages"]))
+    assert not os.path.exists(path + ".tmp")
+
+def test_executor_records_every_task_it_runs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metrics = Metrics()
+
+    async def run() -> list:
+        with ResourceExecutor(memory_budget=1024 ** 3, workers=1, metrics=metrics) as executor:
+            # a task returning two numbers reports them as its rows in and out
+            return await asyncio.gather(*[executor.submit("quarterize", divmod, 7, 2, input_bytes=100) for _ in range(3)])
+
+    assert asyncio.run(run()) == [(3, 1)] * 3
+
+    stage = metrics.report()["stages"]["quarterize"]
+    assert stage["tasks"] == 3
+    assert stage["bytes_in"] == 300
+    assert (stage["rows_in"], stage["rows_out"]) == (9, 3)
+    assert len(metrics.workers) == 1
+    assert list(metrics.workers.values())[0] > 0
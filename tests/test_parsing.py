@@ -0,0 +1,44 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from parsing import extract_gcam_arrays, gcam_dimensions, mentions_cols, read_pandas, read_pyarrow
+
+def write_mentions(path, rows: list[tuple[int, int, bytes]]) -> None:
+    lines = []
+    for event_id, time, url in rows:
+        fields = [str(event_id).encode(), b"20240101", str(time).encode(), b"1", b"source", url, *[b""] * (len(mentions_cols) - 6)]
+        lines.append(b"\t".join(fields))
+    with gzip.open(path, "wb") as file:
+        file.write(b"\n".join(lines) + b"\n")
+
+def test_invalid_byte_only_replaces_its_own_value(tmp_path):
+    path = tmp_path / "20240101000000.mentions.CSV.gz"
+    write_mentions(path, [
+        (1, 20240101000000, "https://example.com/café".encode()),
+        (2, 20240101001500, b"https://example.com/bad\xff"),
+        (3, 20240101003000, "https://example.com/日本".encode()),
+    ])
+
+    df = read_pyarrow(str(path), "mention")
+
+    assert df["MentionIdentifier"].tolist() == ["https://example.com/café", "https://example.com/bad�", "https://example.com/日本"]
+    expected = read_pandas(str(path), "mention")[df.columns]
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+def test_gcam_codes_are_pivoted_from_one_split():
+    values = pa.chunked_array([
+        pa.array(["wc:120,c3.1:4,c3.2:7,c4.16:2", "c4.16:3,wc:9,v1.1:0.25", None], pa.large_string()),
+        pa.array(["", "c3.1:,c3.1:7,c3.1:8", "c13.1:5,xc3.1:6,c3.2:5x", "wc,c3.2:1:2,c4.16:x"], pa.large_string()),
+    ])
+
+    columns = extract_gcam_arrays(values, gcam_dimensions)
+
+    assert list(columns) == list(gcam_dimensions.values())
+    np.testing.assert_array_equal(columns["WordCount"], [120, 9, 0, 0, 0, 0, 0])
+    np.testing.assert_array_equal(columns["Negative"], [4, 0, 0, 0, 7, 0, 0])
+    np.testing.assert_array_equal(columns["Positive"], [7, 0, 0, 0, 0, 5, 1])
+    np.testing.assert_array_equal(columns["Finance"], [2, 3, 0, 0, 0, 0, 0])
+    assert all(len(column) == 0 for column in extract_gcam_arrays(pa.array([], pa.large_string())).values())
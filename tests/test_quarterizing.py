@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from benchmarking import generate_files
+from manifest import data_types
+from parsing import parse_csv
+from quarterizing import batch_bytes, clean_events, join_files
+from schema import apply_schema
+from storing import make_store
+
+@pytest.mark.parametrize("storage", ["csv", "parquet"])
+def test_quarter_is_joined_batch_by_batch_like_one_concat(tmp_path, monkeypatch, storage):
+    monkeypatch.chdir(tmp_path)
+    for name, body in generate_files("2024-01-01", "2024-01-03", "3h", events=30, mentions=90, details=45).items():
+        date, masterlist_type = name.split(".")[:2]
+        (tmp_path / name).write_bytes(body)
+        parse_csv(str(tmp_path / name), data_types[masterlist_type], date[:4], date, storage=storage)
+    store = make_store(storage)
+
+    # every read of the join is recorded, so a batch larger than asked for shows up
+    read_files = type(store).read_files
+    reads = []
+
+    def record(self, data_type, year, dates, columns=None):
+        reads.append(len(dates))
+        return read_files(self, data_type, year, dates, columns)
+
+    monkeypatch.setattr(type(store), "read_files", record)
+
+    for data_type in ["event", "mention", "detail"]:
+        dates = store.list_files(data_type, "2024")
+        expected = read_files(store, data_type, "2024", dates)
+        rows_in = len(expected)
+        if data_type == "event":
+            expected = clean_events(expected)
+        expected = apply_schema(expected, "quarter").reset_index(drop=True)
+
+        reads.clear()
+        assert join_files(dates, data_type, 2024, 1, storage, files_per_batch=5) == (rows_in, len(expected))
+        assert reads == [5, 5, 5, 1]
+        assert batch_bytes(store, dates, data_type, 2024, files_per_batch=5) == max(sum(store.file_bytes(data_type, "2024", date) for date in dates[start:start + 5]) for start in [0, 5, 10, 15])
+
+        pd.testing.assert_frame_equal(store.read_quarter(data_type, 2024, 1), expected)
+        pd.testing.assert_frame_equal(pd.concat(store.iter_quarter(data_type, 2024, 1, rows=100), ignore_index=True), expected)
+
+    assert join_files([], "event", 2024, 2, storage) == (0, 0)
+    assert not store.has_quarter("event", 2024, 2)
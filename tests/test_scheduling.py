@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from scheduling import Scheduler
+
+def test_tasks_start_after_their_dependencies_and_within_resource_limits():
+    scheduler = Scheduler({"network": 2})
+    started, finished = [], []
+    active = {"network": 0, "peak": 0}
+
+    def task(name: str, network: bool = False):
+        async def run():
+            started.append(name)
+            if network:
+                active["network"] += 1
+                active["peak"] = max(active["peak"], active["network"])
+            await asyncio.sleep(0.01)
+            if network:
+                active["network"] -= 1
+            finished.append(name)
+        return run
+
+    for index in range(5):
+        scheduler.add(f"download {index}", task(f"download {index}", network=True), needs={"network": 1}, stage="Downloading")
+    scheduler.add("quarterize", task("quarterize"), after=[f"download {index}" for index in range(5)], stage="Quarterizing")
+    scheduler.add("collect", task("collect"), after=["quarterize"])
+    scheduler.add("financial", task("financial"))
+    # an estimate is taken when the task is ready, so it can read what earlier tasks produced
+    scheduler.add("aggregate", task("aggregate"), after=["collect", "financial"], needs={"network": lambda: len(finished)})
+
+    asyncio.run(scheduler.run())
+
+    assert sorted(finished) == sorted(scheduler.nodes)
+    assert all(finished.index(f"download {index}") < started.index("quarterize") for index in range(5))
+    assert finished.index("quarterize") < started.index("collect")
+    assert started[-1] == "aggregate"
+    assert active["peak"] == 2
+    assert scheduler.progress.tasks[scheduler.stages["Downloading"]].completed == 5
+
+def test_invalid_graphs_are_rejected_before_anything_runs():
+    ran = []
+
+    async def run():
+        ran.append(True)
+
+    scheduler = Scheduler({"network": 1})
+    scheduler.add("download", run)
+    with pytest.raises(ValueError, match="already scheduled"):
+        scheduler.add("download", run)
+
+    for nodes, message in [
+        ([("a", ["missing"], {})], "unknown tasks"),
+        ([("a", [], {"disk": 1})], "unknown resources"),
+        ([("a", ["c"], {}), ("b", ["a"], {}), ("c", ["b"], {}), ("d", [], {})], "depend on each other"),
+    ]:
+        scheduler = Scheduler({"network": 1})
+        for name, after, needs in nodes:
+            scheduler.add(name, run, after=after, needs=needs)
+        with pytest.raises(ValueError, match=message):
+            asyncio.run(scheduler.run())
+
+    assert ran == []
@@ -0,0 +1,69 @@
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from collecting import collect_data
+from parsing import details_cols, event_cols, mentions_cols, parse_csv
+from quarterizing import join_files
+from schema import from_stored, to_epoch, to_stored
+from storing import make_file_path, make_store
+
+def test_to_epoch_matches_parsed_dates():
+    days = np.array([20240101, 20240229, 19991231])
+    times = np.array([20240101001500, 20231231235959])
+
+    np.testing.assert_array_equal(to_epoch(days, 8), pd.to_datetime(days.astype(str), format="%Y%m%d").asi8 // 10 ** 9)
+    np.testing.assert_array_equal(to_epoch(times, 14), pd.to_datetime(times.astype(str), format="%Y%m%d%H%M%S").asi8 // 10 ** 9)
+
+def test_stored_names_say_which_form_a_file_holds():
+    seconds = pd.DataFrame({"SQLDATE": [45792000], "MentionTimeDate": [45835200]})
+    gdelt = pd.DataFrame({"SQLDATE": [19710615], "MentionTimeDate": [19710615120000]})
+
+    # epoch seconds that look like GDELT numbers are read back as they were written
+    pd.testing.assert_frame_equal(from_stored(to_stored(seconds)), seconds)
+    pd.testing.assert_frame_equal(from_stored(gdelt), seconds)
+
+def write_raw(path, columns: list[str], rows: list[dict[str, str]]) -> None:
+    with gzip.open(path, "wt") as file:
+        for row in rows:
+            file.write("\t".join(row.get(column, "") for column in columns) + "\n")
+
+@pytest.mark.parametrize("storage", ["csv", "parquet"])
+def test_early_event_day_survives_every_stage(tmp_path, monkeypatch, storage):
+    # 1971 days are epoch seconds between 10 ** 7 and 10 ** 8, which read like yyyymmdd numbers
+    monkeypatch.chdir(tmp_path)
+    date = "19710615000000"
+    write_raw(tmp_path / "export.gz", event_cols, [{"GlobalEventID": "1", "SQLDATE": "19710615", "EventBaseCode": "042", "QuadClass": "1", "GoldsteinScale": "1.9", "ActionGeo_CountryCode": "US"}])
+    write_raw(tmp_path / "mentions.gz", mentions_cols, [{"GlobalEventID": "1", "MentionTimeDate": "19710615120000", "MentionIdentifier": "https://example.com/a"}])
+    write_raw(tmp_path / "gkg.gz", details_cols, [{"DocumentIdentifier": "https://example.com/a", "GCAM": "wc:100,c3.1:2,c3.2:3,c4.16:4"}])
+
+    for data_type, name in [("event", "export.gz"), ("mention", "mentions.gz"), ("detail", "gkg.gz")]:
+        parse_csv(str(tmp_path / name), data_type, "1971", date, storage=storage)
+        join_files([date], data_type, 1971, 2, storage)
+    collect_data(1971, 2, storage)
+
+    collected = make_store(storage).read_collected(1971, 2)
+    assert collected["Time"].tolist() == [pd.Timestamp("1971-06-15")]
+    assert collected[["MentionsCount", "WordCount", "Negative", "Positive", "Finance"]].values.tolist() == [[1, 100, 2, 3, 4]]
+
+@pytest.mark.parametrize("storage", ["csv", "parquet"])
+def test_files_of_both_forms_are_read_together(tmp_path, monkeypatch, storage):
+    monkeypatch.chdir(tmp_path)
+    store = make_store(storage)
+    store.write_file(pd.DataFrame({"GlobalEventID": [1], "SQLDATE": [45792000]}), "event", "1971", "19710615000000")
+    # a file from before the seconds had their own column name
+    path = make_file_path("event", "1971", "19710616000000") if storage == "csv" else store._file_path("event", "1971", "19710616000000")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if storage == "csv":
+        pd.DataFrame({"GlobalEventID": [2], "SQLDATE": [19710616]}).to_csv(path, index=False, compression="gzip")
+    else:
+        pq.write_table(pa.table({"GlobalEventID": [2], "SQLDATE": [19710616]}), path)
+
+    df = store.read_files("event", "1971", ["19710615000000", "19710616000000"], ["GlobalEventID", "SQLDATE"])
+
+    assert df["SQLDATE"].tolist() == [45792000, 45878400]